@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Adapter-only checkpoints written on a background thread
+
+AsyncCheckpointTrainer replaces Trainer's synchronous checkpoint save.
+At each save step it copies the LoRA adapter tensors (and, with
+save_optimizer=True, the optimizer state) to CPU memory and hands the
+copies to a writer thread, so training continues while they are
+serialized. The scheduler, gradient scaler, RNG and trainer state are
+small and always included, so a resumed run continues the adapter, the
+learning-rate schedule and the batch order (see
+checkpoints.latest_checkpoint). Without save_optimizer the AdamW moments
+restart from zero; with it the resume is exact, like Trainer's own.
+
+The writer fills tmp-checkpoint-N, seals it with a manifest and renames it
+to checkpoint-N, so readers never see a partial checkpoint. At most one
+write is in flight: a save that arrives while the previous one is still
+being written waits for it, bounding the memory held by snapshots.
+
+Usage:
+    trainer = AsyncCheckpointTrainer(..., save_optimizer=False)
+    python async_checkpoint.py --check-resume    # interrupted vs uninterrupted run on a tiny model
+"""
+
+import argparse
+import copy
+import functools
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import torch
+from peft import PeftModel, get_peft_model_state_dict
+from safetensors.torch import save_file
+from transformers import TrainerCallback, TrainingArguments
+from transformers.trainer import OPTIMIZER_NAME, SCHEDULER_NAME
+from transformers.trainer_callback import ExportableState
+from transformers.trainer_utils import PREFIX_CHECKPOINT_DIR, rotate_checkpoints
+
+from batching import BatchingTrainer
+from checkpoints import latest_checkpoint, write_manifest
+
+ADAPTER_WEIGHTS_NAME = "adapter_model.safetensors"
+WRITER_NICE = 10
+TMP_PREFIX = "tmp-"  # outside Trainer's checkpoint-* glob, so never rotated or resumed from
+
+
+def cpu_copy(obj):
+    """Deep copy of a (nested) state dict with every tensor copied to CPU"""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: cpu_copy(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(cpu_copy(v) for v in obj)
+    return copy.deepcopy(obj)
+
+
+class AsyncCheckpointWriter:
+    """Write checkpoint directories on a background thread, one at a time"""
+
+    def __init__(self):
+        self._thread = None
+        self._error = None
+        self.pending = None  # checkpoint directory being written
+        self.write_seconds = []
+
+    def submit(self, checkpoint_dir, files, after=None):
+        """Write files ({name: callable(path)}) into checkpoint_dir, then call after()"""
+        self.wait()
+        self.pending = checkpoint_dir
+        self._thread = threading.Thread(target=self._write, args=(checkpoint_dir, files, after),
+                                        name="checkpoint-writer")
+        self._thread.start()
+
+    def _write(self, checkpoint_dir, files, after):
+        start = time.perf_counter()
+        try:
+            if hasattr(os, "setpriority") and sys.platform.startswith("linux"):
+                # Linux applies nice per thread: the writer yields the CPU to data loading and training
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), WRITER_NICE)
+            parent, name = os.path.split(checkpoint_dir)
+            tmp_dir = os.path.join(parent, TMP_PREFIX + name)
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            for file_name, write in files.items():
+                write(os.path.join(tmp_dir, file_name))
+            write_manifest(tmp_dir)
+            if os.path.isdir(checkpoint_dir):  # saved again at the same step after a resume
+                shutil.rmtree(checkpoint_dir)
+            os.rename(tmp_dir, checkpoint_dir)
+            if after is not None:
+                after()
+        except BaseException as e:  # re-raised on the training thread by wait()
+            self._error = e
+        self.write_seconds.append(time.perf_counter() - start)
+
+    def wait(self):
+        """Block until the pending write is done; raises if it failed"""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            self.pending = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("writing checkpoint failed") from error
+
+
+class AsyncCheckpointTrainer(BatchingTrainer):
+    """BatchingTrainer whose checkpoints hold the adapter only and are written in the background
+
+    Models without LoRA adapters and multi-process runs fall back to
+    Trainer's synchronous save.
+    """
+
+    def __init__(self, *args, save_optimizer=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.save_optimizer = save_optimizer
+        self.checkpoint_writer = AsyncCheckpointWriter()
+        self.snapshot_seconds = []  # time each save held up training
+
+    def _snapshot_rng(self):
+        # Same layout as Trainer._save_rng_state for a single process
+        rng_states = {
+            "python": random.getstate(),
+            "numpy": np.random.get_state(),
+            "cpu": torch.random.get_rng_state(),
+        }
+        if torch.cuda.is_available():
+            rng_states["cuda"] = torch.cuda.random.get_rng_state()
+        return rng_states
+
+    def _save_checkpoint(self, model, trial):
+        unwrapped = self.accelerator.unwrap_model(model)
+        if not isinstance(unwrapped, PeftModel) or self.args.world_size > 1:
+            return super()._save_checkpoint(model, trial)
+        start = time.perf_counter()
+        if self.hp_search_backend is None and trial is None:
+            self.store_flos()
+        run_dir = self._get_output_dir(trial=trial)
+        checkpoint_dir = os.path.join(run_dir, f"{PREFIX_CHECKPOINT_DIR}-{self.state.global_step}")
+
+        # Snapshot on the training thread; everything below is a copy the next step cannot change
+        adapter = unwrapped.active_adapter
+        weights = cpu_copy(get_peft_model_state_dict(unwrapped, adapter_name=adapter))
+        peft_config = copy.deepcopy(unwrapped.peft_config[adapter])
+        peft_config.inference_mode = True  # as PeftModel.save_pretrained writes it
+        files = {
+            ADAPTER_WEIGHTS_NAME: functools.partial(save_file, weights, metadata={"format": "pt"}),
+            "adapter_config.json": lambda path: peft_config.save_pretrained(os.path.dirname(path)),
+            "scheduler.pt": functools.partial(torch.save, cpu_copy(self.lr_scheduler.state_dict())),
+            "rng_state.pth": functools.partial(torch.save, self._snapshot_rng()),
+        }
+        if self.save_optimizer:
+            files["optimizer.pt"] = functools.partial(torch.save, cpu_copy(self.optimizer.state_dict()))
+        scaler = getattr(self.accelerator, "scaler", None)
+        if scaler is not None:
+            files["scaler.pt"] = functools.partial(torch.save, cpu_copy(scaler.state_dict()))
+
+        # Stateful callbacks (e.g. early stopping) travel in the trainer state, as in Trainer
+        for cb in [cb for cb in self.callback_handler.callbacks + [self.control] if isinstance(cb, ExportableState)]:
+            cb_name = cb.__class__.__name__
+            if isinstance(self.state.stateful_callbacks[cb_name], list):
+                self.state.stateful_callbacks[cb_name].append(cb.state())
+            else:
+                self.state.stateful_callbacks[cb_name] = cb.state()
+
+        if self.state.best_global_step:
+            # Trainer only records the best checkpoint once it exists; ours may still be in flight
+            best_dir = os.path.join(run_dir, f"{PREFIX_CHECKPOINT_DIR}-{self.state.best_global_step}")
+            if self.state.best_global_step == self.state.global_step or os.path.exists(best_dir) \
+                    or self.checkpoint_writer.pending == best_dir:
+                self.state.best_model_checkpoint = best_dir
+
+        files["trainer_state.json"] = copy.deepcopy(self.state).save_to_json
+
+        rotate = functools.partial(rotate_checkpoints, output_dir=run_dir, save_total_limit=self.args.save_total_limit,
+                                   best_model_checkpoint=self.state.best_model_checkpoint, use_mtime=False)
+        self.checkpoint_writer.submit(checkpoint_dir, files, after=rotate)
+        self.snapshot_seconds.append(time.perf_counter() - start)
+
+    def _load_optimizer_and_scheduler(self, checkpoint):
+        super()._load_optimizer_and_scheduler(checkpoint)
+        if checkpoint is None or os.path.isfile(os.path.join(checkpoint, OPTIMIZER_NAME)):
+            return
+        # Trainer restores the scheduler only together with optimizer.pt, which adapter-only
+        # checkpoints leave out; without this the resumed run would restart the warmup
+        scheduler_path = os.path.join(checkpoint, SCHEDULER_NAME)
+        if os.path.isfile(scheduler_path):
+            self.lr_scheduler.load_state_dict(torch.load(scheduler_path, weights_only=True))
+
+    def _load_best_model(self):
+        self.checkpoint_writer.wait()  # the best checkpoint may be the one still being written
+        super()._load_best_model()
+
+    def train(self, *args, **kwargs):
+        try:
+            return super().train(*args, **kwargs)
+        finally:
+            self.checkpoint_writer.wait()  # the last checkpoint is on disk before train() returns
+
+
+class _StopAt(TrainerCallback):
+    """Simulate an interruption right after the checkpoint at step"""
+
+    def __init__(self, step):
+        self.step = step
+
+    def on_step_end(self, args, state, control, **kwargs):
+        if state.global_step == self.step:
+            control.should_training_stop = True
+
+
+def _learning_rates(trainer):
+    return {log["step"]: log["learning_rate"] for log in trainer.state.log_history if "learning_rate" in log}
+
+
+def check_resume(output_dir, steps=20, interrupt_at=10, save_optimizer=False):
+    """Learning rates per step of an uninterrupted run and of one resumed at interrupt_at
+
+    Returns (uninterrupted, resumed) dicts of step -> learning rate on a
+    tiny Gemma; they are equal when the schedule survives the resume.
+    """
+    from tiny_gemma import tiny_peft_gemma
+    from token_shards import TokenShardCollator
+
+    generator = torch.Generator().manual_seed(0)
+    dataset = [{"input_ids": ids} for ids in torch.randint(1, 1024, (steps * 2, 32), generator=generator)]
+
+    def run(run_dir, callbacks=(), resume=None):
+        args = TrainingArguments(output_dir=run_dir, max_steps=steps, per_device_train_batch_size=2,
+                                 learning_rate=1e-3, warmup_steps=interrupt_at, lr_scheduler_type="linear",
+                                 save_steps=interrupt_at, logging_steps=1, report_to=[], use_cpu=True,
+                                 remove_unused_columns=False, disable_tqdm=True)
+        trainer = AsyncCheckpointTrainer(model=tiny_peft_gemma(), args=args, train_dataset=dataset,
+                                         data_collator=TokenShardCollator(0), callbacks=list(callbacks),
+                                         save_optimizer=save_optimizer)
+        trainer.train(resume_from_checkpoint=resume)
+        return _learning_rates(trainer)
+
+    uninterrupted = run(os.path.join(output_dir, "uninterrupted"))
+    resumed_dir = os.path.join(output_dir, "resumed")
+    run(resumed_dir, callbacks=[_StopAt(interrupt_at)])
+    resumed = run(resumed_dir, resume=latest_checkpoint(resumed_dir))
+    return uninterrupted, resumed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Adapter-only asynchronous checkpoints")
+    parser.add_argument("--check-resume", action="store_true",
+                        help="check that a resumed tiny run continues the learning-rate schedule")
+    parser.add_argument("--save-optimizer", action="store_true")
+    args = parser.parse_args()
+    if not args.check_resume:
+        parser.print_help()
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        uninterrupted, resumed = check_resume(tmp, save_optimizer=args.save_optimizer)
+    mismatched = [step for step in sorted(resumed) if not np.isclose(resumed[step], uninterrupted.get(step, np.nan))]
+    for step in sorted(resumed):
+        print(f"step {step:>3}: uninterrupted {uninterrupted.get(step, float('nan')):.2e}, resumed {resumed[step]:.2e}")
+    if mismatched:
+        sys.exit(f"Learning rate differs after resuming at steps {mismatched}")
+    print("Resumed run continues the learning-rate schedule")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Probe for the largest safe micro-batch and matching gradient accumulation
+
+A few forward/backward/optimizer steps are run at increasing micro-batch
+sizes for each sequence length, watching peak memory, until a probe runs
+out of memory or crosses safety * the device's memory. The largest
+micro-batch that fit, and the accumulation that reaches the target
+effective batch with it, are written to a JSON config that
+fine_tune_gemma_local.py reads with --batch-config. The config records the
+model, device and max_length it was probed with, and the trainer refuses a
+config probed for anything else.
+
+Peak memory comes from the CUDA allocator on GPUs, from the driver on MPS
+and, on CPU, from the process' resident set size sampled by a background
+thread while each probe runs.
+
+Usage:
+    python fine_tune_gemma_local.py --find-batch-size        # real model, writes batch_config.json
+    python batch_finder.py --tiny                            # tiny Gemma on CPU, writes batch_config_tiny.json
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import gc
+import json
+import math
+import os
+import resource
+import sys
+import threading
+import time
+
+import torch
+
+MEMORY_SAFETY = 0.9
+PROBE_STEPS = 2
+MAX_MICRO_BATCH = 64
+RSS_SAMPLE_SECONDS = 0.001
+# glibc mallopt parameter and value: allocations above 64 KiB get their own mapping
+M_MMAP_THRESHOLD = -3
+TINY_MODEL_NAME = "tiny-gemma"
+MMAP_THRESHOLD = 64 << 10
+
+
+def device_memory(device):
+    """Total memory in bytes that the device can give this process"""
+    if device == "cuda":
+        return torch.cuda.get_device_properties(0).total_memory
+    if device == "mps":
+        return torch.mps.recommended_max_memory()
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def _release_freed_memory():
+    """Return memory freed by earlier probes to the OS so it does not count as resident
+
+    Also fixes glibc's mmap threshold: by default it grows to the size of
+    freed blocks, after which tensors are carved from the heap and stay
+    resident once freed, so the resident set would track the heap's high-water
+    mark rather than live tensors.
+    """
+    gc.collect()
+    libc_name = ctypes.util.find_library("c")
+    if libc_name and sys.platform.startswith("linux"):
+        libc = ctypes.CDLL(libc_name)
+        libc.mallopt(M_MMAP_THRESHOLD, MMAP_THRESHOLD)
+        libc.malloc_trim(0)  # glibc keeps freed heap pages otherwise
+
+
+def _current_rss():
+    try:
+        with open("/proc/self/statm", 'rb') as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:  # no procfs (macOS): the lifetime peak is the best available
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def _reset_peak_rss():
+    """Restart the kernel's peak resident set count (VmHWM, Linux); False where unsupported"""
+    try:
+        with open("/proc/self/clear_refs", 'w') as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss():
+    """Peak resident set since _reset_peak_rss(), or over the process' lifetime"""
+    try:
+        with open("/proc/self/status", 'rb') as f:
+            for line in f:
+                if line.startswith(b"VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+class PeakMemory:
+    """Context manager tracking peak memory of the block on device
+
+    CUDA uses the allocator's peak counter, MPS the driver's current
+    allocation at each sample() call, CPU a thread polling the resident set.
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if self.device == "cuda":
+            torch.cuda.empty_cache()
+            torch.cuda.reset_peak_memory_stats()
+        elif self.device == "mps":
+            torch.mps.empty_cache()
+        else:
+            _release_freed_memory()
+            self.peak = _current_rss()
+            self._thread = threading.Thread(target=self._poll, daemon=True)
+            self._thread.start()
+        return self
+
+    def _poll(self):
+        while not self._stop.wait(RSS_SAMPLE_SECONDS):
+            self.peak = max(self.peak, _current_rss())
+
+    def sample(self):
+        if self.device == "cuda":
+            self.peak = max(self.peak, torch.cuda.max_memory_allocated())
+        elif self.device == "mps":
+            self.peak = max(self.peak, torch.mps.driver_allocated_memory())
+        else:
+            self.peak = max(self.peak, _current_rss())
+        return self.peak
+
+    def __exit__(self, *exc):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+        self.sample()
+        return False
+
+
+def _is_oom(error):
+    return isinstance(error, torch.OutOfMemoryError) or "out of memory" in str(error).lower()
+
+
+def probe(model, batch_size, seq_len, device, steps=PROBE_STEPS):
+    """Peak memory of steps training steps at this shape, or None on OOM
+
+    Runs forward, backward and an AdamW step with lr=0, so optimizer state
+    is allocated as in training but the weights are left unchanged.
+    """
+    vocab_size = model.config.vocab_size
+    params = [p for p in model.parameters() if p.requires_grad]
+    optimizer = torch.optim.AdamW(params, lr=0.0)
+    model.train()
+    peak = None
+    try:
+        with PeakMemory(device) as memory:
+            for _ in range(steps):
+                input_ids = torch.randint(0, vocab_size, (batch_size, seq_len), device=device)
+                loss = model(input_ids=input_ids, labels=input_ids).loss
+                loss.backward()
+                optimizer.step()
+                optimizer.zero_grad(set_to_none=True)
+                memory.sample()
+                del loss, input_ids
+        peak = memory.peak
+    except (RuntimeError, torch.OutOfMemoryError) as e:
+        if not _is_oom(e):
+            raise
+    finally:
+        optimizer.zero_grad(set_to_none=True)
+        del optimizer
+        if device == "cuda":
+            torch.cuda.empty_cache()
+        elif device == "mps":
+            torch.mps.empty_cache()
+    return peak
+
+
+def find_batch_size(model, seq_lens, target_batch_size, device, memory_limit=None, safety=MEMORY_SAFETY,
+                    max_batch_size=MAX_MICRO_BATCH, steps=PROBE_STEPS, model_name=None):
+    """Probe micro-batches 1, 2, 4, ... per sequence length; returns the config dict
+
+    The top-level batch settings are for the longest sequence length, which
+    is the one training pads or packs to. model_name is recorded so the
+    trainer can tell which model the config was probed with.
+    """
+    memory_limit = memory_limit or device_memory(device)
+    budget = safety * memory_limit
+    max_batch_size = min(max_batch_size, target_batch_size)
+    probes = []
+    by_seq_len = {}
+    for seq_len in sorted(seq_lens):
+        best = None
+        batch_size = 1
+        while batch_size <= max_batch_size:
+            start = time.perf_counter()
+            peak = probe(model, batch_size, seq_len, device, steps)
+            fits = peak is not None and peak <= budget
+            probes.append({
+                "seq_len": seq_len,
+                "batch_size": batch_size,
+                "peak_memory_bytes": peak,
+                "seconds_per_step": (time.perf_counter() - start) / steps,
+                "fits": fits,
+            })
+            print(f"  seq_len {seq_len:>5}, micro-batch {batch_size:>3}: "
+                  + (f"{peak / 2**30:.2f} GiB" if peak is not None else "out of memory")
+                  + ("" if fits else " (over budget)"))
+            if not fits:
+                break
+            best = (batch_size, peak)
+            batch_size *= 2
+        if best is None:
+            by_seq_len[str(seq_len)] = None
+            continue
+        micro_batch, peak = best
+        accumulation = math.ceil(target_batch_size / micro_batch)
+        by_seq_len[str(seq_len)] = {
+            "per_device_train_batch_size": micro_batch,
+            "gradient_accumulation_steps": accumulation,
+            "effective_batch_size": micro_batch * accumulation,
+            "peak_memory_bytes": peak,
+        }
+
+    chosen = by_seq_len[str(max(seq_lens))]
+    if chosen is None:
+        raise RuntimeError(f"micro-batch 1 at seq_len {max(seq_lens)} does not fit in "
+                           f"{budget / 2**30:.2f} GiB on {device}")
+    return {
+        "model": model_name,
+        "device": device,
+        "max_length": max(seq_lens),
+        "target_batch_size": target_batch_size,
+        **chosen,
+        "memory_limit_bytes": memory_limit,
+        "safety": safety,
+        "by_seq_len": by_seq_len,
+        "probes": probes,
+    }
+
+
+def save_config(config, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2)
+
+
+class BatchConfigMismatch(ValueError):
+    """Batch config was probed with a different model, device or max_length"""
+
+
+def check_config(config, model_name=None, device=None, max_length=None):
+    """Raise BatchConfigMismatch if the config was not probed for this run"""
+    for key, expected in (("model", model_name), ("device", device), ("max_length", max_length)):
+        if expected is not None and config.get(key) != expected:
+            raise BatchConfigMismatch(f"probed with {key} {config.get(key)!r}, this run uses {expected!r}")
+
+
+def load_config(path, model_name=None, device=None, max_length=None):
+    """Read a config written by save_config, checked against the given run settings"""
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    check_config(config, model_name, device, max_length)
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the largest safe micro-batch for LoRA training")
+    parser.add_argument("--tiny", action="store_true", help="probe a tiny Gemma-shaped model on CPU")
+    parser.add_argument("--seq-lens", type=int, nargs="+", default=[128, 256, 512])
+    parser.add_argument("--target-batch-size", type=int, default=8, help="effective batch per optimizer step")
+    parser.add_argument("--max-batch-size", type=int, default=MAX_MICRO_BATCH)
+    parser.add_argument("--memory-limit-gb", type=float, default=None,
+                        help="memory budget before the safety margin (default: the device's memory)")
+    parser.add_argument("--safety", type=float, default=MEMORY_SAFETY)
+    parser.add_argument("--output", default="batch_config_tiny.json",
+                        help="kept apart from the trainer's batch_config.json, which it would not accept")
+    args = parser.parse_args()
+    if not args.tiny:
+        parser.error("probe the real model with: python fine_tune_gemma_local.py --find-batch-size")
+
+    from tiny_gemma import tiny_peft_gemma
+    model = tiny_peft_gemma()
+    model.gradient_checkpointing_enable(gradient_checkpointing_kwargs={"use_reentrant": False})
+    memory_limit = int(args.memory_limit_gb * 2**30) if args.memory_limit_gb else None
+    config = find_batch_size(model, args.seq_lens, args.target_batch_size, "cpu", memory_limit,
+                             args.safety, args.max_batch_size, model_name=TINY_MODEL_NAME)
+    save_config(config, args.output)
+    print(f"micro-batch {config['per_device_train_batch_size']} x {config['gradient_accumulation_steps']} "
+          f"accumulation at seq_len {config['max_length']} -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Batch samplers that cut padding, and a Trainer that uses them
+
+LengthGroupedBatchSampler groups samples of similar token length into the
+same batch while keeping the order of batches random every epoch.
+TokenBudgetBatchSampler does the same but sizes each batch to a maximum
+number of padded tokens instead of a fixed sample count.
+SortedBatchSampler orders evaluation batches by length, longest first.
+BatchingTrainer plugs any batch sampler into transformers' Trainer and logs
+padding tokens per optimizer step, for whichever batching is in use. Its
+dataloaders honour the prefetch settings from prefetch.prefetch_args.
+"""
+
+import functools
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+from transformers import Trainer, TrainerCallback
+
+from prefetch import init_worker
+
+# Batch key carrying the number of non-padding tokens; removed before forward
+REAL_TOKENS_KEY = "num_real_tokens"
+
+
+class LengthGroupedBatchSampler:
+    """Similar-length batches in a randomised order
+
+    Each epoch the samples are shuffled and cut into mega-batches of
+    batch_size * mega_batch_mult; every mega-batch is sorted by length and
+    split into batches, then the order of all batches is shuffled.
+    """
+
+    def __init__(self, lengths, batch_size, mega_batch_mult=50, seed=42):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.mega_batch_mult = mega_batch_mult
+        self.seed = seed
+        self.epoch = 0
+        self._cached = (None, None)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _split(self, chunk):
+        """Cut one length-sorted (longest first) mega-batch into batches"""
+        return [chunk[i:i + self.batch_size] for i in range(0, len(chunk), self.batch_size)]
+
+    def _batches(self):
+        if self._cached[0] == self.epoch:
+            return self._cached[1]
+        rng = np.random.default_rng((self.seed, self.epoch))
+        order = rng.permutation(len(self.lengths))
+        mega = self.batch_size * self.mega_batch_mult
+        batches = []
+        for start in range(0, len(order), mega):
+            chunk = order[start:start + mega]
+            batches.extend(self._split(chunk[np.argsort(-self.lengths[chunk], kind='stable')]))
+        batches = [batches[i].tolist() for i in rng.permutation(len(batches))]
+        self._cached = (self.epoch, batches)
+        return batches
+
+    def __len__(self):
+        return len(self._batches())
+
+    def __iter__(self):
+        batches = self._batches()
+        self.epoch += 1
+        return iter(batches)
+
+
+class TokenBudgetBatchSampler(LengthGroupedBatchSampler):
+    """Length-grouped batches filled up to a padded-token budget
+
+    A batch grows while len(batch) * longest sample <= max_tokens, so short
+    QA pairs share large batches and long ones get small batches (a sample
+    longer than the budget is batched alone). batch_size only sizes the
+    mega-batches that are sorted together.
+    """
+
+    def __init__(self, lengths, max_tokens, batch_size=8, mega_batch_mult=50, seed=42):
+        super().__init__(lengths, batch_size, mega_batch_mult, seed)
+        self.max_tokens = max_tokens
+
+    def _split(self, chunk):
+        batches = []
+        start = 0
+        for end in range(1, len(chunk)):
+            # chunk is sorted longest first, so a batch's first sample sets its padded width
+            if (end - start + 1) * self.lengths[chunk[start]] > self.max_tokens:
+                batches.append(chunk[start:end])
+                start = end
+        batches.append(chunk[start:])
+        return batches
+
+
+class SortedBatchSampler:
+    """Fixed batches of length-sorted samples, longest first, for evaluation
+
+    Sorting minimises padding; the longest batch comes first so a batch
+    that does not fit fails at once rather than mid-evaluation.
+    """
+
+    def __init__(self, lengths, batch_size):
+        order = np.argsort(-np.asarray(lengths), kind='stable')
+        self.batches = [order[i:i + batch_size].tolist() for i in range(0, len(order), batch_size)]
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __iter__(self):
+        return iter(self.batches)
+
+
+class RealTokenCountingCollator:
+    """Wrap a collator to record how many tokens in the batch are not padding"""
+
+    def __init__(self, collator):
+        self.collator = collator
+
+    def __call__(self, features):
+        batch = self.collator(features)
+        batch[REAL_TOKENS_KEY] = torch.tensor(sum(len(f["input_ids"]) for f in features))
+        return batch
+
+
+class _PaddingStatsStart(TrainerCallback):
+    """Start BatchingTrainer's padding counters at the step training begins from"""
+
+    def __init__(self, trainer):
+        self.trainer = trainer
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        self.trainer._real_tokens = self.trainer._total_tokens = 0
+        self.trainer._padding_logged_step = state.global_step  # above 0 when resumed
+
+
+class _SamplerEpoch(TrainerCallback):
+    """Set the batch sampler's epoch from the trainer state
+
+    Under DDP accelerate wraps the batch sampler in BatchSamplerShard, which
+    does not forward set_epoch, so a resumed run would replay epoch 0's order.
+    """
+
+    def __init__(self, batch_sampler):
+        self.batch_sampler = batch_sampler
+
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        self.batch_sampler.set_epoch(int(state.epoch or 0))  # state.epoch is fractional when resumed mid-epoch
+
+
+class BatchingTrainer(Trainer):
+    """Trainer with an optional batch sampler and padding metrics in its logs
+
+    Every training log gains padding_tokens_per_step, real_tokens_per_step
+    and padding_ratio averaged over the optimizer steps since the last log.
+    """
+
+    def __init__(self, *args, batch_sampler=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batch_sampler = batch_sampler
+        self.data_collator = RealTokenCountingCollator(self.data_collator)
+        self._real_tokens = 0
+        self._total_tokens = 0
+        self._padding_logged_step = 0
+        self._sorted_eval_dataloaders = {}
+        self.add_callback(_PaddingStatsStart(self))
+        if hasattr(batch_sampler, "set_epoch"):
+            self.add_callback(_SamplerEpoch(batch_sampler))
+
+    def _batch_sampler_dataloader(self, dataset, batch_sampler):
+        dataloader = DataLoader(
+            dataset,
+            batch_sampler=batch_sampler,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+            persistent_workers=self.args.dataloader_persistent_workers,
+            prefetch_factor=self.args.dataloader_prefetch_factor,
+        )
+        return self.accelerator.prepare(dataloader)
+
+    def _with_worker_init(self, dataloader):
+        init = dataloader.worker_init_fn
+        if self.args.dataloader_num_workers > 0 and getattr(init, "func", None) is not init_worker:
+            # Keeps Trainer's worker seeding, after limiting the worker's threads and priority
+            dataloader.worker_init_fn = functools.partial(init_worker, previous=init)
+        return dataloader
+
+    def get_train_dataloader(self):
+        if self.batch_sampler is None:
+            return self._with_worker_init(super().get_train_dataloader())
+        return self._with_worker_init(self._batch_sampler_dataloader(self.train_dataset, self.batch_sampler))
+
+    def get_eval_dataloader(self, eval_dataset=None):
+        dataset = eval_dataset if eval_dataset is not None else self.eval_dataset
+        lengths = getattr(dataset, "lengths", None)
+        if lengths is None:
+            return self._with_worker_init(super().get_eval_dataloader(eval_dataset))
+        cached = self._sorted_eval_dataloaders.get(id(dataset))
+        if cached is not None and cached[0] is dataset:  # reused so persistent workers stay alive
+            return cached[1]
+        dataloader = self._with_worker_init(
+            self._batch_sampler_dataloader(dataset, SortedBatchSampler(lengths, self.args.eval_batch_size)))
+        if self.args.dataloader_persistent_workers:
+            self._sorted_eval_dataloaders[id(dataset)] = (dataset, dataloader)
+        return dataloader
+
+    def training_step(self, model, inputs, *args, **kwargs):
+        total = inputs["input_ids"].numel()
+        real = inputs.pop(REAL_TOKENS_KEY, None)
+        self._real_tokens += total if real is None else int(real)
+        self._total_tokens += total
+        return super().training_step(model, inputs, *args, **kwargs)
+
+    def prediction_step(self, model, inputs, *args, **kwargs):
+        inputs.pop(REAL_TOKENS_KEY, None)
+        return super().prediction_step(model, inputs, *args, **kwargs)
+
+    def log(self, logs, *args, **kwargs):
+        steps = self.state.global_step - self._padding_logged_step
+        if "loss" in logs and steps > 0 and self._total_tokens:
+            padding = self._total_tokens - self._real_tokens
+            logs["padding_tokens_per_step"] = padding / steps
+            logs["real_tokens_per_step"] = self._real_tokens / steps
+            logs["padding_ratio"] = padding / self._total_tokens
+            self._real_tokens = self._total_tokens = 0
+            self._padding_logged_step = self.state.global_step
+        super().log(logs, *args, **kwargs)
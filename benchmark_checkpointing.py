@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Benchmark: step-time jitter of synchronous vs asynchronous checkpoints
+
+Trains a tiny Gemma-shaped LoRA model on CPU with random tokens and saves
+every --save-steps steps, once with Trainer's default synchronous save and
+once per AsyncCheckpointTrainer mode. The wall time between consecutive
+optimizer steps is recorded; steps right after a save carry its stall.
+
+Usage:
+    python benchmark_checkpointing.py --steps 120 --save-steps 10 --output checkpoint_benchmark.json
+"""
+
+import argparse
+import json
+import tempfile
+import time
+
+import numpy as np
+import torch
+from transformers import TrainerCallback, TrainingArguments
+
+from async_checkpoint import AsyncCheckpointTrainer
+from batching import BatchingTrainer
+from tiny_gemma import tiny_peft_gemma
+from token_shards import TokenShardCollator
+
+# Wider than TINY_CONFIG so the adapter and optimizer state take real time to write
+MODEL_OVERRIDES = {"hidden_size": 512, "intermediate_size": 2048, "num_hidden_layers": 4,
+                   "num_attention_heads": 4, "head_dim": 128}
+
+
+class RandomTokens(torch.utils.data.Dataset):
+    def __init__(self, count, seq_len, vocab_size, seed=0):
+        generator = torch.Generator().manual_seed(seed)
+        self.input_ids = torch.randint(1, vocab_size, (count, seq_len), generator=generator)
+
+    def __len__(self):
+        return len(self.input_ids)
+
+    def __getitem__(self, i):
+        return {"input_ids": self.input_ids[i]}
+
+
+class StepTimes(TrainerCallback):
+    """Wall time between consecutive optimizer steps"""
+
+    def __init__(self):
+        self.ends = []
+
+    def on_step_end(self, args, state, control, **kwargs):
+        self.ends.append(time.perf_counter())
+
+
+def run(mode, steps, save_steps, rank, batch_size, seq_len, output_dir):
+    model = tiny_peft_gemma(r=rank, lora_alpha=2 * rank, **MODEL_OVERRIDES)
+    args = TrainingArguments(
+        output_dir=output_dir,
+        max_steps=steps,
+        per_device_train_batch_size=batch_size,
+        save_steps=save_steps,
+        save_total_limit=3,
+        logging_steps=steps,
+        report_to=[],
+        use_cpu=True,
+        remove_unused_columns=False,
+        disable_tqdm=True,
+    )
+    times = StepTimes()
+    kwargs = dict(model=model, args=args, train_dataset=RandomTokens(steps * batch_size, seq_len, model.config.vocab_size),
+                  data_collator=TokenShardCollator(0), callbacks=[times])
+    if mode == "sync":
+        trainer = BatchingTrainer(**kwargs)
+    else:
+        trainer = AsyncCheckpointTrainer(save_optimizer=mode == "async+optimizer", **kwargs)
+    start = time.perf_counter()
+    trainer.train()
+    total = time.perf_counter() - start
+
+    intervals = np.diff(times.ends)
+    # Interval i ends at step i + 2 and contains the save made after step i + 1
+    after_save = np.array([(i + 1) % save_steps == 0 for i in range(len(intervals))])
+    normal = intervals[~after_save]
+    saving = intervals[after_save]
+    return {
+        "mode": mode,
+        "total_seconds": total,
+        "step_p50": float(np.median(normal)),
+        "step_p99": float(np.percentile(intervals, 99)),
+        "step_max": float(intervals.max()),
+        "step_std": float(intervals.std()),
+        "stall_per_save": float(saving.mean() - np.median(normal)) if len(saving) else 0.0,
+        "saves": int(after_save.sum()),
+        # Time the training thread spent in each save: copying tensors and waiting for the previous write
+        "snapshot_seconds": float(np.mean(trainer.snapshot_seconds)) if mode != "sync" else None,
+        "background_write_seconds": (float(np.mean(trainer.checkpoint_writer.write_seconds))
+                                     if mode != "sync" else None),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synchronous vs asynchronous checkpoint step-time jitter")
+    parser.add_argument("--steps", type=int, default=120)
+    parser.add_argument("--save-steps", type=int, default=10)
+    parser.add_argument("--rank", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=2)
+    parser.add_argument("--seq-len", type=int, default=128)
+    parser.add_argument("--dir", default=None, help="where to write checkpoints (default: a temp dir)")
+    parser.add_argument("--output", default=None, help="write results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for mode in ("sync", "async", "async+optimizer"):
+        with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+            results.append(run(mode, args.steps, args.save_steps, args.rank, args.batch_size, args.seq_len, tmp))
+
+    print(f"{'mode':<16} {'total s':>8} {'p50 ms':>7} {'p99 ms':>7} {'max ms':>7} {'std ms':>7} {'stall/save ms':>13} "
+          f"{'snapshot ms':>11} {'bg write ms':>11}")
+    for r in results:
+        snapshot = f"{r['snapshot_seconds'] * 1000:.0f}" if r['snapshot_seconds'] is not None else "-"
+        background = f"{r['background_write_seconds'] * 1000:.0f}" if r['background_write_seconds'] is not None else "-"
+        print(f"{r['mode']:<16} {r['total_seconds']:>8.1f} {r['step_p50'] * 1000:>7.0f} {r['step_p99'] * 1000:>7.0f} "
+              f"{r['step_max'] * 1000:>7.0f} {r['step_std'] * 1000:>7.1f} {r['stall_per_save'] * 1000:>13.0f} "
+              f"{snapshot:>11} {background:>11}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
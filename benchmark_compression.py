@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Benchmark: reading raw vs gzip vs zstd compressed JSONL
+
+Writes the same synthetic records as plain, .gz and .zst JSONL (zstd only
+when the zstandard package is installed), then times a full iter_jsonl pass
+over each. With --memory a second, traced pass reports the peak Python heap
+while reading, which stays at a few chunks regardless of file size.
+
+Usage:
+    python benchmark_compression.py --records 1000000 --output compression_benchmark.json
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from benchmark_tokenization import synthetic_records
+from jsonl_stream import iter_jsonl, open_jsonl, zstandard
+
+
+def write_file(path, count, seed=0):
+    start = time.perf_counter()
+    with open_jsonl(path, 'w', buffering=1 << 20) as f:
+        for item in synthetic_records(count, seed):
+            f.write(json.dumps(item, ensure_ascii=False) + '\n')
+    return time.perf_counter() - start
+
+
+def read_file(path):
+    """(records, seconds) of one full pass"""
+    start = time.perf_counter()
+    records = sum(1 for _ in iter_jsonl(path))
+    return records, time.perf_counter() - start
+
+
+def peak_read_memory(path):
+    """Peak traced heap bytes during a full pass (tracing slows the pass down)"""
+    tracemalloc.start()
+    for _ in iter_jsonl(path):
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Raw vs compressed JSONL read throughput")
+    parser.add_argument("--records", type=int, default=1_000_000)
+    parser.add_argument("--dir", default=None, help="where to write the test files (default: a temp dir)")
+    parser.add_argument("--memory", action="store_true", help="also measure peak heap while reading")
+    parser.add_argument("--output", default=None, help="write results as JSON")
+    args = parser.parse_args()
+
+    suffixes = [".jsonl", ".jsonl.gz"] + ([".jsonl.zst"] if zstandard is not None else [])
+    if zstandard is None:
+        print("zstandard not installed, skipping .zst")
+
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for suffix in suffixes:
+            path = os.path.join(tmp, f"synthetic{suffix}")
+            write_seconds = write_file(path, args.records)
+            records, seconds = read_file(path)
+            peak = peak_read_memory(path) if args.memory else None
+            results.append({
+                "format": suffix,
+                "records": records,
+                "file_mb": os.path.getsize(path) / 1e6,
+                "write_seconds": write_seconds,
+                "read_seconds": seconds,
+                "records_per_sec": records / seconds,
+                "peak_heap_mb": peak / 1e6 if peak is not None else None,
+            })
+
+    raw = results[0]
+    print(f"{'format':<11} {'size MB':>9} {'ratio':>6} {'write s':>8} {'read s':>7} {'rec/s':>9} {'vs raw':>7} {'peak MB':>8}")
+    for r in results:
+        peak = f"{r['peak_heap_mb']:.1f}" if r['peak_heap_mb'] is not None else "-"
+        print(f"{r['format']:<11} {r['file_mb']:>9.1f} {raw['file_mb'] / r['file_mb']:>5.1f}x "
+              f"{r['write_seconds']:>8.1f} {r['read_seconds']:>7.1f} {r['records_per_sec']:>9.0f} "
+              f"{r['records_per_sec'] / raw['records_per_sec']:>6.2f}x {peak:>8}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
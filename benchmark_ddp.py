@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Benchmark: data-parallel LoRA throughput vs number of CPU processes
+
+For each process count, launches torchrun on this script: every process
+trains a replica of a tiny Gemma-shaped LoRA model with the gloo backend
+through BatchingTrainer on its shard of fixed-length random samples, with
+this machine's cores split between the processes. The per-process batch is
+fixed (weak scaling), so ideal throughput grows linearly with processes.
+After training the LoRA weights of every replica are compared with rank 0's,
+and the gradient bytes all-reduced per step (adapters only) are reported
+next to the model size.
+
+Usage:
+    python benchmark_ddp.py --processes 1 2 4 --steps 30 --output ddp_benchmark.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+from transformers import TrainerCallback, TrainingArguments
+
+import distributed
+from batching import BatchingTrainer
+from tiny_gemma import tiny_peft_gemma
+from token_shards import TokenShardCollator
+
+MODEL_OVERRIDES = {"hidden_size": 256, "intermediate_size": 1024, "num_hidden_layers": 4,
+                   "num_attention_heads": 4, "head_dim": 64}
+
+
+class FixedLengthSamples(torch.utils.data.Dataset):
+    def __init__(self, count, seq_len, vocab_size, seed=0):
+        generator = torch.Generator().manual_seed(seed)
+        self.input_ids = torch.randint(1, vocab_size, (count, seq_len), generator=generator)
+
+    def __len__(self):
+        return len(self.input_ids)
+
+    def __getitem__(self, i):
+        return {"input_ids": self.input_ids[i]}
+
+
+class StepTimes(TrainerCallback):
+    def __init__(self):
+        self.ends = []
+
+    def on_step_end(self, args, state, control, **kwargs):
+        self.ends.append(time.perf_counter())
+
+
+def worker(args):
+    """One torchrun process; rank 0 writes the result to args.result"""
+    info = distributed.init("cpu")
+    threads = distributed.configure_threads(info["local_world_size"])
+    model = tiny_peft_gemma(r=args.rank, lora_alpha=2 * args.rank, **MODEL_OVERRIDES)
+    samples = args.steps * args.batch_size * info["world_size"]
+    times = StepTimes()
+    with tempfile.TemporaryDirectory() as tmp:
+        training_args = TrainingArguments(
+            output_dir=tmp,
+            max_steps=args.steps,
+            per_device_train_batch_size=args.batch_size,
+            save_strategy="no",
+            logging_steps=args.steps,
+            report_to=[],
+            use_cpu=True,
+            ddp_backend="gloo",
+            remove_unused_columns=False,
+            disable_tqdm=True,
+            gradient_checkpointing=True,
+            gradient_checkpointing_kwargs={"use_reentrant": False},
+        )
+        trainer = BatchingTrainer(model=model, args=training_args,
+                                  train_dataset=FixedLengthSamples(samples, args.seq_len, model.config.vocab_size),
+                                  data_collator=TokenShardCollator(0), callbacks=[times])
+        trainer.train()
+        wrapped = isinstance(trainer.model_wrapped, torch.nn.parallel.DistributedDataParallel)
+    divergence = distributed.adapter_divergence(model)
+    if info["rank"] == 0:
+        step_times = np.diff(times.ends)[1:]  # the first interval includes DDP's first bucket rebuild
+        step_time = float(np.median(step_times))
+        result = {
+            "processes": info["world_size"],
+            "threads_per_process": threads,
+            "step_time_p50": step_time,
+            "tokens_per_sec": args.batch_size * args.seq_len * info["world_size"] / step_time,
+            "ddp": wrapped,
+            # DDP reduces trainable parameters only: the adapters' gradients, not the base model
+            "allreduce_bytes_per_step": sum(p.numel() * p.element_size() for p in model.parameters()
+                                            if p.requires_grad) if wrapped else 0,
+            "model_bytes": sum(p.numel() * p.element_size() for p in model.parameters()),
+            "adapter_divergence": divergence,
+        }
+        with open(args.result, 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+    distributed.shutdown()
+
+
+def launch(processes, args):
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        result_path = f.name
+    command = [sys.executable, "-m", "torch.distributed.run", "--standalone", f"--nproc-per-node={processes}",
+               os.path.abspath(__file__), "--worker", "--result", result_path, "--steps", str(args.steps),
+               "--batch-size", str(args.batch_size), "--seq-len", str(args.seq_len), "--rank", str(args.rank)]
+    subprocess.run(command, check=True)
+    with open(result_path, 'r', encoding='utf-8') as f:
+        result = json.load(f)
+    os.remove(result_path)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Data-parallel LoRA throughput vs CPU process count (gloo)")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--steps", type=int, default=30)
+    parser.add_argument("--batch-size", type=int, default=4, help="per process")
+    parser.add_argument("--seq-len", type=int, default=256)
+    parser.add_argument("--rank", type=int, default=16)
+    parser.add_argument("--output", default=None, help="write results as JSON")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--result", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args)
+        return
+
+    results = [launch(processes, args) for processes in args.processes]
+    base = next((r for r in results if r["processes"] == 1), results[0])
+    base_per_process = base["tokens_per_sec"] / base["processes"]
+    print(f"{'processes':>9} {'threads':>7} {'step p50 ms':>11} {'tok/s':>8} {'speedup':>7} {'efficiency':>10} "
+          f"{'all-reduce MB/step':>18} {'adapter diff':>12}")
+    for r in results:
+        r["speedup"] = r["tokens_per_sec"] / base["tokens_per_sec"]
+        r["efficiency"] = r["tokens_per_sec"] / (base_per_process * r["processes"])
+        print(f"{r['processes']:>9} {r['threads_per_process']:>7} {r['step_time_p50'] * 1000:>11.1f} "
+              f"{r['tokens_per_sec']:>8.0f} {r['speedup']:>7.2f} {r['efficiency']:>10.1%} "
+              f"{r['allreduce_bytes_per_step'] / 1e6:>18.2f} {r['adapter_divergence']:>12.2e}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Benchmark: LoRA rank and target_modules vs step time and memory
+
+Runs a short fixed number of training steps (forward, backward, AdamW) for
+every combination of rank and target-module subset on a tiny Gemma-shaped
+model on CPU, with gradient checkpointing as in fine_tune_gemma_local.py.
+Records median step time, tokens/sec, trainable parameters and the peak
+memory of the steps (measured, and from memory_estimate) with the git
+commit, so results from two commits can be compared:
+
+    python benchmark_lora.py --output lora_benchmark.json
+    git checkout other-branch
+    python benchmark_lora.py --output lora_benchmark_new.json --compare lora_benchmark.json
+
+Timing noise on a shared CPU is larger than most regressions: --repeats
+runs the whole grid several times, interleaved, and keeps each
+configuration's fastest median. --compare exits with status 1 when any
+configuration's tokens/sec dropped by more than --tolerance, so it can gate
+a CI job.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import torch
+
+from batch_finder import PeakMemory
+from memory_estimate import estimate_memory
+from tiny_gemma import tiny_peft_gemma
+
+RANKS = (4, 8, 16, 32, 64)
+TARGET_SETS = {
+    "qv": ["q_proj", "v_proj"],
+    "attention": ["q_proj", "k_proj", "v_proj", "o_proj"],
+    "mlp": ["gate_proj", "up_proj", "down_proj"],
+    "all": ["q_proj", "k_proj", "v_proj", "o_proj", "gate_proj", "up_proj", "down_proj"],
+}
+# Wider than TINY_CONFIG so the adapter cost is visible next to the base model's
+MODEL_OVERRIDES = {"hidden_size": 256, "intermediate_size": 1024, "num_hidden_layers": 4,
+                   "num_attention_heads": 4, "head_dim": 64}
+
+
+def git_commit():
+    """Short hash of the checkout this script is in, with -dirty for uncommitted changes"""
+    repo = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True, cwd=repo).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                               text=True, check=True, cwd=repo).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+
+def time_steps(model, batch_size, seq_len, steps, warmup_steps, seed=0):
+    """(seconds per step after warmup, peak memory of the timed steps above the idle process)"""
+    generator = torch.Generator().manual_seed(seed)
+    vocab_size = model.config.vocab_size
+    optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=1e-4)
+    model.train()
+
+    def step():
+        input_ids = torch.randint(0, vocab_size, (batch_size, seq_len), generator=generator)
+        model(input_ids=input_ids, labels=input_ids).loss.backward()
+        optimizer.step()
+        optimizer.zero_grad(set_to_none=True)
+
+    for _ in range(warmup_steps):
+        step()
+    with PeakMemory("cpu") as idle:
+        pass
+    times = []
+    with PeakMemory("cpu") as memory:
+        for _ in range(steps):
+            start = time.perf_counter()
+            step()
+            times.append(time.perf_counter() - start)
+    return times, memory.peak - idle.peak
+
+
+def run_config(rank, targets, batch_size, seq_len, steps, warmup_steps):
+    model = tiny_peft_gemma(r=rank, lora_alpha=2 * rank, target_modules=TARGET_SETS[targets], **MODEL_OVERRIDES)
+    model.gradient_checkpointing_enable(gradient_checkpointing_kwargs={"use_reentrant": False})
+    trainable = sum(p.numel() for p in model.parameters() if p.requires_grad)
+    total = sum(p.numel() for p in model.parameters())
+    times, peak = time_steps(model, batch_size, seq_len, steps, warmup_steps)
+    estimate = estimate_memory(model.config, model.peft_config["default"], batch_size, seq_len, torch.float32,
+                               gradient_checkpointing=True, device="cpu")
+    step_time = float(np.median(times))
+    return {
+        "rank": rank,
+        "targets": targets,
+        "trainable_params": trainable,
+        "trainable_fraction": trainable / total,
+        "step_time": step_time,
+        "step_time_p90": float(np.percentile(times, 90)),
+        "tokens_per_sec": batch_size * seq_len / step_time,
+        "peak_memory_bytes": peak,
+        "estimated_memory_bytes": estimate["total"] - estimate["parameters"] - estimate["lora_parameters"],
+    }
+
+
+def _key(row):
+    return f"r{row['rank']}/{row['targets']}"
+
+
+def compare(results, baseline, tolerance):
+    """Rows of (config, old tokens/sec, new tokens/sec, change); configs in both files only"""
+    old = {_key(r): r for r in baseline["results"]}
+    rows = []
+    for r in results["results"]:
+        if _key(r) in old:
+            before = old[_key(r)]["tokens_per_sec"]
+            change = r["tokens_per_sec"] / before - 1.0
+            rows.append((_key(r), before, r["tokens_per_sec"], change, change < -tolerance))
+    return rows
+
+
+def print_results(results):
+    print(f"{'config':<14} {'trainable':>10} {'%':>6} {'step ms':>8} {'p90 ms':>7} {'tok/s':>7} "
+          f"{'peak MB':>8} {'est MB':>7}")
+    for r in results:
+        print(f"{_key(r):<14} {r['trainable_params']:>10} {r['trainable_fraction']:>6.1%} "
+              f"{r['step_time'] * 1000:>8.1f} {r['step_time_p90'] * 1000:>7.1f} {r['tokens_per_sec']:>7.0f} "
+              f"{r['peak_memory_bytes'] / 1e6:>8.1f} {r['estimated_memory_bytes'] / 1e6:>7.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep LoRA rank and target modules on a tiny Gemma on CPU")
+    parser.add_argument("--ranks", type=int, nargs="+", default=list(RANKS))
+    parser.add_argument("--targets", nargs="+", choices=list(TARGET_SETS), default=list(TARGET_SETS))
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--seq-len", type=int, default=256)
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--warmup-steps", type=int, default=2)
+    parser.add_argument("--repeats", type=int, default=1, help="runs of the grid; the fastest run per config is kept")
+    parser.add_argument("--threads", type=int, default=None, help="torch threads (default: torch's choice)")
+    parser.add_argument("--output", default="lora_benchmark.json")
+    parser.add_argument("--compare", default=None, help="earlier results file to compare tokens/sec against")
+    parser.add_argument("--tolerance", type=float, default=0.05,
+                        help="largest tokens/sec drop vs --compare not reported as a regression")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    best = {}
+    for repeat in range(args.repeats):
+        for targets in args.targets:
+            for rank in args.ranks:
+                row = run_config(rank, targets, args.batch_size, args.seq_len, args.steps, args.warmup_steps)
+                print(f"  [{repeat + 1}/{args.repeats}] {_key(row)}: {row['step_time'] * 1000:.1f} ms/step")
+                if _key(row) not in best or row["step_time"] < best[_key(row)]["step_time"]:
+                    best[_key(row)] = row
+    rows = list(best.values())
+    results = {
+        "commit": git_commit(),
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "torch": torch.__version__,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "threads": torch.get_num_threads(),
+        "model": MODEL_OVERRIDES,
+        "batch_size": args.batch_size,
+        "seq_len": args.seq_len,
+        "steps": args.steps,
+        "repeats": args.repeats,
+        "results": rows,
+    }
+    print()
+    print_results(rows)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if (baseline["batch_size"], baseline["seq_len"], baseline["threads"]) != \
+                (results["batch_size"], results["seq_len"], results["threads"]):
+            print("\nWarning: baseline ran with a different batch size, sequence length or thread count")
+        print(f"\ntokens/sec vs {args.compare} ({baseline.get('commit')} -> {results['commit']}):")
+        rows = compare(results, baseline, args.tolerance)
+        for key, before, after, change, regressed in rows:
+            print(f"  {key:<14} {before:>8.0f} -> {after:>8.0f} {change:>+7.1%}{'  REGRESSION' if regressed else ''}")
+        regressions = sum(regressed for *_, regressed in rows)
+        if regressions:
+            print(f"{regressions} configuration(s) slower by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Benchmark: data-wait per step with and without background prefetching
+
+Trains a tiny Gemma-shaped LoRA model on CPU with variable-length random
+samples through BatchingTrainer and the trainer's TokenShardCollator, once
+with loading on the main process and once per worker count with
+prefetch.prefetch_args. --packing uses PackedCollator instead, whose 4D
+attention masks make collation far more expensive. ThroughputCallback's
+per-step data_wait is the time each optimizer step waited for its batches.
+
+Usage:
+    python benchmark_prefetch.py --steps 60 --workers 0 1 2 --output prefetch_benchmark.json
+"""
+
+import argparse
+import json
+import os
+import tempfile
+
+import numpy as np
+import torch
+from transformers import TrainingArguments
+
+from batching import BatchingTrainer, LengthGroupedBatchSampler
+from packing import PackedCollator, PackedDataset
+from prefetch import prefetch_args
+from throughput import ThroughputCallback
+from tiny_gemma import tiny_peft_gemma
+from token_shards import TokenShardCollator
+
+MODEL_OVERRIDES = {"hidden_size": 256, "intermediate_size": 1024, "num_hidden_layers": 4,
+                   "num_attention_heads": 4, "head_dim": 64}
+
+
+class RandomSamples(torch.utils.data.Dataset):
+    """Variable-length random token samples, like QA pairs in a token shard"""
+
+    def __init__(self, count, max_length, vocab_size, seed=0):
+        rng = np.random.default_rng(seed)
+        self.lengths = rng.integers(max_length // 8, max_length + 1, count)
+        self.tokens = rng.integers(1, vocab_size, int(self.lengths.sum()), dtype=np.uint32)
+        self.offsets = np.concatenate([[0], np.cumsum(self.lengths)])
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, i):
+        return {"input_ids": torch.from_numpy(self.tokens[self.offsets[i]:self.offsets[i + 1]])}
+
+
+def run(workers, steps, batch_size, grad_accum, max_length, batching, packing, output_dir):
+    model = tiny_peft_gemma(**MODEL_OVERRIDES)
+    dataset = RandomSamples(steps * batch_size * grad_accum, max_length, model.config.vocab_size)
+    collator = TokenShardCollator(0)
+    if packing:
+        dataset = PackedDataset(dataset, max_length)
+        collator = PackedCollator(0)
+    args = TrainingArguments(
+        output_dir=output_dir,
+        max_steps=steps,
+        per_device_train_batch_size=batch_size,
+        gradient_accumulation_steps=grad_accum,
+        save_strategy="no",
+        logging_steps=steps,
+        report_to=[],
+        use_cpu=True,
+        remove_unused_columns=False,
+        disable_tqdm=True,
+        gradient_checkpointing=True,
+        gradient_checkpointing_kwargs={"use_reentrant": False},
+        **prefetch_args("cpu", workers),
+    )
+    batch_sampler = LengthGroupedBatchSampler(dataset.lengths, batch_size) if batching == "length" else None
+    throughput = ThroughputCallback(os.path.join(output_dir, "throughput.jsonl"))
+    trainer = BatchingTrainer(model=model, args=args, train_dataset=dataset, data_collator=collator,
+                              batch_sampler=batch_sampler, callbacks=[throughput])
+    trainer.train()
+    summary = throughput.summary
+    data_wait = np.array([s["data_wait"] for s in throughput.steps[1:]])  # first step includes worker start-up
+    return {
+        "workers": workers,
+        "step_time_p50": summary["step_time_p50"],
+        "padded_tokens_per_sec": summary["padded_tokens_per_sec"],
+        "data_wait_fraction": summary["data_wait_fraction"],
+        "data_wait_p50": float(np.median(data_wait)),
+        "data_wait_max": float(data_wait.max()),
+        "first_step_data_wait": throughput.steps[0]["data_wait"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Data-wait per step with and without prefetching workers")
+    parser.add_argument("--steps", type=int, default=60)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2])
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--grad-accum", type=int, default=2)
+    parser.add_argument("--max-length", type=int, default=256)
+    parser.add_argument("--batching", choices=["random", "length"], default="random")
+    parser.add_argument("--packing", action="store_true")
+    parser.add_argument("--output", default=None, help="write results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as tmp:
+            results.append(run(workers, args.steps, args.batch_size, args.grad_accum, args.max_length,
+                               args.batching, args.packing, tmp))
+
+    print(f"{'workers':>7} {'step p50 ms':>11} {'tok/s':>7} {'data wait':>9} {'wait p50 ms':>11} "
+          f"{'wait max ms':>11} {'first step wait ms':>18}")
+    for r in results:
+        print(f"{r['workers']:>7} {r['step_time_p50'] * 1000:>11.1f} {r['padded_tokens_per_sec']:>7.0f} "
+              f"{r['data_wait_fraction']:>9.2%} {r['data_wait_p50'] * 1000:>11.2f} {r['data_wait_max'] * 1000:>11.2f} "
+              f"{r['first_step_data_wait'] * 1000:>18.1f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
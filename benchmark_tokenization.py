@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Benchmark parallel tokenization: samples/sec vs worker count
+
+Usage:
+    python benchmark_tokenization.py --model google/gemma-3-1b-it --workers 1,2,4,8
+    python benchmark_tokenization.py --dataset final_training_dataset/kazakh_law_qa_full_20250702_013138.jsonl
+"""
+
+import argparse
+import json
+import os
+import random
+import time
+from itertools import islice
+
+from jsonl_stream import iter_jsonl
+from token_shards import TOKENIZE_BATCH_SIZE, iter_token_ids
+
+_WORDS = ("закон", "статья", "кодекс", "договор", "регистрация", "ТОО", "налог",
+          "работник", "суд", "право", "Республики", "Казахстан", "құқық", "заң")
+
+
+def synthetic_records(count, seed=0):
+    """QA records with roughly the corpus' average length (~940 chars)"""
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield {
+            "instruction": " ".join(rng.choices(_WORDS, k=15)) + "?",
+            "output": " ".join(rng.choices(_WORDS, k=110)) + ".",
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokenization throughput vs worker count")
+    parser.add_argument("--model", default="google/gemma-3-1b-it")
+    parser.add_argument("--dataset", default=None, help="JSONL file (default: synthetic records)")
+    parser.add_argument("--samples", type=int, default=20000)
+    parser.add_argument("--workers", default=f"1,2,4,{os.cpu_count() or 1}")
+    parser.add_argument("--batch-size", type=int, default=TOKENIZE_BATCH_SIZE)
+    parser.add_argument("--max-length", type=int, default=512)
+    parser.add_argument("--output", default=None, help="write results as JSON")
+    args = parser.parse_args()
+
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+
+    if args.dataset:
+        records = list(islice(iter_jsonl(args.dataset), args.samples))
+    else:
+        records = list(synthetic_records(args.samples))
+    worker_counts = sorted({int(w) for w in args.workers.split(",")})
+
+    print(f"Tokenizing {len(records)} samples, batch size {args.batch_size}")
+    print(f"{'workers':>8} {'seconds':>9} {'samples/s':>11} {'speedup':>8} {'identical':>10}")
+    reference = None
+    results = []
+    for workers in worker_counts:
+        start = time.perf_counter()
+        ids = list(iter_token_ids(records, tokenizer, args.max_length, args.batch_size,
+                                  num_workers=workers))
+        elapsed = time.perf_counter() - start
+        if reference is None:
+            reference, baseline = ids, elapsed
+        result = {
+            "workers": workers,
+            "seconds": elapsed,
+            "samples_per_sec": len(records) / elapsed,
+            "speedup": baseline / elapsed,
+            "identical": ids == reference,
+        }
+        results.append(result)
+        print(f"{workers:>8} {elapsed:>9.2f} {result['samples_per_sec']:>11.0f} "
+              f"{result['speedup']:>7.2f}x {'yes' if result['identical'] else 'NO':>10}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"samples": len(records), "batch_size": args.batch_size, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Crash-safe checkpoint discovery for the PyTorch training path
+
+PyTorch: ManifestCallback writes checkpoint_manifest.json (size and sha256
+of every file) into each Trainer checkpoint once it is completely saved.
+latest_checkpoint() returns the newest checkpoint-N whose files still match
+their manifest, skipping half-written ones, for
+trainer.train(resume_from_checkpoint=...), which restores the weights,
+optimizer, scheduler, RNG and the position in the epoch's batch order.
+Checkpoints from before manifests existed are checked structurally
+(parseable trainer state, intact safetensors and torch zip archives).
+
+MLX checkpoints are handled by mlx_resume.py, which does not need torch.
+
+Usage:
+    python checkpoints.py ./gemma_kazakh_law_finetuned     # Trainer output_dir
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import zipfile
+
+import torch.distributed as dist
+from transformers import TrainerCallback
+
+from mlx_resume import check_safetensors
+
+MANIFEST_NAME = "checkpoint_manifest.json"
+TRAINER_STATE_NAME = "trainer_state.json"
+_CHECKPOINT_DIR = re.compile(r"checkpoint-(\d+)$")
+HASH_CHUNK = 1 << 20
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _atomic_write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def write_manifest(checkpoint_dir):
+    """Record size and sha256 of every file in checkpoint_dir"""
+    files = {}
+    for root, _, names in os.walk(checkpoint_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, checkpoint_dir)
+            if rel == MANIFEST_NAME or rel.endswith(".tmp"):
+                continue
+            files[rel] = {"size": os.path.getsize(path), "sha256": _sha256(path)}
+    _atomic_write_json(os.path.join(checkpoint_dir, MANIFEST_NAME), {"files": files})
+
+
+def _check_zip(path):
+    """torch.save files are zip archives with a CRC per record"""
+    try:
+        with zipfile.ZipFile(path) as archive:
+            bad = archive.testzip()
+    except (OSError, zipfile.BadZipFile) as e:
+        return f"not a valid archive ({e})"
+    return f"corrupt record {bad}" if bad else None
+
+
+def verify_checkpoint(checkpoint_dir):
+    """Reason a Trainer checkpoint cannot be resumed from, or None if it is intact"""
+    manifest_path = os.path.join(checkpoint_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                files = json.load(f)["files"]
+        except (OSError, ValueError, KeyError) as e:
+            return f"unreadable manifest ({e})"
+        for rel, expected in files.items():
+            path = os.path.join(checkpoint_dir, rel)
+            if not os.path.exists(path):
+                return f"{rel} is missing"
+            if os.path.getsize(path) != expected["size"] or _sha256(path) != expected["sha256"]:
+                return f"{rel} does not match the manifest"
+        return None
+
+    # No manifest: saving was interrupted, or the checkpoint predates manifests
+    try:
+        with open(os.path.join(checkpoint_dir, TRAINER_STATE_NAME), 'r', encoding='utf-8') as f:
+            json.load(f)
+    except (OSError, ValueError) as e:
+        return f"no manifest and no readable {TRAINER_STATE_NAME} ({e})"
+    names = os.listdir(checkpoint_dir)
+    if not any(name.endswith(".safetensors") or name.endswith(".bin") for name in names):
+        return "no model weights"
+    for name in names:
+        path = os.path.join(checkpoint_dir, name)
+        problem = None
+        if name.endswith(".safetensors"):
+            problem = check_safetensors(path)
+        elif name.endswith(".pt") or name.endswith(".pth") or name.endswith(".bin"):
+            problem = _check_zip(path)
+        if problem:
+            return f"{name}: {problem}"
+    return None
+
+
+def latest_checkpoint(output_dir):
+    """Newest intact checkpoint-N directory in output_dir, or None
+
+    Damaged checkpoints are reported and skipped.
+    """
+    if not os.path.isdir(output_dir):
+        return None
+    candidates = []
+    for name in os.listdir(output_dir):
+        match = _CHECKPOINT_DIR.match(name)
+        path = os.path.join(output_dir, name)
+        if match and os.path.isdir(path):
+            candidates.append((int(match.group(1)), path))
+    for _, path in sorted(candidates, reverse=True):
+        problem = verify_checkpoint(path)
+        if problem is None:
+            return path
+        print(f"Skipping damaged checkpoint {path}: {problem}")
+    return None
+
+
+class ManifestCallback(TrainerCallback):
+    """Seal each Trainer checkpoint with a manifest once it is fully written"""
+
+    def on_save(self, args, state, control, **kwargs):
+        if dist.is_available() and dist.is_initialized():
+            dist.barrier()  # every rank has written its files (e.g. rng_state_N.pth)
+        if not state.is_world_process_zero:
+            return
+        checkpoint_dir = os.path.join(args.output_dir, f"checkpoint-{state.global_step}")
+        if os.path.isdir(checkpoint_dir):
+            write_manifest(checkpoint_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the newest intact checkpoint")
+    parser.add_argument("directory", help="Trainer output_dir")
+    args = parser.parse_args()
+
+    latest = latest_checkpoint(args.directory)
+    print(f"Resume from: {latest or 'nothing (fresh start)'}")
+
+
+if __name__ == "__main__":
+    main()
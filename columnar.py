@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Columnar Parquet/Arrow export of the QA corpus
+
+The JSONL corpus is converted once into typed columns (instruction, output,
+quality_score, complexity, source_file and, optionally, pre-tokenized
+input_ids). Analysis reads only the columns it needs, and training maps the
+file instead of parsing text:
+
+- *.arrow files use the Arrow IPC stream format, which is memory-mapped
+  without copies (datasets.Dataset.from_file opens them directly);
+- *.parquet files are compressed and smaller, read column-pruned.
+
+Usage:
+    python columnar.py export --dataset final_training_dataset/kazakh_law_qa_full_20250702_013138.jsonl \\
+        --output final_training_dataset/kazakh_law_qa_full.arrow --model google/gemma-3-1b-it
+    python columnar.py stats final_training_dataset/kazakh_law_qa_full.arrow
+"""
+
+import argparse
+import json
+import os
+import time
+from collections import deque
+from itertools import islice
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import torch
+
+from jsonl_stream import iter_jsonl
+from prompt_format import PROMPT_TEMPLATE
+from token_shards import StaleShardError, iter_token_ids, tokenizer_fingerprint
+
+ROW_GROUP_SIZE = 4096
+
+TEXT_FIELDS = [
+    pa.field("instruction", pa.string()),
+    pa.field("output", pa.string()),
+    pa.field("quality_score", pa.float32()),
+    pa.field("complexity", pa.dictionary(pa.int8(), pa.string())),
+    pa.field("source_file", pa.dictionary(pa.int32(), pa.string())),
+]
+TOKENS_FIELD = pa.field("input_ids", pa.list_(pa.uint32()))
+
+
+def corpus_schema(tokenized=False, metadata=None):
+    fields = TEXT_FIELDS + ([TOKENS_FIELD] if tokenized else [])
+    return pa.schema(fields, metadata=metadata)
+
+
+def _record_batch(items, schema, token_ids=None):
+    columns = {
+        "instruction": [item['instruction'] for item in items],
+        "output": [item['output'] for item in items],
+        "quality_score": [item.get('quality_score') for item in items],
+        "complexity": [item.get('complexity') for item in items],
+        "source_file": [item.get('source_file') for item in items],
+    }
+    if token_ids is not None:
+        columns["input_ids"] = token_ids
+    arrays = [pa.array(columns[field.name], type=field.type) for field in schema]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class _Writer:
+    """Parquet or Arrow IPC stream writer chosen by file extension"""
+
+    def __init__(self, path, schema, parquet):
+        self.parquet = parquet
+        if self.parquet:
+            self.writer = pq.ParquetWriter(path, schema, compression="zstd")
+        else:
+            self.sink = pa.OSFile(path, 'wb')
+            self.writer = pa.ipc.new_stream(self.sink, schema)
+
+    def write(self, batch):
+        if self.parquet:
+            self.writer.write_batch(batch, row_group_size=ROW_GROUP_SIZE)
+        else:
+            self.writer.write_batch(batch)
+
+    def close(self):
+        self.writer.close()
+        if not self.parquet:
+            self.sink.close()
+
+
+def export_columnar(records, output_path, tokenizer=None, max_length=512, num_workers=1):
+    """Write records to output_path (.parquet or .arrow) in ROW_GROUP_SIZE batches
+
+    With a tokenizer, an input_ids column holds the prompt tokens truncated
+    to max_length; the tokenizer fingerprint, max_length and prompt template
+    are stored in the schema metadata. Returns the number of rows written.
+    """
+    metadata = None
+    if tokenizer is not None:
+        metadata = {
+            "tokenizer_fingerprint": tokenizer_fingerprint(tokenizer),
+            "max_length": str(max_length),
+            "prompt_template": PROMPT_TEMPLATE,
+        }
+    schema = corpus_schema(tokenizer is not None, metadata)
+
+    # One tokenizer pass (and one worker pool) over the whole stream, paired back
+    # with its records; only the batches in flight are buffered
+    token_stream = None
+    if tokenizer is None:
+        rows_iter = ((item, None) for item in records)
+    else:
+        buffered = deque()
+
+        def remember(records):
+            for item in records:
+                buffered.append(item)
+                yield item
+
+        token_stream = iter_token_ids(remember(records), tokenizer, max_length, num_workers=num_workers)
+        rows_iter = ((buffered.popleft(), ids) for ids in token_stream)
+
+    tmp_path = f"{output_path}.tmp"
+    writer = _Writer(tmp_path, schema, output_path.endswith(".parquet"))
+    rows = 0
+    try:
+        while True:
+            group = list(islice(rows_iter, ROW_GROUP_SIZE))
+            if not group:
+                break
+            items = [item for item, _ in group]
+            token_ids = [ids for _, ids in group] if tokenizer is not None else None
+            writer.write(_record_batch(items, schema, token_ids))
+            rows += len(items)
+    finally:
+        if token_stream is not None:
+            token_stream.close()  # shuts the worker pool down on errors too
+        writer.close()
+    os.replace(tmp_path, output_path)
+    return rows
+
+
+def load_table(path, columns=None, filters=None):
+    """Read a columnar export, touching only the requested columns
+
+    .arrow files are memory-mapped (zero-copy); .parquet files are read
+    column- and row-group-pruned, with filters as in pyarrow.parquet.
+    """
+    if path.endswith(".parquet"):
+        return pq.read_table(path, columns=columns, filters=filters, memory_map=True)
+    # Buffers of the table point into the mapping, which stays open while they are referenced
+    table = pa.ipc.open_stream(pa.memory_map(path, 'r')).read_all()
+    if columns is not None:
+        table = table.select(columns)
+    if filters is not None:
+        table = table.filter(pq.filters_to_expression(filters))
+    return table
+
+
+def column_stats(table):
+    """Quality-by-complexity summary, as the analysis CSV was used for"""
+    # Each record batch carries its own dictionary for the categorical columns
+    grouped = table.unify_dictionaries().group_by("complexity").aggregate([
+        ("quality_score", "count"),
+        ("quality_score", "mean"),
+        ("quality_score", "min"),
+        ("quality_score", "max"),
+    ])
+    stats = {}
+    for row in grouped.to_pylist():
+        stats[row["complexity"]] = {
+            "count": row["quality_score_count"],
+            "mean": row["quality_score_mean"],
+            "min": row["quality_score_min"],
+            "max": row["quality_score_max"],
+        }
+    return stats
+
+
+def check_metadata(metadata, tokenizer=None, max_length=None):
+    """Raise StaleShardError if the export's tokens do not match the current run"""
+    metadata = {k.decode(): v.decode() for k, v in metadata.items()}
+    if "tokenizer_fingerprint" not in metadata:
+        raise StaleShardError("export has no input_ids column; re-export with --model")
+    if metadata.get("prompt_template") != PROMPT_TEMPLATE:
+        raise StaleShardError("prompt template changed")
+    if max_length is not None and int(metadata["max_length"]) != max_length:
+        raise StaleShardError(f"max_length {metadata['max_length']} != {max_length}")
+    if tokenizer is not None and metadata["tokenizer_fingerprint"] != tokenizer_fingerprint(tokenizer):
+        raise StaleShardError("tokenizer fingerprint changed")
+
+
+class ArrowTokenDataset(torch.utils.data.Dataset):
+    """Pre-tokenized samples served from a memory-mapped .arrow export
+
+    Same interface as token_shards.TokenShardDataset: items are
+    {"input_ids": tensor} and lengths holds every sample's token count.
+    """
+
+    def __init__(self, path, tokenizer=None, max_length=None):
+        if path.endswith(".parquet"):
+            raise ValueError("training reads .arrow exports; Parquet pages must be decompressed")
+        self.path = path
+        self.table = load_table(path, ["input_ids"])
+        check_metadata(self.table.schema.metadata or {}, tokenizer, max_length)
+        # One (offsets, values) pair of zero-copy views per record batch in the file
+        self.chunks = [(chunk.offsets.to_numpy(), chunk.values.to_numpy())
+                       for chunk in self.table.column("input_ids").chunks]
+        self.lengths = np.concatenate([np.diff(offsets) for offsets, _ in self.chunks] or [np.zeros(0, np.int64)])
+        self.chunk_starts = np.cumsum([0] + [len(offsets) - 1 for offsets, _ in self.chunks])
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def length(self, i):
+        return int(self.lengths[i])
+
+    def __getitem__(self, i):
+        c = int(np.searchsorted(self.chunk_starts, i, side='right')) - 1
+        offsets, values = self.chunks[c]
+        j = i - self.chunk_starts[c]
+        ids = values[offsets[j]:offsets[j + 1]].astype(np.int64)
+        return {"input_ids": torch.from_numpy(ids)}
+
+    def __getstate__(self):
+        # Pickling the table copies its buffers; DataLoader workers started with spawn map the file again
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+
+def _jsonl_stats(dataset_path):
+    rows = {}
+    for item in iter_jsonl(dataset_path):
+        rows.setdefault(item.get('complexity'), []).append(item.get('quality_score'))
+    return {k: {"count": len(v), "mean": float(np.mean(v))} for k, v in rows.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar Parquet/Arrow export of the QA corpus")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="convert a JSONL dataset")
+    export.add_argument("--dataset", required=True)
+    export.add_argument("--output", required=True, help=".arrow (memory-mapped) or .parquet (compressed)")
+    export.add_argument("--model", default=None, help="add an input_ids column tokenized with this model")
+    export.add_argument("--max-length", type=int, default=512)
+    export.add_argument("--workers", type=int, default=1, help="tokenizer processes")
+
+    stats = commands.add_parser("stats", help="quality by complexity from a columnar export")
+    stats.add_argument("path")
+    stats.add_argument("--compare-jsonl", default=None, help="time the same query over this JSONL file")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        tokenizer = None
+        if args.model:
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(args.model)
+        rows = export_columnar(iter_jsonl(args.dataset), args.output, tokenizer, args.max_length, args.workers)
+        print(f"Wrote {rows} rows to {args.output} ({os.path.getsize(args.output) / 1e6:.1f} MB)")
+        return
+
+    timings = []
+    for _ in range(2):
+        start = time.perf_counter()
+        result = column_stats(load_table(args.path, ["complexity", "quality_score"]))
+        timings.append(time.perf_counter() - start)
+    elapsed = timings[1]
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    # The first query also pays pyarrow's one-time compute initialisation
+    print(f"Columnar query: {elapsed * 1000:.1f} ms (first run {timings[0] * 1000:.1f} ms)")
+    if args.compare_jsonl:
+        start = time.perf_counter()
+        _jsonl_stats(args.compare_jsonl)
+        baseline = time.perf_counter() - start
+        print(f"JSONL query: {baseline * 1000:.1f} ms ({baseline / elapsed:.0f}x slower)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Incremental statistics for the QA corpus (dataset_stats_*.json)
+
+One streaming pass fills NumPy accumulators with the figures the
+dataset_stats_*.json files report (record count, quality stats, complexity
+distribution, character/word lengths) plus a histogram of prompt token
+lengths for a tokenizer, from which exact percentiles are read. The
+accumulators are saved next to the dataset with the byte offset they cover;
+when records are only appended, the next run reads from that offset instead
+of rescanning the file. Any other change to the file, the tokenizer, the
+prompt template or the quality threshold triggers a full rescan.
+
+Usage:
+    python dataset_stats.py --dataset final_training_dataset/kazakh_law_qa_full_20250702_013138.jsonl \\
+        --model google/gemma-3-1b-it
+"""
+
+import argparse
+import hashlib
+import json
+import os
+from collections import Counter
+from datetime import datetime
+from itertools import islice
+
+import numpy as np
+
+from jsonl_stream import JSONLDecodeError, _loads, compression_of, iter_lines
+from prompt_format import PROMPT_TEMPLATE, format_prompt
+from token_shards import tokenizer_fingerprint
+
+STATE_SUFFIX = ".stats.json"
+STATE_VERSION = 1
+QUALITY_THRESHOLD = 0.7
+PERCENTILES = (50, 90, 95, 99)
+BATCH_SIZE = 1000
+# Bytes hashed at the start of the file and just before the resume offset
+_FINGERPRINT_BYTES = 1 << 16
+
+
+def token_lengths(items, tokenizer):
+    """Untruncated token counts of the formatted prompts"""
+    texts = [format_prompt(item['instruction'], item['output']) for item in items]
+    ids = tokenizer(texts, add_special_tokens=True, return_attention_mask=False)["input_ids"]
+    return np.fromiter((len(x) for x in ids), dtype=np.int64, count=len(ids))
+
+
+class StatsAccumulator:
+    """Mergeable running totals behind a dataset_stats report"""
+
+    def __init__(self, quality_threshold=QUALITY_THRESHOLD):
+        self.quality_threshold = quality_threshold
+        self.records = 0
+        self.high_quality = 0
+        self.quality_count = 0
+        self.quality_sum = 0.0
+        self.quality_min = float('inf')
+        self.quality_max = float('-inf')
+        self.complexity = Counter()
+        self.characters = 0
+        self.words = 0
+        self.token_histogram = np.zeros(0, dtype=np.int64)
+
+    def update(self, items, lengths=None):
+        """Add a batch of records and, optionally, their token lengths"""
+        self.records += len(items)
+        quality = np.array([item['quality_score'] for item in items if 'quality_score' in item], dtype=np.float64)
+        if len(quality):
+            self.quality_count += len(quality)
+            self.quality_sum += float(quality.sum())
+            self.quality_min = min(self.quality_min, float(quality.min()))
+            self.quality_max = max(self.quality_max, float(quality.max()))
+            self.high_quality += int((quality >= self.quality_threshold).sum())
+        self.complexity.update(item.get('complexity') for item in items)
+        self.characters += sum(len(item['instruction']) + len(item['output']) for item in items)
+        self.words += sum(len(item['instruction'].split()) + len(item['output'].split()) for item in items)
+        if lengths is not None and len(lengths):
+            counts = np.bincount(lengths)
+            if len(counts) > len(self.token_histogram):
+                self.token_histogram = np.pad(self.token_histogram, (0, len(counts) - len(self.token_histogram)))
+            self.token_histogram[:len(counts)] += counts
+
+    def copy(self):
+        return StatsAccumulator.from_state(self.to_state())
+
+    def to_state(self):
+        state = dict(vars(self))
+        state["complexity"] = dict(self.complexity)
+        nonzero = np.flatnonzero(self.token_histogram)
+        state["token_histogram"] = {str(n): int(self.token_histogram[n]) for n in nonzero}
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        acc = cls(state["quality_threshold"])
+        for key, value in state.items():
+            setattr(acc, key, value)
+        acc.complexity = Counter(state["complexity"])
+        histogram = {int(n): c for n, c in state["token_histogram"].items()}
+        acc.token_histogram = np.zeros(max(histogram, default=-1) + 1, dtype=np.int64)
+        for n, c in histogram.items():
+            acc.token_histogram[n] = c
+        return acc
+
+    def token_length_stats(self):
+        total = int(self.token_histogram.sum())
+        if not total:
+            return None
+        lengths = np.arange(len(self.token_histogram))
+        cumulative = np.cumsum(self.token_histogram)
+        nonzero = np.flatnonzero(self.token_histogram)
+        # Nearest-rank percentiles, exact because lengths are integers
+        percentiles = {f"p{p}": int(np.searchsorted(cumulative, np.ceil(total * p / 100))) for p in PERCENTILES}
+        return {
+            "count": total,
+            "mean": float((lengths * self.token_histogram).sum() / total),
+            "min": int(nonzero[0]),
+            "max": int(nonzero[-1]),
+            **percentiles,
+        }
+
+    def report(self):
+        """Figures in the layout of dataset_stats_*.json"""
+        records = self.records or 1
+        report = {
+            "total_records": self.records,
+            "high_quality_records": self.high_quality,
+            "quality_threshold": self.quality_threshold,
+            "quality_stats": {
+                "count": self.quality_count,
+                "mean": self.quality_sum / self.quality_count if self.quality_count else None,
+                "min": self.quality_min if self.quality_count else None,
+                "max": self.quality_max if self.quality_count else None,
+            },
+            "complexity_distribution": dict(self.complexity.most_common()),
+            "length_stats": {
+                "total_characters": self.characters,
+                "total_words": self.words,
+                "avg_characters": self.characters / records,
+                "avg_words": self.words / records,
+            },
+        }
+        token_stats = self.token_length_stats()
+        if token_stats is not None:
+            report["token_length_stats"] = token_stats
+        return report
+
+
+def _file_fingerprint(dataset_path, offset):
+    """Hash of the file's head and of the bytes just before offset"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(dataset_path, 'rb') as f:
+        h.update(f.read(min(offset, _FINGERPRINT_BYTES)))
+        start = max(0, offset - _FINGERPRINT_BYTES)
+        f.seek(start)
+        h.update(f.read(offset - start))
+    return h.hexdigest()
+
+
+def _load_state(state_path):
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return state if state.get("version") == STATE_VERSION else None
+
+
+def _resume_point(state, dataset_path, config):
+    """Offset to continue from, or None when the saved state cannot be reused"""
+    if state is None or state["config"] != config:
+        return None
+    offset = state["offset"]
+    if os.path.getsize(dataset_path) < offset or _file_fingerprint(dataset_path, offset) != state["fingerprint"]:
+        return None
+    return offset
+
+
+def compute_stats(dataset_path, tokenizer=None, quality_threshold=QUALITY_THRESHOLD, state_path=None,
+                  full=False, batch_size=BATCH_SIZE):
+    """Statistics of dataset_path, resumed from state_path when possible
+
+    state_path defaults to the dataset path + STATE_SUFFIX. Compressed
+    files are always scanned in full and leave no state. Returns (report,
+    info) where info tells whether the run was incremental and how many
+    records it read.
+    """
+    compressed = compression_of(dataset_path) is not None
+    state_path = state_path or f"{dataset_path}{STATE_SUFFIX}"
+    config = {
+        "quality_threshold": quality_threshold,
+        "tokenizer_fingerprint": tokenizer_fingerprint(tokenizer) if tokenizer is not None else None,
+        "prompt_template": PROMPT_TEMPLATE if tokenizer is not None else None,
+    }
+    state = None if full or compressed else _load_state(state_path)
+    offset = _resume_point(state, dataset_path, config)
+    if offset is None:
+        acc, offset, incremental = StatsAccumulator(quality_threshold), 0, False
+    else:
+        acc, incremental = StatsAccumulator.from_state(state["accumulators"]), True
+
+    # Offsets count decompressed bytes, so a compressed file's last line is always complete
+    size = float('inf') if compressed else os.path.getsize(dataset_path)
+    committed = offset
+    pending = None  # a final line without '\n' may still be being written
+    lines = iter_lines(dataset_path, start=offset)
+    read = 0
+    while True:
+        chunk = list(islice(lines, batch_size))
+        if not chunk:
+            break
+        items = []
+        for line_number, line_offset, line in chunk:
+            try:
+                items.append(_loads(line))
+            except ValueError as e:
+                raise JSONLDecodeError(dataset_path, line_number, line_offset, e) from None
+        line_end = chunk[-1][1] + len(chunk[-1][2]) + 1
+        if line_end > size:
+            pending = items.pop()
+        read += len(items)
+        acc.update(items, token_lengths(items, tokenizer) if tokenizer is not None and items else None)
+        committed = min(line_end, size) if pending is None else chunk[-1][1]
+
+    if not compressed:
+        with open(f"{state_path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump({
+                "version": STATE_VERSION,
+                "dataset": os.path.abspath(dataset_path),
+                "offset": committed,
+                "fingerprint": _file_fingerprint(dataset_path, committed),
+                "config": config,
+                "accumulators": acc.to_state(),
+            }, f)
+        os.replace(f"{state_path}.tmp", state_path)
+
+    if pending is not None:
+        acc = acc.copy()
+        acc.update([pending], token_lengths([pending], tokenizer) if tokenizer is not None else None)
+        read += 1
+    report = acc.report()
+    if "token_length_stats" in report:
+        report["token_length_stats"]["tokenizer"] = getattr(tokenizer, "name_or_path", type(tokenizer).__name__)
+    return report, {"incremental": incremental, "records_read": read}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Regenerate dataset_stats_*.json for a JSONL dataset")
+    parser.add_argument("--dataset", required=True)
+    parser.add_argument("--model", default=None, help="add token-length percentiles for this tokenizer")
+    parser.add_argument("--quality-threshold", type=float, default=QUALITY_THRESHOLD)
+    parser.add_argument("--output", default=None,
+                        help="stats file (default: dataset_stats_<timestamp>.json next to the dataset)")
+    parser.add_argument("--full", action="store_true", help="ignore the saved state and rescan")
+    args = parser.parse_args()
+
+    tokenizer = None
+    if args.model:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(args.model)
+
+    report, info = compute_stats(args.dataset, tokenizer, args.quality_threshold, full=args.full)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    output = args.output or os.path.join(os.path.dirname(args.dataset), f"dataset_stats_{timestamp}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({"creation_timestamp": timestamp, **report}, f, ensure_ascii=False, indent=2)
+
+    mode = "incremental" if info["incremental"] else "full scan"
+    print(f"{report['total_records']} records ({info['records_read']} read, {mode}) -> {output}")
+    token_stats = report.get("token_length_stats")
+    if token_stats:
+        print("Token lengths: " + ", ".join(f"{k} {token_stats[k]}" for k in ["p50", "p90", "p95", "p99", "max"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Parallel streaming validator and repairer for the QA JSONL corpus
+
+The file is cut into newline-aligned byte ranges that a spawn process pool
+checks in parallel: JSON syntax, schema (instruction/output strings,
+quality_score in [0, 1], complexity string), empty fields, control
+characters and literal chat-template tokens such as <end_of_turn> inside
+the text. Every issue is reported with its line number and byte offset.
+
+Repair streams the file once more: untouched records are copied byte for
+byte, records with control characters or template tokens are rewritten with
+those removed, and records that cannot be repaired (invalid JSON, wrong
+schema, empty fields) are dropped.
+
+Usage:
+    python dataset_validator.py --dataset final_training_dataset/kazakh_law_qa_full_20250702_013138.jsonl \\
+        --report validation_report.json --repair final_training_dataset/kazakh_law_qa_full_repaired.jsonl
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from jsonl_stream import _BOM, _loads, compression_of, iter_lines, open_jsonl
+from prompt_format import TEMPLATE_TOKENS
+
+# Byte range read by a worker at a time; memory per worker is bounded by it
+RANGE_SIZE = 16 << 20
+TEXT_FIELDS = ("instruction", "output")
+# C0 controls except tab/newline/carriage return, DEL, C1 controls and the
+# Unicode line/paragraph separators that break line-oriented tools
+_CONTROL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f\u2028\u2029]")
+_TEMPLATE = re.compile("|".join(re.escape(token) for token in TEMPLATE_TOKENS))
+# Issue codes that repair fixes in place; the rest drop the record
+REPAIRABLE = {"control_characters", "template_token"}
+
+
+def check_record(record):
+    """[(code, field, message)] for one decoded record"""
+    if not isinstance(record, dict):
+        return [("not_object", None, f"expected an object, got {type(record).__name__}")]
+    issues = []
+    for field in TEXT_FIELDS:
+        value = record.get(field)
+        if value is None:
+            issues.append(("missing_field", field, f"{field} is missing"))
+        elif not isinstance(value, str):
+            issues.append(("wrong_type", field, f"{field} is {type(value).__name__}, not a string"))
+        elif not value.strip():
+            issues.append(("empty_field", field, f"{field} is empty"))
+        else:
+            control = _CONTROL.findall(value)
+            if control:
+                codes = ", ".join(sorted({f"U+{ord(c):04X}" for c in control}))
+                issues.append(("control_characters", field, f"{len(control)} control characters ({codes})"))
+            tokens = _TEMPLATE.findall(value)
+            if tokens:
+                issues.append(("template_token", field, f"contains {', '.join(sorted(set(tokens)))}"))
+    quality = record.get("quality_score")
+    if quality is not None and (isinstance(quality, bool) or not isinstance(quality, (int, float))
+                                or not 0.0 <= quality <= 1.0):
+        issues.append(("bad_quality_score", "quality_score", f"quality_score {quality!r} is not a number in [0, 1]"))
+    complexity = record.get("complexity")
+    if complexity is not None and not isinstance(complexity, str):
+        issues.append(("wrong_type", "complexity", f"complexity is {type(complexity).__name__}, not a string"))
+    return issues
+
+
+def repair_record(record):
+    """Copy of record with control characters and template tokens removed"""
+    fixed = dict(record)
+    for field in TEXT_FIELDS:
+        fixed[field] = _TEMPLATE.sub("", _CONTROL.sub("", fixed[field]))
+    return fixed
+
+
+def _check_line(line, issues, line_number, offset):
+    try:
+        record = _loads(line)
+    except ValueError as e:
+        issues.append({"line": line_number, "offset": offset, "code": "invalid_json", "field": None,
+                       "message": str(e)})
+        return
+    for code, field, message in check_record(record):
+        issues.append({"line": line_number, "offset": offset, "code": code, "field": field, "message": message})
+
+
+def byte_ranges(file_path, range_size=RANGE_SIZE):
+    """[(start, end)] covering the file, each boundary just after a newline"""
+    size = os.path.getsize(file_path)
+    bounds = [0]
+    with open(file_path, 'rb') as f:
+        for approx in range(range_size, size, range_size):
+            if approx <= bounds[-1]:
+                continue
+            f.seek(approx)
+            f.readline()
+            if f.tell() >= size:
+                break
+            bounds.append(f.tell())
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def validate_range(file_path, start, end):
+    """Check the lines in [start, end); line numbers are relative to start
+
+    Returns (number of lines, records, issues).
+    """
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    offset = start
+    if start == 0 and data.startswith(_BOM):
+        data = data[len(_BOM):]
+        offset = len(_BOM)
+    lines = data.split(b'\n')
+    if lines and not lines[-1]:
+        lines.pop()  # the range ends with a newline
+    issues = []
+    records = 0
+    for i, line in enumerate(lines, 1):
+        if line.strip():
+            records += 1
+            _check_line(line, issues, i, offset)
+        offset += len(line) + 1
+    return len(lines), records, issues
+
+
+def _validate_stream(file_path):
+    """Single-process check for files that cannot be split (compressed)"""
+    issues = []
+    records = 0
+    for line_number, offset, line in iter_lines(file_path):
+        records += 1
+        _check_line(line, issues, line_number, offset)
+    return records, issues
+
+
+def validate(file_path, num_workers=None, range_size=RANGE_SIZE):
+    """Validate a JSONL file; returns a report dict
+
+    Compressed files are checked in a single process, with offsets into the
+    decompressed stream.
+    """
+    if compression_of(file_path):
+        records, issues = _validate_stream(file_path)
+    else:
+        ranges = byte_ranges(file_path, range_size)
+        num_workers = min(num_workers or os.cpu_count() or 1, len(ranges))
+        if num_workers > 1:
+            with ProcessPoolExecutor(max_workers=num_workers,
+                                     mp_context=multiprocessing.get_context("spawn")) as pool:
+                results = list(pool.map(validate_range, [file_path] * len(ranges),
+                                        *zip(*ranges)))
+        else:
+            results = [validate_range(file_path, start, end) for start, end in ranges]
+        # Turn per-range line numbers into file line numbers
+        issues = []
+        records = 0
+        first_line = 0
+        for lines, range_records, range_issues in results:
+            for issue in range_issues:
+                issue["line"] += first_line
+            issues.extend(range_issues)
+            records += range_records
+            first_line += lines
+
+    for issue in issues:
+        issue["action"] = "repair" if issue["code"] in REPAIRABLE else "drop"
+    dropped = {i["offset"] for i in issues if i["action"] == "drop"}
+    repaired = {i["offset"] for i in issues if i["action"] == "repair"} - dropped
+    return {
+        "file": str(file_path),
+        "records": records,
+        "valid_records": records - len(dropped) - len(repaired),
+        "records_to_repair": len(repaired),
+        "records_to_drop": len(dropped),
+        "issue_counts": dict(Counter(i["code"] for i in issues).most_common()),
+        "issues": issues,
+    }
+
+
+def repair(file_path, output_path, report):
+    """Stream file_path to output_path, fixing or dropping the reported records
+
+    Records without issues are copied unchanged. Returns the counts of
+    written, repaired and dropped records.
+    """
+    actions = {}
+    for issue in report["issues"]:
+        if actions.get(issue["offset"]) != "drop":
+            actions[issue["offset"]] = issue["action"]
+    counts = Counter()
+    # The compression suffix stays last so the temporary file is written compressed too
+    root, ext = os.path.splitext(output_path) if compression_of(output_path) else (output_path, "")
+    tmp_path = f"{root}.tmp{ext}"
+    with open_jsonl(tmp_path, 'w', buffering=1 << 20) as out:
+        for _, offset, line in iter_lines(file_path):
+            action = actions.get(offset)
+            if action == "drop":
+                counts["dropped"] += 1
+                continue
+            if action == "repair":
+                fixed = repair_record(_loads(line))
+                if check_record(fixed):  # e.g. a field held nothing but template tokens
+                    counts["dropped"] += 1
+                    continue
+                out.write(json.dumps(fixed, ensure_ascii=False) + '\n')
+                counts["repaired"] += 1
+            else:
+                out.write(line.decode('utf-8') + '\n')
+            counts["written"] += 1
+    os.replace(tmp_path, output_path)
+    return {"written": counts["written"], "repaired": counts["repaired"], "dropped": counts["dropped"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate (and repair) a QA JSONL dataset")
+    parser.add_argument("--dataset", required=True)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--report", default=None, help="write the issue report as JSON")
+    parser.add_argument("--repair", default=None, help="write a repaired copy of the dataset here")
+    args = parser.parse_args()
+
+    report = validate(args.dataset, args.workers)
+    print(f"{report['records']} records: {report['valid_records']} valid, "
+          f"{report['records_to_repair']} repairable, {report['records_to_drop']} unrepairable")
+    for code, count in report["issue_counts"].items():
+        print(f"  {code}: {count}")
+    for issue in report["issues"][:10]:
+        print(f"  line {issue['line']} (byte {issue['offset']}): {issue['code']} {issue['message']}")
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.repair:
+        counts = repair(args.dataset, args.repair, report)
+        print(f"Wrote {counts['written']} records to {args.repair} "
+              f"({counts['repaired']} repaired, {counts['dropped']} dropped)")
+
+
+if __name__ == "__main__":
+    main()
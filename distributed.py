@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Multi-process data-parallel training for the PyTorch training path
+
+Launched with torchrun, fine_tune_gemma_local.py trains one model replica
+per process. Trainer (through accelerate) wraps the model in
+DistributedDataParallel, shards each epoch's batches across the processes
+and saves checkpoints from rank 0 only. DDP all-reduces the gradients of
+parameters with requires_grad, which after get_peft_model are only the LoRA
+adapters: the frozen base model is never communicated. CPU processes use
+the gloo backend, so several processes on one machine, several sockets or
+several machines all work without GPUs.
+
+Usage:
+    # One machine, 4 processes
+    torchrun --standalone --nproc-per-node 4 fine_tune_gemma_local.py
+    # Two machines, 2 processes each (run on both, --node-rank 0 and 1)
+    torchrun --nnodes 2 --node-rank 0 --nproc-per-node 2 --master-addr host0 --master-port 29500 \\
+        fine_tune_gemma_local.py
+"""
+
+import os
+from contextlib import contextmanager
+
+import torch
+import torch.distributed as dist
+
+
+def world():
+    """rank, local_rank, world_size and local_world_size as set by torchrun"""
+    return {
+        "rank": int(os.environ.get("RANK", 0)),
+        "local_rank": int(os.environ.get("LOCAL_RANK", 0)),
+        "world_size": int(os.environ.get("WORLD_SIZE", 1)),
+        "local_world_size": int(os.environ.get("LOCAL_WORLD_SIZE", 1)),
+    }
+
+
+def is_distributed():
+    return world()["world_size"] > 1
+
+
+def backend(device):
+    return "nccl" if device == "cuda" else "gloo"
+
+
+def init(device):
+    """Join the process group early, so data preparation can be coordinated
+
+    Trainer reuses an initialised group. Returns world().
+    """
+    info = world()
+    if info["world_size"] > 1 and not dist.is_initialized():
+        dist.init_process_group(backend(device))
+    return info
+
+
+def shutdown():
+    if dist.is_initialized():
+        dist.destroy_process_group()
+
+
+def _cores():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def configure_threads(local_world_size, threads=None):
+    """Split this machine's cores between its processes (torchrun sets OMP_NUM_THREADS=1)
+
+    Returns the intra-op threads set for this process.
+    """
+    threads = threads or max(1, _cores() // local_world_size)
+    torch.set_num_threads(threads)
+    return threads
+
+
+@contextmanager
+def main_process_first(local=True):
+    """Run the block on each node's local rank 0 first (e.g. compiling the token shard), then on the others
+
+    Nodes without a shared filesystem each prepare their own copy. Pass
+    local=False when they share the working directory, so that only global
+    rank 0 writes it.
+    """
+    info = world()
+    first = not dist.is_initialized() or info["local_rank" if local else "rank"] == 0
+    if not first:
+        dist.barrier()
+    try:
+        yield
+    finally:
+        if first and dist.is_initialized():
+            dist.barrier()
+
+
+def gradient_accumulation(grad_accum, world_size):
+    """Accumulation steps per process keeping at least the single-process batch per optimizer step"""
+    return max(1, -(-grad_accum // world_size))
+
+
+def adapter_divergence(model):
+    """Largest difference of any trainable parameter from rank 0's copy (0.0 when in sync)"""
+    if not dist.is_initialized():
+        return 0.0
+    worst = torch.zeros(())
+    for param in model.parameters():
+        if param.requires_grad:
+            reference = param.detach().clone()
+            dist.broadcast(reference, src=0)
+            worst = torch.maximum(worst, (param.detach() - reference).abs().max().cpu())
+    dist.all_reduce(worst, op=dist.ReduceOp.MAX)
+    return worst.item()
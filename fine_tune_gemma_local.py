@@ -4,12 +4,14 @@ Fine-tune Gemma 3 4B on Kazakh Law QA dataset using QLoRA
 Optimized for Mac M1 Pro with 16GB RAM
 """
 
+import argparse
+import functools
 import os
 import sys
 
 # Force use only GPU 0 (RTX 4070) on multi-GPU systems
-# Must be set BEFORE importing torch
-if 'CUDA_VISIBLE_DEVICES' not in os.environ:
+# Must be set BEFORE importing torch; under torchrun each process uses its LOCAL_RANK GPU instead
+if 'CUDA_VISIBLE_DEVICES' not in os.environ and 'LOCAL_RANK' not in os.environ:
     os.environ['CUDA_VISIBLE_DEVICES'] = '0'
 
 # Workaround for MLX import error on non-Mac systems
@@ -41,18 +43,38 @@ if sys.platform != 'darwin':
     
     sys.modules['mlx.core'] = mlx_core
 
-import json
+from pathlib import Path
+
 import torch
-from datasets import Dataset
 from transformers import (
     AutoTokenizer, 
     AutoModelForCausalLM,
     TrainingArguments,
-    Trainer,
-    DataCollatorForSeq2Seq
 )
 from peft import LoraConfig, get_peft_model, TaskType
 
+import distributed
+from async_checkpoint import AsyncCheckpointTrainer
+from batch_finder import BatchConfigMismatch, device_memory, find_batch_size, load_config, save_config
+from batching import BatchingTrainer, LengthGroupedBatchSampler, TokenBudgetBatchSampler
+from checkpoints import ManifestCallback, latest_checkpoint
+from columnar import ArrowTokenDataset
+from jsonl_stream import iter_jsonl
+from memory_estimate import preflight, print_breakdown
+from packing import PackedCollator, PackedDataset, packing_report
+from prefetch import prefetch_args
+from subset_sampling import sample_subset
+from throughput import ThroughputCallback
+from token_shards import (
+    StaleShardError,
+    TokenShardCollator,
+    compile_shard,
+    load_shard,
+    source_info,
+)
+from tokenization_cache import TokenizationCache
+from validation import EarlyStoppingReport, holdout_split
+
 # Check device availability (CUDA for Linux, MPS for Mac, CPU as fallback)
 if torch.cuda.is_available():
     device = "cuda"
@@ -66,43 +88,58 @@ if device == "cuda":
     print(f"Memory: {torch.cuda.get_device_properties(0).total_memory / 1e9:.2f} GB")
 
 def load_jsonl_dataset(file_path):
-    """Load JSONL dataset"""
-    data = []
-    with open(file_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            data.append(json.loads(line))
-    return data
+    """Stream records from a JSONL dataset (.gz/.zst decompressed on the fly)"""
+    return iter_jsonl(file_path)
 
-def format_prompt(instruction, output):
-    """Format prompt in Gemma chat format"""
-    return f"<bos><start_of_turn>user\n{instruction}<end_of_turn>\n<start_of_turn>model\n{output}<end_of_turn><eos>"
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fine-tune Gemma 3 on Kazakh Law QA with LoRA")
+    parser.add_argument("--packing", action="store_true",
+                        help="pack several samples into each max_length sequence")
+    parser.add_argument("--batching", choices=["random", "length", "token-budget"], default="random",
+                        help="random batches, batches grouped by similar token length, "
+                             "or length-grouped batches filled up to --max-tokens")
+    parser.add_argument("--max-tokens", type=int, default=None,
+                        help="padded tokens per micro-batch for token-budget batching "
+                             "(default: batch size x max_length)")
+    parser.add_argument("--columnar", default=None,
+                        help="train on a pre-tokenized .arrow export (columnar.py export --model ...) "
+                             "instead of the token shard")
+    parser.add_argument("--find-batch-size", action="store_true",
+                        help="probe the largest safe micro-batch, write --batch-config and exit")
+    parser.add_argument("--batch-config", default="batch_config.json",
+                        help="micro-batch/accumulation config written by --find-batch-size, used when present")
+    parser.add_argument("--async-checkpoints", action="store_true",
+                        help="save only the LoRA adapter, on a background thread")
+    parser.add_argument("--checkpoint-optimizer", action="store_true",
+                        help="with --async-checkpoints, also save optimizer state (exact resume)")
+    parser.add_argument("--eval-fraction", type=float, default=0.1,
+                        help="share of samples held out for validation (0 disables evaluation and early stopping)")
+    parser.add_argument("--eval-samples", type=int, default=64,
+                        help="held-out samples evaluated every --eval-steps (the full split is evaluated at the end)")
+    parser.add_argument("--eval-steps", type=int, default=50,
+                        help="optimizer steps between evaluations; must divide save_steps (100)")
+    parser.add_argument("--patience", type=int, default=3,
+                        help="evaluations without a lower validation loss before training stops")
+    parser.add_argument("--dataloader-workers", type=int, default=None,
+                        help="processes collating batches ahead of the training step "
+                             "(default: 1 on CPU/MPS, up to 4 on CUDA; 0 loads on the main process)")
+    parser.add_argument("--threads-per-process", type=int, default=None,
+                        help="intra-op threads of each torchrun process on CPU "
+                             "(default: this machine's cores split between its processes)")
+    return parser.parse_args()
 
-def preprocess_dataset(data, tokenizer, max_length=1024):
-    """Preprocess dataset for training"""
-    formatted_texts = []
-    
-    for item in data:
-        formatted_text = format_prompt(item['instruction'], item['output'])
-        formatted_texts.append(formatted_text)
-    
-    # Tokenize without converting to tensors (DataCollator will handle padding)
-    tokenized = tokenizer(
-        formatted_texts,
-        truncation=True,
-        padding=False,
-        max_length=max_length,
-    )
+def main():
+    args = parse_args()
     
-    # Create dataset with labels = input_ids for causal LM
-    dataset = Dataset.from_dict({
-        "input_ids": tokenized["input_ids"],
-        "attention_mask": tokenized["attention_mask"],
-        "labels": tokenized["input_ids"]  # For causal LM
-    })
+    # Data-parallel when launched with torchrun (see distributed.py); gloo on CPU
+    world = distributed.init(device)
+    if world["world_size"] > 1:
+        if args.find_batch_size:
+            sys.exit("--find-batch-size probes a single process; run it without torchrun")
+        if device == "cpu":
+            threads = distributed.configure_threads(world["local_world_size"], args.threads_per_process)
+            print(f"Rank {world['rank']}/{world['world_size']}: {threads} CPU threads")
     
-    return dataset
-
-def main():
     # Model configuration
     model_name = "google/gemma-3-1b-it"  # Gemma 3 1B - optimal for M1 Pro 16GB
     dataset_path = "final_training_dataset/kazakh_law_qa_high_quality_20250702_013138.jsonl"
@@ -148,29 +185,120 @@ def main():
         print(f"Moving model to {device}...")
         model = model.to(device)
     
-    print("Loading and preprocessing dataset...")
+    max_length = 512
+    target_batch_size = 8  # Examples per optimizer step
     
-    # Load dataset
-    raw_data = load_jsonl_dataset(dataset_path)
-    print(f"Loaded {len(raw_data)} samples")
+    if args.find_batch_size:
+        # Probe with gradient checkpointing on, as Trainer will train
+        model.gradient_checkpointing_enable(gradient_checkpointing_kwargs={"use_reentrant": False})
+        print("Probing micro-batch sizes...")
+        batch_config = find_batch_size(model, [max_length // 4, max_length // 2, max_length],
+                                       target_batch_size, device, model_name=model_name)
+        save_config(batch_config, args.batch_config)
+        print(f"Micro-batch {batch_config['per_device_train_batch_size']} x "
+              f"{batch_config['gradient_accumulation_steps']} accumulation -> {args.batch_config}")
+        return
     
-    # Use subset for testing (remove [:500] for full dataset)
-    train_data = raw_data[:500]  # Start with 500 samples for testing
+    print("Loading and preprocessing dataset...")
     
-    # Preprocess
-    train_dataset = preprocess_dataset(train_data, tokenizer, max_length=512)
+    train_samples = 500  # Start with 500 samples for testing (None for full dataset)
+    sample_seed = 0
+    tokenize_workers = os.cpu_count() or 1  # Process pool for shard compilation (1 = serial)
+    
+    # Pre-tokenized shard: compiled once, then memory-mapped on every run
+    shard_dir = f"token_shards/{Path(dataset_path).stem}_{max_length}"
+    sample = None if train_samples is None else {"size": train_samples, "seed": sample_seed}
+    source = source_info(dataset_path, sample=sample)
+    if args.columnar:
+        # Memory-mapped Arrow export; no text is parsed or tokenized
+        train_dataset = ArrowTokenDataset(args.columnar, tokenizer, max_length)
+        print(f"Loaded {len(train_dataset)} pre-tokenized samples from {args.columnar}")
+    else:
+        # Rank 0 compiles a missing or stale shard; the other processes then map it
+        with distributed.main_process_first():
+            try:
+                train_dataset = load_shard(shard_dir, tokenizer, max_length, source)
+                print(f"Loaded {len(train_dataset)} pre-tokenized samples from {shard_dir}")
+            except (FileNotFoundError, StaleShardError) as e:
+                print(f"Compiling token shard {shard_dir} ({e})...")
+        
+                # Only records added or changed since the last compile are re-tokenized
+                cache = TokenizationCache()
+                # Streamed (plain, .gz or .zst); the subset is drawn in the same single pass
+                records = load_jsonl_dataset(dataset_path)
+                if train_samples is not None:
+                    # Quality-weighted, complexity-stratified subset
+                    records = [item for _, item in sample_subset(records, train_samples, seed=sample_seed)]
+                    print(f"Sampled {len(records)} samples")
+                compile_shard(records, tokenizer, shard_dir, max_length, source,
+                              cache=cache, num_workers=tokenize_workers)
+                print(f"Tokenization cache: {cache.hits} hits, {cache.misses} misses")
+                cache.close()
+                train_dataset = load_shard(shard_dir)
+    
+    eval_dataset = heldout_dataset = None
+    if args.eval_fraction > 0:
+        # Fixed by sample_seed, so a resumed run validates on the same held-out samples
+        train_dataset, heldout_dataset, eval_dataset = holdout_split(
+            train_dataset, args.eval_fraction, args.eval_samples, seed=sample_seed)
+        print(f"Held out {len(heldout_dataset)} samples for validation, {len(eval_dataset)} evaluated "
+              f"every {args.eval_steps} steps")
     
     print("Setting up training arguments...")
     
     # Training arguments optimized for available hardware
-    # RTX 4070 12GB can handle batch_size=2 with Gemma 1B
-    batch_size = 2 if device == "cuda" else 1
-    grad_accum = 4 if device == "cuda" else 4  # Effective batch = 8
-    pin_memory = True if device == "cuda" else False
+    if os.path.exists(args.batch_config):
+        # Largest micro-batch that fit when probed with --find-batch-size on this machine
+        try:
+            batch_config = load_config(args.batch_config, model_name, device, max_length)
+        except BatchConfigMismatch as e:
+            sys.exit(f"{args.batch_config} does not match this run ({e}); "
+                     "re-probe with --find-batch-size or pass another --batch-config")
+        batch_size = batch_config["per_device_train_batch_size"]
+        grad_accum = batch_config["gradient_accumulation_steps"]
+        print(f"Using {args.batch_config}: micro-batch {batch_size} x {grad_accum} accumulation")
+    else:
+        # RTX 4070 12GB can handle batch_size=2 with Gemma 1B
+        batch_size = 2 if device == "cuda" else 1
+        grad_accum = 4 if device == "cuda" else 4  # Effective batch = 8
+    if world["world_size"] > 1:
+        # Every process contributes a micro-batch per accumulation step
+        grad_accum = distributed.gradient_accumulation(grad_accum, world["world_size"])
+        print(f"Data-parallel over {world['world_size']} processes: effective batch "
+              f"{batch_size} x {grad_accum} x {world['world_size']}")
+    # Batches are collated ahead in worker processes (pinned, copied non-blocking on CUDA)
+    input_pipeline = prefetch_args(device, args.dataloader_workers)
+    
+    # Pre-flight memory check from the configs, before any training state is allocated
+    micro_batch = batch_size
+    if args.batching == "token-budget":
+        micro_batch = -(-(args.max_tokens or batch_size * max_length) // max_length)
+    # Processes on one machine share its RAM
+    memory_limit = device_memory(device) // world["local_world_size"] if device == "cpu" else None
+    estimate = preflight(model.config, lora_config, micro_batch, max_length, device, model.dtype,
+                         memory_limit=memory_limit)
+    print(f"Estimated peak memory: {estimate['required'] / 2**30:.2f} GiB "
+          f"of {estimate['available'] / 2**30:.2f} GiB available")
+    if not estimate["fits"]:
+        print_breakdown(estimate)
+        sys.exit("Estimated peak memory exceeds the device's; lower the micro-batch or run --find-batch-size")
+    
+    # Validation: loss only (no logits gathered), same micro-batch as training (no activations kept)
+    eval_kwargs = {}
+    if eval_dataset is not None:
+        eval_kwargs = dict(
+            eval_strategy="steps",
+            eval_steps=args.eval_steps,
+            per_device_eval_batch_size=micro_batch,
+            prediction_loss_only=True,
+            metric_for_best_model="eval_loss",
+            greater_is_better=False,
+            load_best_model_at_end=True,  # the adapter from the best evaluation is what gets saved
+        )
     
     training_args = TrainingArguments(
         output_dir=output_dir,
-        num_train_epochs=3,
+        num_train_epochs=3,  # upper bound; early stopping ends sooner once validation loss plateaus
         per_device_train_batch_size=batch_size,
         gradient_accumulation_steps=grad_accum,
         learning_rate=2e-4,
@@ -181,38 +309,94 @@ def main():
         warmup_steps=50,
         lr_scheduler_type="cosine",
         fp16=True,  # Use mixed precision
-        dataloader_pin_memory=pin_memory,
         remove_unused_columns=False,
         report_to=[],  # Disable wandb/tensorboard
+        ddp_backend=distributed.backend(device) if world["world_size"] > 1 else None,
         gradient_checkpointing=True,  # Required for LoRA to work properly
-        gradient_checkpointing_kwargs={"use_reentrant": False}  # Use non-reentrant checkpointing
+        gradient_checkpointing_kwargs={"use_reentrant": False},  # Use non-reentrant checkpointing
+        **input_pipeline,
+        **eval_kwargs,
     )
     
-    # Data collator for seq2seq (handles padding properly for causal LM with labels)
-    data_collator = DataCollatorForSeq2Seq(
-        tokenizer=tokenizer,
-        model=model,
-        padding=True,
-    )
+    # Pads shard samples like DataCollatorForSeq2Seq (labels = input_ids, -100 on padding)
+    data_collator = TokenShardCollator(tokenizer.pad_token_id)
+    
+    if args.packing:
+        # Concatenate samples up to max_length; positions and attention reset per sample
+        packed_dataset = PackedDataset(train_dataset, max_length)
+        report = packing_report(train_dataset.lengths, packed_dataset.lengths, batch_size)
+        print(f"Packed {report['samples']} samples into {report['packed_sequences']} sequences")
+        print(f"Padding ratio: {report['padding_ratio_before']:.1%} -> {report['padding_ratio_after']:.1%} "
+              f"(effective tokens/sec x{report['effective_tokens_per_sec_gain']:.2f})")
+        train_dataset = packed_dataset
+        data_collator = PackedCollator(tokenizer.pad_token_id, mask_dtype=model.dtype)
+        if eval_dataset is not None:
+            # Validation batches go through the same collator
+            eval_dataset = PackedDataset(eval_dataset, max_length)
+            heldout_dataset = PackedDataset(heldout_dataset, max_length)
+    
+    batch_sampler = None
+    if args.batching == "length":
+        # Similar-length samples share a batch, batch order stays random each epoch
+        batch_sampler = LengthGroupedBatchSampler(train_dataset.lengths, batch_size, seed=training_args.seed)
+    elif args.batching == "token-budget":
+        # Micro-batches hold up to max_tokens padded tokens instead of a fixed sample count.
+        # With the same grad_accum each optimizer step covers the same token budget as before,
+        # and Trainer normalises the loss by the label tokens of the whole accumulated step.
+        max_tokens = args.max_tokens or batch_size * max_length
+        batch_sampler = TokenBudgetBatchSampler(train_dataset.lengths, max_tokens, seed=training_args.seed)
+        print(f"Token-budget batching: {max_tokens} tokens per micro-batch, "
+              f"{len(batch_sampler)} micro-batches per epoch")
     
     print("Starting training...")
     
-    # Initialize trainer
-    trainer = Trainer(
+    # Initialize trainer (logs padding tokens per step for either batching mode)
+    # Per-step tokens/sec, phase times and peak memory; summary printed at the end
+    callbacks = [ThroughputCallback(os.path.join(output_dir, "throughput.jsonl"))]
+    if args.async_checkpoints:
+        # Adapter-only checkpoints written in the background, sealed and renamed into place
+        trainer_class = functools.partial(AsyncCheckpointTrainer, save_optimizer=args.checkpoint_optimizer)
+        if world["world_size"] > 1:
+            print("--async-checkpoints: multi-process runs save synchronously")
+    else:
+        trainer_class = BatchingTrainer
+    if not args.async_checkpoints or world["world_size"] > 1:
+        # Trainer's synchronous save: marks each checkpoint complete for resume
+        callbacks.append(ManifestCallback())
+    if eval_dataset is not None:
+        # Stop after --patience evaluations without improvement; report the steps and time saved
+        callbacks.append(EarlyStoppingReport(early_stopping_patience=args.patience))
+    trainer = trainer_class(
         model=model,
         args=training_args,
         train_dataset=train_dataset,
+        eval_dataset=eval_dataset,
         data_collator=data_collator,
         tokenizer=tokenizer,
+        batch_sampler=batch_sampler,
+        callbacks=callbacks,
     )
     
+    # Continue an interrupted run from its newest intact checkpoint: weights, optimizer,
+    # scheduler, RNG and position in the batch order are restored
+    resume_from = latest_checkpoint(output_dir)
+    if resume_from:
+        print(f"Resuming from {resume_from}")
+    
     # Start training
-    trainer.train()
+    trainer.train(resume_from_checkpoint=resume_from)
+    
+    if heldout_dataset is not None:
+        metrics = trainer.evaluate(heldout_dataset)
+        print(f"Held-out loss of the final adapter: {metrics['eval_loss']:.4f} ({len(heldout_dataset)} samples)")
     
     print("Saving model...")
     
-    # Save the fine-tuned model
+    # Save the fine-tuned model (written by rank 0 only)
     trainer.save_model(output_dir)
+    if not trainer.is_world_process_zero():
+        distributed.shutdown()
+        return
     tokenizer.save_pretrained(output_dir)
     
     print(f"Training completed! Model saved to {output_dir}")
@@ -242,6 +426,8 @@ def main():
         response = tokenizer.decode(outputs[0], skip_special_tokens=True)
         print(f"Question: {test_prompt}")
         print(f"Answer: {response.split('<start_of_turn>model')[-1]}")
+    
+    distributed.shutdown()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
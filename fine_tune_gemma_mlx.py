@@ -4,10 +4,11 @@ Fine-tune Gemma 3 1B using MLX for Mac M1 Pro
 Based on: https://gist.github.com/alexweberk/635431b5c5773efd6d1755801020429f
 """
 
-import json
 import os
 from pathlib import Path
 
+from mlx_dataset import build_mlx_dataset
+
 def install_mlx():
     """Install MLX if not available"""
     try:
@@ -35,35 +36,13 @@ def prepare_dataset():
     # Load your dataset
     dataset_path = "final_training_dataset/kazakh_law_qa_high_quality_20250702_013138.jsonl"
     
-    # Create data directory
-    os.makedirs("data", exist_ok=True)
-    
-    # Convert to MLX format
-    with open(dataset_path, 'r', encoding='utf-8') as f:
-        raw_data = [json.loads(line) for line in f]
-    
-    # Format for MLX training (first 500 for testing)
-    mlx_data = []
-    for item in raw_data[:500]:  # Start with 500 samples
-        formatted = {
-            "text": f"<bos><start_of_turn>user\n{item['instruction']}<end_of_turn>\n<start_of_turn>model\n{item['output']}<end_of_turn><eos>"
-        }
-        mlx_data.append(formatted)
-    
-    # Save train and valid sets
-    train_size = int(len(mlx_data) * 0.9)
-    train_data = mlx_data[:train_size]
-    valid_data = mlx_data[train_size:]
-    
-    with open("data/train.jsonl", 'w', encoding='utf-8') as f:
-        for item in train_data:
-            f.write(json.dumps(item, ensure_ascii=False) + '\n')
-    
-    with open("data/valid.jsonl", 'w', encoding='utf-8') as f:
-        for item in valid_data:
-            f.write(json.dumps(item, ensure_ascii=False) + '\n')
+    # Format for MLX training (500 for testing), split train/valid by content hash
+    # Quality-weighted subset with the corpus' complexity mix instead of the first 500 rows
+    stats = build_mlx_dataset(dataset_path, "data", sample_size=500)  # Start with 500 samples
     
-    print(f"✅ Подготовлено {len(train_data)} образцов для обучения, {len(valid_data)} для валидации")
+    if stats["skipped"]:
+        print("♻️  Датасет не изменился, используются готовые data/train.jsonl и data/valid.jsonl")
+    print(f"✅ Подготовлено {stats['train']} образцов для обучения, {stats['valid']} для валидации")
 
 def run_mlx_training():
     """Run MLX LoRA training"""
@@ -4,10 +4,14 @@ Fine-tune Gemma 3n E4B using MLX for Mac M1 Pro on full Kazakhstani law dataset
 Based on: https://gist.github.com/alexweberk/635431b5c5773efd6d1755801020429f
 """
 
-import json
 import os
+import sys
 from pathlib import Path
 
+# Shared dataset helpers live in the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from mlx_dataset import build_mlx_dataset
+
 def install_mlx():
     """Install MLX if not available"""
     try:
@@ -35,37 +39,12 @@ def prepare_dataset():
     # Load FULL dataset
     dataset_path = "final_training_dataset/kazakh_law_qa_full_20250702_013138.jsonl"
     
-    # Create data directory
-    os.makedirs("data", exist_ok=True)
-    
-    # Convert to MLX format
-    with open(dataset_path, 'r', encoding='utf-8') as f:
-        raw_data = [json.loads(line) for line in f]
-    
-    print(f"📊 Загружено {len(raw_data)} образцов из полного датасета")
-    
-    # Format for MLX training (ALL data)
-    mlx_data = []
-    for item in raw_data:  # Use ALL samples
-        formatted = {
-            "text": f"<bos><start_of_turn>user\n{item['instruction']}<end_of_turn>\n<start_of_turn>model\n{item['output']}<end_of_turn><eos>"
-        }
-        mlx_data.append(formatted)
-    
-    # Save train and valid sets
-    train_size = int(len(mlx_data) * 0.9)
-    train_data = mlx_data[:train_size]
-    valid_data = mlx_data[train_size:]
-    
-    with open("data/train.jsonl", 'w', encoding='utf-8') as f:
-        for item in train_data:
-            f.write(json.dumps(item, ensure_ascii=False) + '\n')
-    
-    with open("data/valid.jsonl", 'w', encoding='utf-8') as f:
-        for item in valid_data:
-            f.write(json.dumps(item, ensure_ascii=False) + '\n')
+    # Format for MLX training (ALL data), split train/valid by content hash
+    stats = build_mlx_dataset(dataset_path, "data")
     
-    print(f"✅ Подготовлено {len(train_data)} образцов для обучения, {len(valid_data)} для валидации")
+    if stats["skipped"]:
+        print("♻️  Датасет не изменился, используются готовые data/train.jsonl и data/valid.jsonl")
+    print(f"✅ Подготовлено {stats['train']} образцов для обучения, {stats['valid']} для валидации")
 
 def run_mlx_training():
     """Run MLX LoRA training"""
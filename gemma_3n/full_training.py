@@ -4,10 +4,13 @@ Full training script for Gemma 3 4B on complete Kazakhstani law dataset
 """
 
 import os
-import json
 import subprocess
 import sys
-from sklearn.model_selection import train_test_split
+
+# Shared dataset helpers live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mlx_resume import finish_mlx_run, mlx_resume_plan
+from mlx_dataset import build_mlx_dataset
 
 def prepare_full_dataset():
     """Prepare complete dataset for training"""
@@ -20,38 +23,14 @@ def prepare_full_dataset():
         print(f"❌ Файл {dataset_path} не найден!")
         return False
     
-    # Create data directory
-    os.makedirs("data", exist_ok=True)
-    
-    # Load all data
-    with open(dataset_path, 'r', encoding='utf-8') as f:
-        raw_data = [json.loads(line) for line in f]
-    
-    print(f"📊 Загружено {len(raw_data)} образцов из ПОЛНОГО датасета")
-    
-    # Format for MLX training
-    mlx_data = []
-    for item in raw_data:
-        formatted = {
-            "text": f"<bos><start_of_turn>user\n{item['instruction']}<end_of_turn>\n<start_of_turn>model\n{item['output']}<end_of_turn><eos>"
-        }
-        mlx_data.append(formatted)
-    
-    # Split into train/validation (90/10)
-    train_data, valid_data = train_test_split(mlx_data, test_size=0.1, random_state=42)
-    
-    # Save training data
-    with open("data/train.jsonl", 'w', encoding='utf-8') as f:
-        for item in train_data:
-            f.write(json.dumps(item, ensure_ascii=False) + '\n')
+    # Format for MLX training, split into train/validation (90/10) by content hash
+    stats = build_mlx_dataset(dataset_path, "data", valid_fraction=0.1)
     
-    # Save validation data
-    with open("data/valid.jsonl", 'w', encoding='utf-8') as f:
-        for item in valid_data:
-            f.write(json.dumps(item, ensure_ascii=False) + '\n')
-    
-    print(f"✅ Подготовлено {len(train_data)} образцов для обучения, {len(valid_data)} для валидации")
-    print(f"📈 Увеличение: с 7786 до {len(train_data)} (+{len(train_data)-7786} образцов)")
+    if stats["skipped"]:
+        print("♻️  Датасет не изменился, используются готовые data/train.jsonl и data/valid.jsonl")
+    print(f"📊 Обработано {stats['train'] + stats['valid']} образцов из ПОЛНОГО датасета")
+    print(f"✅ Подготовлено {stats['train']} образцов для обучения, {stats['valid']} для валидации")
+    print(f"📈 Увеличение: с 7786 до {stats['train']} (+{stats['train']-7786} образцов)")
     return True
 
 def run_full_training():
@@ -67,6 +46,7 @@ def run_full_training():
     SAVE_EVERY = 200  # Сохранять чаще
     LEARNING_RATE = 1e-4  # Чуть меньше для стабильности
     GRAD_CHECKPOINT = True
+    MAX_RESTARTS = 3  # Automatic resumes after a crash
     
     print(f"🔧 Параметры обучения:")
     print(f"   • Модель: {MODEL_NAME}")
@@ -77,39 +57,55 @@ def run_full_training():
     print(f"   • Градиентные чекпоинты: {'Да' if GRAD_CHECKPOINT else 'Нет'}")
     print()
     
-    # Build MLX command
-    train_cmd = f"TOKENIZERS_PARALLELISM=false python -m mlx_lm.lora " \
-                f"--model {MODEL_NAME} " \
-                f"--train " \
-                f"--iters {ITERS} " \
-                f"--data {DATA_PATH} " \
-                f"--adapter-path ./checkpoints_full " \
-                f"--save-every {SAVE_EVERY} " \
-                f"--batch-size {BATCH_SIZE} " \
-                f"--learning-rate {LEARNING_RATE} "
-    
-    if GRAD_CHECKPOINT:
-        train_cmd += "--grad-checkpoint "
-    
-    print("🖥️  Команда для выполнения:")
-    print(train_cmd)
-    print()
+    # Create checkpoints directory
+    os.makedirs("checkpoints_full", exist_ok=True)
     
-    try:
-        # Create checkpoints directory
-        os.makedirs("checkpoints_full", exist_ok=True)
+    # After a crash, continue from the newest intact checkpoint instead of iteration 0
+    for attempt in range(MAX_RESTARTS + 1):
+        plan = mlx_resume_plan("checkpoints_full", ITERS)
+        if plan["iters"] == 0:
+            break
+        if plan["resume_adapter_file"]:
+            print(f"♻️  Продолжение с итерации {plan['done']}: {plan['resume_adapter_file']}")
         
-        # Run training
-        result = subprocess.run(train_cmd, shell=True, check=True)
+        # Build MLX command
+        train_cmd = f"TOKENIZERS_PARALLELISM=false python -m mlx_lm.lora " \
+                    f"--model {MODEL_NAME} " \
+                    f"--train " \
+                    f"--iters {plan['iters']} " \
+                    f"--data {DATA_PATH} " \
+                    f"--adapter-path {plan['adapter_path']} " \
+                    f"--save-every {SAVE_EVERY} " \
+                    f"--batch-size {BATCH_SIZE} " \
+                    f"--learning-rate {LEARNING_RATE} " \
+                    f"--seed {plan['seed']} "
         
-        print("\\n✅ ПОЛНОЕ ОБУЧЕНИЕ ЗАВЕРШЕНО!")
-        print("📁 Адаптеры сохранены в ./checkpoints_full/")
+        if GRAD_CHECKPOINT:
+            train_cmd += "--grad-checkpoint "
+        if plan["resume_adapter_file"]:
+            train_cmd += f"--resume-adapter-file {plan['resume_adapter_file']} "
         
-        return True
+        print("🖥️  Команда для выполнения:")
+        print(train_cmd)
+        print()
         
-    except subprocess.CalledProcessError as e:
-        print(f"❌ Ошибка обучения: {e}")
-        return False
+        try:
+            # Run training
+            subprocess.run(train_cmd, shell=True, check=True)
+            break
+        except subprocess.CalledProcessError as e:
+            print(f"❌ Ошибка обучения: {e}")
+            if attempt == MAX_RESTARTS:
+                return False
+            print(f"🔁 Перезапуск {attempt + 1}/{MAX_RESTARTS} с последнего чекпоинта...")
+    
+    # A resumed run saved into its own subdirectory; put its final adapters where loaders look
+    finish_mlx_run(plan, "checkpoints_full")
+    
+    print("\\n✅ ПОЛНОЕ ОБУЧЕНИЕ ЗАВЕРШЕНО!")
+    print("📁 Адаптеры сохранены в ./checkpoints_full/")
+    
+    return True
 
 def estimate_training_time():
     """Estimate training time for full dataset"""
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Memory-mapped line-offset index for random access into JSONL datasets
+
+The index is a sidecar file next to the dataset (<file>.idx): a small header
+with the dataset size and mtime followed by one uint64 byte offset per
+non-blank line. Both files are memory-mapped, so shuffling, subsampling and
+splitting read only the lines they touch. Compressed (.gz/.zst) files have
+no byte offsets to seek to and are streamed with jsonl_stream instead.
+
+Usage:
+    with JSONLIndex(dataset_path) as index:
+        records = list(index.iter_records(index.sample(1000, seed=0)))
+"""
+
+import mmap
+import os
+import struct
+from array import array
+
+import numpy as np
+
+from jsonl_stream import _loads, compression_of, iter_lines
+
+INDEX_SUFFIX = ".idx"
+_MAGIC = b"JSONLIDX"
+_VERSION = 1
+# magic, version, data size, data mtime_ns, line count
+_HEADER = struct.Struct("<8sQQqQ")
+
+
+def index_path_for(file_path):
+    """Sidecar index path for a dataset file"""
+    return str(file_path) + INDEX_SUFFIX
+
+
+def _read_header(index_path):
+    try:
+        with open(index_path, 'rb') as f:
+            header = f.read(_HEADER.size)
+    except OSError:
+        return None
+    if len(header) != _HEADER.size:
+        return None
+    magic, version, size, mtime_ns, count = _HEADER.unpack(header)
+    if magic != _MAGIC or version != _VERSION:
+        return None
+    if os.path.getsize(index_path) != _HEADER.size + 8 * count:
+        return None
+    return size, mtime_ns, count
+
+
+def build_index(file_path, index_path=None):
+    """Scan the dataset once and write its offset index atomically"""
+    index_path = index_path or index_path_for(file_path)
+    stat = os.stat(file_path)
+    tmp_path = f"{index_path}.tmp{os.getpid()}"
+    count = 0
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, 0, 0, 0))
+        offsets = array('Q')
+        for _, offset, _ in iter_lines(file_path):
+            offsets.append(offset)
+            if len(offsets) >= 65536:
+                offsets.tofile(f)
+                count += len(offsets)
+                offsets = array('Q')
+        offsets.tofile(f)
+        count += len(offsets)
+        f.seek(0)
+        f.write(_HEADER.pack(_MAGIC, _VERSION, stat.st_size, stat.st_mtime_ns, count))
+    os.replace(tmp_path, index_path)
+    return index_path
+
+
+class JSONLIndex:
+    """O(1) random access to the records of a JSONL file
+
+    The sidecar index is rebuilt automatically whenever the dataset's size or
+    mtime no longer matches the values recorded in its header.
+    """
+
+    def __init__(self, file_path, index_path=None):
+        if compression_of(file_path):
+            raise ValueError(f"random access needs an uncompressed JSONL file, not {file_path}")
+        self.file_path = str(file_path)
+        self.index_path = index_path or index_path_for(file_path)
+
+        stat = os.stat(self.file_path)
+        header = _read_header(self.index_path)
+        if header is None or header[:2] != (stat.st_size, stat.st_mtime_ns):
+            build_index(self.file_path, self.index_path)
+            header = _read_header(self.index_path)
+        self.size, _, count = header
+
+        if count:
+            self.offsets = np.memmap(self.index_path, dtype='<u8', mode='r',
+                                     offset=_HEADER.size, shape=(count,))
+        else:
+            self.offsets = np.zeros(0, dtype='<u8')
+        with open(self.file_path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+        self._view = memoryview(self._mmap)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _line_end(self, start):
+        end = self._mmap.find(b'\n', start)
+        return self.size if end == -1 else end
+
+    def raw(self, i):
+        """Raw bytes of record i as a zero-copy memoryview"""
+        start = int(self.offsets[i])
+        return self._view[start:self._line_end(start)]
+
+    def lines(self, start, stop):
+        """Zero-copy view over the contiguous bytes of records [start, stop)"""
+        start, stop, _ = slice(start, stop).indices(len(self))
+        if start >= stop:
+            return self._view[0:0]
+        begin = int(self.offsets[start])
+        return self._view[begin:self._line_end(int(self.offsets[stop - 1]))]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return _loads(bytes(self.raw(i)))
+
+    def iter_records(self, indices=None):
+        """Decode records in the given order, reading only those lines"""
+        if indices is None:
+            indices = range(len(self))
+        for i in indices:
+            yield self[int(i)]
+
+    def permutation(self, seed=42):
+        """Shuffled record order for one epoch"""
+        return np.random.default_rng(seed).permutation(len(self))
+
+    def sample(self, n, seed=42):
+        """Sorted indices of n records drawn uniformly without replacement
+
+        Sorted, so reading them walks the file forward once.
+        """
+        return np.sort(self.permutation(seed)[:n])
+
+    def split(self, valid_fraction=0.1, seed=42):
+        """Shuffled (train_indices, valid_indices) without reading any record"""
+        order = self.permutation(seed)
+        n_valid = int(round(len(order) * valid_fraction))
+        return order[n_valid:], order[:n_valid]
+
+    def close(self):
+        self._view.release()
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
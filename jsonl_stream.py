@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Streaming JSONL reader shared by the training and dataset scripts
+
+Files ending in .gz or .zst/.zstd are decompressed (and, by open_jsonl,
+compressed) on the fly, chosen by extension.
+"""
+
+import gzip
+import io
+import json
+import sys
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:  # orjson is optional, the stdlib decoder accepts bytes too
+    orjson = None
+    _loads = json.loads
+
+try:
+    import zstandard
+except ImportError:  # only needed for .zst files
+    zstandard = None
+
+# Read size for each bulk chunk; memory use is bounded by this, not the file size
+CHUNK_SIZE = 1 << 20
+
+_BOM = b'\xef\xbb\xbf'
+GZIP_SUFFIXES = ('.gz',)
+ZSTD_SUFFIXES = ('.zst', '.zstd')
+# gzip level 6 is gzip's own default; zstd 3 is zstd's
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def compression_of(file_path):
+    """'gzip', 'zstd' or None, from the file extension"""
+    name = str(file_path).lower()
+    if name.endswith(GZIP_SUFFIXES):
+        return 'gzip'
+    if name.endswith(ZSTD_SUFFIXES):
+        return 'zstd'
+    return None
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError("reading or writing .zst files needs the zstandard package (pip install zstandard)")
+
+
+def open_jsonl(file_path, mode='rb', buffering=-1):
+    """Open a JSONL file, compressing or decompressing by extension
+
+    mode is 'rb' (a binary stream) or 'w' (a UTF-8 text stream). Compressed
+    streams are not seekable.
+    """
+    compression = compression_of(file_path)
+    if mode == 'rb':
+        if compression == 'gzip':
+            return gzip.open(file_path, 'rb')
+        if compression == 'zstd':
+            _require_zstandard()
+            return zstandard.ZstdDecompressor().stream_reader(open(file_path, 'rb'), closefd=True)
+        return open(file_path, 'rb', buffering=buffering)
+    if mode == 'w':
+        if compression == 'gzip':
+            return io.TextIOWrapper(gzip.open(file_path, 'wb', compresslevel=GZIP_LEVEL), encoding='utf-8')
+        if compression == 'zstd':
+            _require_zstandard()
+            raw = open(file_path, 'wb')
+            writer = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(raw, closefd=True)
+            return io.TextIOWrapper(writer, encoding='utf-8')
+        return open(file_path, 'w', encoding='utf-8', buffering=buffering)
+    raise ValueError(f"unsupported mode {mode!r}")
+
+
+class JSONLDecodeError(ValueError):
+    """Malformed JSONL line, located by line number and byte offset"""
+
+    def __init__(self, file_path, line_number, offset, message):
+        self.file_path = str(file_path)
+        self.line_number = line_number
+        self.offset = offset
+        super().__init__(f"{file_path}:{line_number} (byte {offset}): {message}")
+
+
+def iter_lines(file_path, chunk_size=CHUNK_SIZE, start=0):
+    """Yield (line_number, byte_offset, raw_line) for every non-blank line
+
+    The file is read in fixed-size binary chunks and split on b'\\n', so only
+    one chunk (plus a partial trailing line) is held in memory at a time.
+    Compressed files are decompressed chunk by chunk and offsets refer to
+    the decompressed bytes. start resumes at a byte offset that begins a
+    line (uncompressed files only); line numbers then count from there.
+    """
+    if start and compression_of(file_path):
+        raise ValueError("cannot resume reading a compressed file at a byte offset")
+    offset = start
+    line_number = 0
+    tail = b''
+    with open_jsonl(file_path, 'rb') as f:
+        if start:
+            f.seek(start)
+        chunk = f.read(max(chunk_size, len(_BOM)))
+        if not start and chunk.startswith(_BOM):
+            chunk = chunk[len(_BOM):] or f.read(chunk_size)
+            offset = len(_BOM)
+        while chunk:
+            lines = (tail + chunk).split(b'\n')
+            tail = lines.pop()
+            for line in lines:
+                line_number += 1
+                if line.strip():
+                    yield line_number, offset, line
+                offset += len(line) + 1
+            chunk = f.read(chunk_size)
+    if tail.strip():
+        yield line_number + 1, offset, tail
+
+
+def iter_jsonl(file_path, chunk_size=CHUNK_SIZE, skip_invalid=False):
+    """Yield decoded records from a JSONL file one at a time
+
+    Uses orjson when it is installed. A malformed line raises JSONLDecodeError
+    with its line number and byte offset, or is reported on stderr and skipped
+    when skip_invalid is set.
+    """
+    for line_number, offset, line in iter_lines(file_path, chunk_size):
+        try:
+            yield _loads(line)
+        except ValueError as e:
+            error = JSONLDecodeError(file_path, line_number, offset, e)
+            if not skip_invalid:
+                raise error from None
+            print(f"Skipping malformed line: {error}", file=sys.stderr)
+
+
+def count_records(file_path, chunk_size=CHUNK_SIZE):
+    """Count non-blank lines without decoding them"""
+    return sum(1 for _ in iter_lines(file_path, chunk_size))
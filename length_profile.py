@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Token-length profile and truncation report for choosing max_length
+
+Tokenizes every formatted prompt (untruncated) in batches and, for each
+candidate max_length and batch size, reports how many samples would be cut
+off, how many tokens are lost, and how much of each batch is padding with
+random and with length-grouped batching. Efficiency is the fraction of
+padded batch slots holding real tokens, i.e. throughput relative to a
+padding-free run.
+
+--sample N profiles N records drawn uniformly from an uncompressed file,
+reading only their lines through the JSONLIndex offset index, where --limit
+takes the first N in file order.
+
+Usage:
+    python length_profile.py --model google/gemma-3-1b-it \\
+        --dataset final_training_dataset/kazakh_law_qa_high_quality_20250702_013138.jsonl \\
+        --output length_profile.json
+    python length_profile.py --dataset final_training_dataset/kazakh_law_qa_full_20250702_013138.jsonl \\
+        --sample 2000
+"""
+
+import argparse
+import json
+from itertools import islice
+
+import numpy as np
+
+from batching import LengthGroupedBatchSampler
+from dataset_stats import token_lengths
+from jsonl_index import JSONLIndex
+from jsonl_stream import compression_of, iter_jsonl
+from packing import padding_ratio
+
+MAX_LENGTHS = (256, 512, 768, 1024, 2048)
+BATCH_SIZES = (1, 2, 4, 8)
+HISTOGRAM_BIN = 64
+TOKENIZE_BATCH_SIZE = 1000
+
+
+def corpus_lengths(records, tokenizer, batch_size=TOKENIZE_BATCH_SIZE):
+    """Untruncated prompt token counts of all records, in order"""
+    records = iter(records)
+    parts = []
+    while True:
+        items = list(islice(records, batch_size))
+        if not items:
+            break
+        parts.append(token_lengths(items, tokenizer))
+    return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+
+def length_histogram(lengths, bin_size=HISTOGRAM_BIN):
+    """[(bin start, count)] for non-empty bins of bin_size tokens"""
+    counts = np.bincount(np.asarray(lengths) // bin_size)
+    return [(int(b * bin_size), int(counts[b])) for b in np.flatnonzero(counts)]
+
+
+def grouped_padding_ratio(lengths, batch_size, seed=0):
+    """Padding fraction with LengthGroupedBatchSampler batches"""
+    lengths = np.asarray(lengths)
+    real = padded = 0
+    for batch in LengthGroupedBatchSampler(lengths, batch_size, seed=seed):
+        batch_lengths = lengths[batch]
+        real += int(batch_lengths.sum())
+        padded += int(batch_lengths.max()) * len(batch_lengths)
+    return 1.0 - real / padded if padded else 0.0
+
+
+def truncation_report(lengths, max_lengths=MAX_LENGTHS, batch_sizes=BATCH_SIZES, seed=0):
+    """One row per (max_length, batch_size) candidate"""
+    lengths = np.asarray(lengths)
+    total_tokens = int(lengths.sum())
+    rows = []
+    for max_length in max_lengths:
+        kept = np.minimum(lengths, max_length)
+        truncated = lengths > max_length
+        for batch_size in batch_sizes:
+            random_padding = padding_ratio(kept, batch_size, seed)
+            grouped_padding = grouped_padding_ratio(kept, batch_size, seed)
+            rows.append({
+                "max_length": max_length,
+                "batch_size": batch_size,
+                "truncation_rate": float(truncated.mean()) if len(lengths) else 0.0,
+                "tokens_lost": 1.0 - kept.sum() / total_tokens if total_tokens else 0.0,
+                "padding_random": random_padding,
+                "padding_grouped": grouped_padding,
+                "efficiency_random": 1.0 - random_padding,
+                "efficiency_grouped": 1.0 - grouped_padding,
+            })
+    return rows
+
+
+def recommend(rows, max_truncation, min_efficiency=0.9):
+    """Smallest max_length within the truncation budget, at the largest batch size
+    that keeps length-grouped efficiency at or above min_efficiency
+    """
+    eligible = [r for r in rows if r["truncation_rate"] <= max_truncation]
+    if not eligible:
+        return None
+    smallest = min(r["max_length"] for r in eligible)
+    candidates = [r for r in eligible if r["max_length"] == smallest]
+    efficient = [r for r in candidates if r["efficiency_grouped"] >= min_efficiency]
+    if efficient:
+        return max(efficient, key=lambda r: r["batch_size"])
+    return max(candidates, key=lambda r: r["efficiency_grouped"])
+
+
+def print_table(rows):
+    header = f"{'max_len':>7} {'batch':>5} {'truncated':>9} {'lost':>6} {'pad rand':>8} {'pad group':>9} {'eff group':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(f"{r['max_length']:>7} {r['batch_size']:>5} {r['truncation_rate']:>9.1%} {r['tokens_lost']:>6.1%} "
+              f"{r['padding_random']:>8.1%} {r['padding_grouped']:>9.1%} {r['efficiency_grouped']:>9.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Token-length profile and truncation report")
+    parser.add_argument("--model", default="google/gemma-3-1b-it")
+    parser.add_argument("--dataset", required=True)
+    parser.add_argument("--limit", type=int, default=None, help="profile the first N records")
+    parser.add_argument("--sample", type=int, default=None,
+                        help="profile N records drawn at random (uncompressed files; reads only those lines)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for --sample")
+    parser.add_argument("--max-lengths", type=int, nargs="+", default=list(MAX_LENGTHS))
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=list(BATCH_SIZES))
+    parser.add_argument("--max-truncation", type=float, default=0.01,
+                        help="highest acceptable fraction of truncated samples for the recommendation")
+    parser.add_argument("--min-efficiency", type=float, default=0.9,
+                        help="lowest acceptable real-token fraction with length-grouped batches")
+    parser.add_argument("--output", default=None, help="write the report as JSON")
+    args = parser.parse_args()
+    if args.sample is not None and (args.limit is not None or compression_of(args.dataset)):
+        parser.error("--sample needs an uncompressed dataset and cannot be combined with --limit")
+
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+
+    if args.sample is not None:
+        with JSONLIndex(args.dataset) as index:
+            lengths = corpus_lengths(index.iter_records(index.sample(args.sample, args.seed)), tokenizer)
+    else:
+        lengths = corpus_lengths(islice(iter_jsonl(args.dataset), args.limit), tokenizer)
+    if not len(lengths):
+        print("No records")
+        return
+    percentiles = {f"p{p}": int(np.percentile(lengths, p, method="inverted_cdf")) for p in (50, 90, 95, 99)}
+    print(f"{len(lengths)} samples, mean {lengths.mean():.0f} tokens, "
+          + ", ".join(f"{k} {v}" for k, v in percentiles.items()) + f", max {lengths.max()}")
+
+    histogram = length_histogram(lengths)
+    peak = max(count for _, count in histogram)
+    for start, count in histogram:
+        print(f"{start:>6}-{start + HISTOGRAM_BIN - 1:<6} {count:>6} {'#' * max(1, round(40 * count / peak))}")
+    print()
+
+    rows = truncation_report(lengths, args.max_lengths, args.batch_sizes)
+    print_table(rows)
+    best = recommend(rows, args.max_truncation, args.min_efficiency)
+    if best:
+        print(f"\nRecommended: max_length={best['max_length']}, batch_size={best['batch_size']} "
+              f"({best['truncation_rate']:.1%} truncated, {best['efficiency_grouped']:.1%} efficient with "
+              f"--batching length)")
+    else:
+        print(f"\nNo candidate truncates at most {args.max_truncation:.1%} of samples")
+
+    if args.output:
+        report = {
+            "dataset": args.dataset,
+            "model": args.model,
+            "samples": len(lengths),
+            "sampled": args.sample is not None,
+            "mean": float(lengths.mean()),
+            "max": int(lengths.max()),
+            **percentiles,
+            "histogram": [{"start": start, "count": count} for start, count in histogram],
+            "candidates": rows,
+            "recommended": best,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Analytic peak-memory estimate for LoRA fine-tuning of Gemma 3
+
+Works from the model config and the LoraConfig alone, so it runs before any
+weights are loaded. The estimate is split into frozen base parameters, LoRA
+parameters, their gradients, AdamW state, activations kept for backward
+(every layer's, or with gradient checkpointing the layer inputs plus one
+recomputed layer) and the logits with their float32 loss copies.
+
+--validate compares the estimate with the measured peak of training steps
+on tiny Gemma models on CPU (see batch_finder.PeakMemory).
+
+Usage:
+    python memory_estimate.py --model google/gemma-3-1b-it --batch-size 2 --max-length 512
+    python memory_estimate.py --validate
+"""
+
+import argparse
+import re
+
+import torch
+
+from batch_finder import MEMORY_SAFETY, PeakMemory, device_memory, probe
+
+# peft keeps adapter weights in float32 even on a float16/bfloat16 base model
+LORA_WEIGHT_BYTES = 4
+ADAMW_STATES = 2  # exp_avg, exp_avg_sq
+# A recomputed layer's activations plus the gradients backward creates for
+# them (fitted on tiny CPU models, see --validate)
+RECOMPUTE_FACTOR = 1.25
+# Memory outside the tensors: CUDA context and kernels, or the torch/transformers
+# libraries in a CPU process' resident set
+RUNTIME_OVERHEAD = {"cuda": 512 << 20, "mps": 256 << 20, "cpu": 512 << 20}
+# (TINY_CONFIG overrides, batch size, seq_len, gradient checkpointing) checked by --validate
+VALIDATION_CASES = [
+    ({}, 4, 256, True),
+    ({}, 4, 256, False),
+    ({}, 8, 512, True),
+    ({}, 2, 1024, False),
+    ({"vocab_size": 16384}, 4, 256, True),
+    ({"hidden_size": 256, "intermediate_size": 1024, "num_hidden_layers": 4, "head_dim": 64}, 4, 256, False),
+    ({"hidden_size": 256, "intermediate_size": 1024, "num_hidden_layers": 4, "head_dim": 64}, 8, 256, True),
+]
+
+
+def model_dims(config):
+    """Layer sizes of a Gemma 3 config (or its text_config for multimodal models)"""
+    config = getattr(config, "text_config", None) or config
+    heads = config.num_attention_heads
+    return {
+        "vocab_size": config.vocab_size,
+        "hidden_size": config.hidden_size,
+        "intermediate_size": config.intermediate_size,
+        "num_layers": config.num_hidden_layers,
+        "num_heads": heads,
+        "num_kv_heads": config.num_key_value_heads,
+        "head_dim": getattr(config, "head_dim", None) or config.hidden_size // heads,
+        "tie_word_embeddings": getattr(config, "tie_word_embeddings", True),
+    }
+
+
+def projection_shapes(dims):
+    """{module path within a decoder layer: (in_features, out_features)}"""
+    hidden = dims["hidden_size"]
+    inter = dims["intermediate_size"]
+    q = dims["num_heads"] * dims["head_dim"]
+    kv = dims["num_kv_heads"] * dims["head_dim"]
+    return {
+        "self_attn.q_proj": (hidden, q),
+        "self_attn.k_proj": (hidden, kv),
+        "self_attn.v_proj": (hidden, kv),
+        "self_attn.o_proj": (q, hidden),
+        "mlp.gate_proj": (hidden, inter),
+        "mlp.up_proj": (hidden, inter),
+        "mlp.down_proj": (inter, hidden),
+    }
+
+
+def lora_targets(lora_config, shapes):
+    """Module paths from shapes that the LoraConfig adapts, matched the way peft does"""
+    targets = lora_config.target_modules
+    if targets == "all-linear":
+        return list(shapes)
+    if isinstance(targets, str):  # a regex over the full module name
+        return [path for path in shapes if re.fullmatch(targets, f"model.layers.0.{path}")]
+    return [path for path in shapes if path.rsplit(".", 1)[-1] in targets]
+
+
+def parameter_counts(dims, lora_config):
+    """(base parameters, LoRA parameters)"""
+    shapes = projection_shapes(dims)
+    hidden = dims["hidden_size"]
+    # Four RMSNorms over hidden_size and the q/k norms over head_dim
+    layer = sum(i * o for i, o in shapes.values()) + 4 * hidden + 2 * dims["head_dim"]
+    embeddings = dims["vocab_size"] * hidden * (1 if dims["tie_word_embeddings"] else 2)
+    base = embeddings + dims["num_layers"] * layer + hidden
+    lora = dims["num_layers"] * lora_config.r * sum(sum(shapes[path]) for path in lora_targets(lora_config, shapes))
+    return base, lora
+
+
+def layer_activation_bytes(dims, lora_config, seq_len, dtype_bytes, device="cuda"):
+    """Bytes saved for backward per token by one decoder layer (eager attention)"""
+    shapes = projection_shapes(dims)
+    hidden = dims["hidden_size"]
+    q = dims["num_heads"] * dims["head_dim"]
+    kv = dims["num_kv_heads"] * dims["head_dim"]
+    # RMSNorm upcasts its input to float32 and keeps it: four over hidden, q/k norms
+    norms = 4 * (4 * hidden + q + kv)
+    # Query, key and value (repeated to all heads), softmax output in float32 and
+    # its copy in the compute dtype
+    probs = dims["num_heads"] * seq_len
+    attention = 3 * q * dtype_bytes + probs * 4 + (probs * dtype_bytes if dtype_bytes != 4 else 0)
+    # gelu(gate) keeps gate, gelu(gate) * up keeps both factors
+    mlp = 3 * dims["intermediate_size"] * dtype_bytes
+    # Frozen base projections keep nothing; each adapter keeps its float32 input,
+    # the dropout mask and the rank-r output of lora_A
+    mask_bytes = 0
+    if lora_config.lora_dropout:
+        # Fused dropout keeps a bool mask; on CPU it is a float32 tensor
+        mask_bytes = 4 if device == "cpu" else 1
+    lora = sum((LORA_WEIGHT_BYTES + mask_bytes) * shapes[path][0] + LORA_WEIGHT_BYTES * lora_config.r
+               for path in lora_targets(lora_config, shapes))
+    return norms + attention + mlp + lora
+
+
+def estimate_memory(config, lora_config, batch_size, seq_len, dtype=torch.float16, gradient_checkpointing=True,
+                    device="cuda"):
+    """Peak memory breakdown in bytes for one training step of a LoRA model
+
+    config is the model's config (transformers.AutoConfig), lora_config the
+    peft LoraConfig applied to it; dtype is the base weights' dtype. With
+    gradient checkpointing "total" is less than the sum of the parts, since
+    activations and logits peak at different times.
+    """
+    dims = model_dims(config)
+    dtype_bytes = torch.empty((), dtype=dtype).element_size()
+    base, lora = parameter_counts(dims, lora_config)
+    tokens = batch_size * seq_len
+
+    layer = layer_activation_bytes(dims, lora_config, seq_len, dtype_bytes, device)
+    final_norm = tokens * 4 * dims["hidden_size"]
+    # Logits, the loss's float32 copy and log-softmax output, plus the float32
+    # gradient flowing back into them
+    logits = tokens * dims["vocab_size"] * (dtype_bytes + (4 if dtype_bytes != 4 else 0) + 4 + 4)
+    state = lora * LORA_WEIGHT_BYTES * (1 + ADAMW_STATES)  # gradients and optimizer state
+    if gradient_checkpointing:
+        # Each layer keeps only its input; backward recomputes one layer at a time,
+        # after the logits are freed, so the two do not peak together
+        inputs = tokens * dims["num_layers"] * dims["hidden_size"] * dtype_bytes
+        recomputed = int(tokens * layer * RECOMPUTE_FACTOR)
+        activations = inputs + final_norm + recomputed
+        peak_activations = inputs + final_norm + max(logits, recomputed)
+    else:
+        activations = tokens * dims["num_layers"] * layer + final_norm
+        peak_activations = activations + logits
+
+    breakdown = {
+        "parameters": base * dtype_bytes,
+        "lora_parameters": lora * LORA_WEIGHT_BYTES,
+        "gradients": lora * LORA_WEIGHT_BYTES,
+        "optimizer_states": ADAMW_STATES * lora * LORA_WEIGHT_BYTES,
+        "activations": activations,
+        "logits": logits,
+    }
+    breakdown["total"] = breakdown["parameters"] + breakdown["lora_parameters"] + state + peak_activations
+    return breakdown
+
+
+def preflight(config, lora_config, batch_size, seq_len, device, dtype=torch.float16, gradient_checkpointing=True,
+              memory_limit=None, safety=MEMORY_SAFETY):
+    """estimate_memory plus the runtime overhead, checked against safety * device memory
+
+    Returns the breakdown with "required", "available" and "fits" added.
+    """
+    estimate = estimate_memory(config, lora_config, batch_size, seq_len, dtype, gradient_checkpointing, device)
+    estimate["runtime_overhead"] = RUNTIME_OVERHEAD.get(device, 0)
+    estimate["required"] = estimate["total"] + estimate["runtime_overhead"]
+    estimate["available"] = int(safety * (memory_limit or device_memory(device)))
+    estimate["fits"] = estimate["required"] <= estimate["available"]
+    return estimate
+
+
+def print_breakdown(estimate):
+    for key in ("parameters", "lora_parameters", "gradients", "optimizer_states", "activations", "logits",
+                "runtime_overhead", "required", "available"):
+        if key in estimate:
+            print(f"  {key:<17} {estimate[key] / 2**30:>8.3f} GiB")
+
+
+def validate(cases=VALIDATION_CASES, steps=2):
+    """Estimated vs measured training memory on tiny CPU models
+
+    Measured is the peak resident set during probe() minus the resident set
+    with the model loaded, compared with the estimate minus the parameters.
+    """
+    from tiny_gemma import tiny_peft_gemma
+
+    rows = []
+    for overrides, batch_size, seq_len, checkpointing in cases:
+        model = tiny_peft_gemma(**overrides)
+        if checkpointing:
+            model.gradient_checkpointing_enable(gradient_checkpointing_kwargs={"use_reentrant": False})
+        lora_config = model.peft_config["default"]
+        estimate = estimate_memory(model.config, lora_config, batch_size, seq_len, torch.float32, checkpointing,
+                                   "cpu")
+        base = sum(p.numel() * p.element_size() for p in model.parameters() if not p.requires_grad)
+        lora = sum(p.numel() * p.element_size() for p in model.parameters() if p.requires_grad)
+        probe(model, 1, 8, "cpu", 1)  # warm up kernels and allocator pools
+        with PeakMemory("cpu") as memory:
+            pass
+        peak = probe(model, batch_size, seq_len, "cpu", steps)
+        measured = peak - memory.peak
+        estimated = estimate["total"] - estimate["parameters"] - estimate["lora_parameters"]
+        rows.append({
+            "config": overrides,
+            "batch_size": batch_size,
+            "seq_len": seq_len,
+            "gradient_checkpointing": checkpointing,
+            "parameters_estimated": estimate["parameters"] + estimate["lora_parameters"],
+            "parameters_measured": base + lora,
+            "training_estimated": estimated,
+            "training_measured": measured,
+            "ratio": estimated / measured,
+        })
+        del model
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimate peak memory of LoRA fine-tuning")
+    parser.add_argument("--model", default="google/gemma-3-1b-it")
+    parser.add_argument("--batch-size", type=int, default=2)
+    parser.add_argument("--max-length", type=int, default=512)
+    parser.add_argument("--r", type=int, default=16)
+    parser.add_argument("--target-modules", nargs="+",
+                        default=["q_proj", "k_proj", "v_proj", "o_proj", "gate_proj", "up_proj", "down_proj"])
+    parser.add_argument("--dtype", choices=["float16", "bfloat16", "float32"], default="float16")
+    parser.add_argument("--no-gradient-checkpointing", action="store_true")
+    parser.add_argument("--device", default="cuda", choices=["cuda", "mps", "cpu"])
+    parser.add_argument("--memory-limit-gb", type=float, default=None,
+                        help="memory to check against (default: the device's memory)")
+    parser.add_argument("--validate", action="store_true", help="compare with measured peaks of tiny CPU models")
+    args = parser.parse_args()
+
+    if args.validate:
+        print(f"{'batch':>5} {'seq':>5} {'ckpt':>4} {'params est/meas MB':>19} {'train est MB':>12} "
+              f"{'meas MB':>8} {'ratio':>6}  config")
+        for r in validate():
+            config = ", ".join(f"{k}={v}" for k, v in r["config"].items()) or "tiny"
+            print(f"{r['batch_size']:>5} {r['seq_len']:>5} {'yes' if r['gradient_checkpointing'] else 'no':>4} "
+                  f"{r['parameters_estimated'] / 1e6:>9.1f}/{r['parameters_measured'] / 1e6:<9.1f} "
+                  f"{r['training_estimated'] / 1e6:>12.1f} {r['training_measured'] / 1e6:>8.1f} {r['ratio']:>6.2f}  "
+                  f"{config}")
+        return
+
+    from peft import LoraConfig, TaskType
+    from transformers import AutoConfig
+
+    config = AutoConfig.from_pretrained(args.model)
+    lora_config = LoraConfig(task_type=TaskType.CAUSAL_LM, r=args.r, lora_alpha=2 * args.r, lora_dropout=0.1,
+                             target_modules=args.target_modules, bias="none")
+    memory_limit = int(args.memory_limit_gb * 2**30) if args.memory_limit_gb else None
+    estimate = preflight(config, lora_config, args.batch_size, args.max_length, args.device,
+                         getattr(torch, args.dtype), not args.no_gradient_checkpointing, memory_limit)
+    print(f"{args.model}, r={args.r}, batch {args.batch_size} x {args.max_length} tokens on {args.device}:")
+    print_breakdown(estimate)
+    print("fits" if estimate["fits"] else "does NOT fit")
+
+
+if __name__ == "__main__":
+    main()
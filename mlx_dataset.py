@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Single-pass streaming builder for the MLX train/valid files
+
+Each record is read once, formatted in the Gemma chat format and routed to
+data/train.jsonl or data/valid.jsonl by a stable hash of its content, so the
+split does not depend on record order and duplicates never straddle it.
+Memory use is constant. A manifest next to the outputs records the input
+file and build config; when neither changed the build is skipped. Inputs
+and outputs may be gzip/zstd compressed (by extension, see jsonl_stream);
+mlx_lm itself reads only the uncompressed train/valid files.
+
+Usage:
+    python mlx_dataset.py --dataset final_training_dataset/kazakh_law_qa_full_20250702_013138.jsonl
+"""
+
+import argparse
+import hashlib
+import json
+import os
+from itertools import islice
+
+from jsonl_stream import iter_jsonl, open_jsonl
+from near_dedup import NearDuplicateFilter
+from prompt_format import PROMPT_TEMPLATE, format_prompt
+from subset_sampling import sample_subset
+
+MANIFEST_NAME = ".build_manifest.json"
+WRITE_BUFFER_SIZE = 1 << 20
+_HASH_SPACE = float(1 << 64)
+
+
+def split_fraction(item):
+    """Stable position of a record in [0, 1) derived from its content"""
+    digest = hashlib.blake2b(f"{item['instruction']}\0{item['output']}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') / _HASH_SPACE
+
+
+def _manifest_inputs(dataset_path, config):
+    stat = os.stat(dataset_path)
+    return {
+        "dataset": {"path": os.path.abspath(dataset_path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns},
+        "config": config,
+    }
+
+
+def _load_manifest(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _outputs_intact(manifest, output_dir):
+    for name, size in manifest.get("outputs", {}).items():
+        path = os.path.join(output_dir, name)
+        if not os.path.exists(path) or os.path.getsize(path) != size:
+            return False
+    return bool(manifest.get("outputs"))
+
+
+def build_mlx_dataset(dataset_path, output_dir="data", valid_fraction=0.1, limit=None,
+                      flatten_newlines=False, dedup_threshold=None, sample_size=None, sample_seed=0,
+                      compression=None, force=False):
+    """Stream dataset_path into output_dir/train.jsonl and valid.jsonl
+
+    limit keeps only the first N records; flatten_newlines replaces line
+    breaks inside instruction/output with spaces; dedup_threshold drops
+    records whose estimated Jaccard similarity to an earlier one reaches it;
+    sample_size keeps a quality-weighted, complexity-stratified subset of
+    that many records (see subset_sampling) instead of the first ones;
+    compression ("gz" or "zst") writes train.jsonl.gz etc. for archiving.
+    Returns a stats dict with "train", "valid", "near_duplicates" and
+    "skipped" (True when the outputs were up to date).
+    """
+    config = {
+        "valid_fraction": valid_fraction,
+        "limit": limit,
+        "flatten_newlines": flatten_newlines,
+        "dedup_threshold": dedup_threshold,
+        "sample_size": sample_size,
+        "sample_seed": sample_seed,
+        "compression": compression,
+        "prompt_template": PROMPT_TEMPLATE,
+    }
+    inputs = _manifest_inputs(dataset_path, config)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = _load_manifest(manifest_path)
+    if not force and manifest and manifest.get("inputs") == inputs and _outputs_intact(manifest, output_dir):
+        return {**manifest["counts"], "skipped": True}
+
+    os.makedirs(output_dir, exist_ok=True)
+    if manifest is not None:
+        # Invalidate first so an interrupted rebuild is never mistaken for a complete one
+        os.remove(manifest_path)
+    suffix = f".{compression}" if compression else ""
+    names = {"train": f"train.jsonl{suffix}", "valid": f"valid.jsonl{suffix}"}
+    # The compression suffix stays last so the temporary files are written compressed too
+    tmp_paths = {split: os.path.join(output_dir, f".{name}.tmp{suffix}") for split, name in names.items()}
+    counts = {"train": 0, "valid": 0, "near_duplicates": 0}
+    records = islice(iter_jsonl(dataset_path), limit)
+    dedup = None
+    if dedup_threshold is not None:
+        dedup = NearDuplicateFilter(dedup_threshold)
+        records = dedup.filter(records)
+    if sample_size is not None:
+        records = (item for _, item in sample_subset(records, sample_size, seed=sample_seed))
+
+    files = {split: open_jsonl(path, 'w', buffering=WRITE_BUFFER_SIZE)
+             for split, path in tmp_paths.items()}
+    try:
+        for item in records:
+            instruction, output = item['instruction'], item['output']
+            if flatten_newlines:
+                instruction = instruction.replace('\n', ' ').replace('\r', ' ')
+                output = output.replace('\n', ' ').replace('\r', ' ')
+            split = "valid" if split_fraction(item) < valid_fraction else "train"
+            files[split].write(json.dumps({"text": format_prompt(instruction, output)}, ensure_ascii=False) + '\n')
+            counts[split] += 1
+    finally:
+        for f in files.values():
+            f.close()
+    if dedup is not None:
+        counts["near_duplicates"] = dedup.dropped
+
+    outputs = {}
+    for split, name in names.items():
+        os.replace(tmp_paths[split], os.path.join(output_dir, name))
+        outputs[name] = os.path.getsize(os.path.join(output_dir, name))
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({"inputs": inputs, "outputs": outputs, "counts": counts}, f, ensure_ascii=False, indent=2)
+    return {**counts, "skipped": False}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build MLX train/valid JSONL files")
+    parser.add_argument("--dataset", required=True)
+    parser.add_argument("--output-dir", default="data")
+    parser.add_argument("--valid-fraction", type=float, default=0.1)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--flatten-newlines", action="store_true")
+    parser.add_argument("--dedup-threshold", type=float, default=None,
+                        help="drop near-duplicates at this estimated Jaccard similarity (e.g. 0.8)")
+    parser.add_argument("--sample", type=int, default=None,
+                        help="keep a quality-weighted, complexity-stratified subset of this many records")
+    parser.add_argument("--sample-seed", type=int, default=0)
+    parser.add_argument("--compression", choices=["gz", "zst"], default=None,
+                        help="write compressed train/valid files (for archiving; mlx_lm needs plain JSONL)")
+    parser.add_argument("--force", action="store_true", help="rebuild even if inputs are unchanged")
+    args = parser.parse_args()
+
+    stats = build_mlx_dataset(args.dataset, args.output_dir, args.valid_fraction, args.limit,
+                              args.flatten_newlines, args.dedup_threshold,
+                              args.sample, args.sample_seed, args.compression, args.force)
+    status = "up to date" if stats["skipped"] else "built"
+    print(f"{args.output_dir}: {stats['train']} train, {stats['valid']} valid, "
+          f"{stats.get('near_duplicates', 0)} near-duplicates dropped ({status})")
+
+
+if __name__ == "__main__":
+    main()
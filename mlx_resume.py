@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Crash-safe resumption of mlx_lm.lora runs (no torch required)
+
+mlx_lm.lora saves NNNNNNN_adapters.safetensors every --save-every
+iterations but cannot resume its optimizer or iteration count. A resumed
+run therefore starts from the newest intact adapter file with
+--resume-adapter-file, runs only the remaining iterations and saves into a
+resume-<done> subdirectory, so its own numbering never overwrites the
+earlier files. check_safetensors() is shared with checkpoints.py.
+
+Usage:
+    python mlx_resume.py checkpoints_full
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import struct
+
+_MLX_CHECKPOINT = re.compile(r"(\d+)_adapters\.safetensors$")
+_RESUME_DIR = re.compile(r"resume-(\d+)$")
+
+
+def check_safetensors(path):
+    """Problem with a safetensors file's header and length, or None
+
+    A file cut short while writing has fewer bytes than its header declares.
+    """
+    try:
+        with open(path, 'rb') as f:
+            (header_size,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_size))
+    except (OSError, struct.error, ValueError) as e:
+        return f"unreadable header ({e})"
+    end = max((t["data_offsets"][1] for k, t in header.items() if k != "__metadata__"), default=0)
+    expected = 8 + header_size + end
+    size = os.path.getsize(path)
+    if size != expected:
+        return f"{size} bytes, header declares {expected}"
+    return None
+
+
+def mlx_checkpoints(adapter_path):
+    """[(iteration, path)] of the numbered mlx_lm adapter files, oldest first
+
+    Files in resume-<done> subdirectories count their iterations from done.
+    """
+    found = []
+    if not os.path.isdir(adapter_path):
+        return found
+    dirs = [(0, adapter_path)]
+    for name in os.listdir(adapter_path):
+        match = _RESUME_DIR.match(name)
+        if match and os.path.isdir(os.path.join(adapter_path, name)):
+            dirs.append((int(match.group(1)), os.path.join(adapter_path, name)))
+    for offset, directory in dirs:
+        for name in os.listdir(directory):
+            match = _MLX_CHECKPOINT.match(name)
+            if match:
+                found.append((offset + int(match.group(1)), os.path.join(directory, name)))
+    return sorted(found)
+
+
+def latest_mlx_checkpoint(adapter_path):
+    """(iteration, path) of the newest intact numbered adapter file, or None"""
+    for iteration, path in reversed(mlx_checkpoints(adapter_path)):
+        problem = check_safetensors(path)
+        if problem is None:
+            return iteration, path
+        print(f"Skipping damaged checkpoint {path}: {problem}")
+    return None
+
+
+def mlx_resume_plan(adapter_path, iters, seed=0):
+    """How to continue an mlx_lm.lora run in adapter_path
+
+    Returns a dict with the iterations already done, the remaining iters,
+    the adapter file to resume from (None for a fresh start), the directory
+    to save into and the seed. A resumed segment gets seed + done so it does
+    not replay the first batches of the interrupted run's order.
+    """
+    latest = latest_mlx_checkpoint(adapter_path)
+    if latest is None:
+        return {"done": 0, "iters": iters, "resume_adapter_file": None,
+                "adapter_path": adapter_path, "seed": seed}
+    done, path = latest
+    return {
+        "done": done,
+        "iters": max(iters - done, 0),
+        "resume_adapter_file": path,
+        "adapter_path": os.path.join(adapter_path, f"resume-{done:07d}"),
+        "seed": seed + done,
+    }
+
+
+def finish_mlx_run(plan, adapter_path):
+    """Put the final adapters of a (resumed) run in adapter_path, where loaders look
+
+    plan is the mlx_resume_plan the last segment ran with. When nothing was
+    left to run, the newest numbered checkpoint is the final one.
+    """
+    if plan["iters"] == 0 and plan["resume_adapter_file"]:
+        sources = {"adapters.safetensors": plan["resume_adapter_file"]}
+        segment_path = os.path.dirname(plan["resume_adapter_file"])
+    else:
+        segment_path = plan["adapter_path"]
+        sources = {"adapters.safetensors": os.path.join(segment_path, "adapters.safetensors")}
+    sources["adapter_config.json"] = os.path.join(segment_path, "adapter_config.json")
+    for name, source in sources.items():
+        target = os.path.join(adapter_path, name)
+        if os.path.exists(source) and os.path.abspath(source) != os.path.abspath(target):
+            shutil.copyfile(source, f"{target}.tmp")
+            os.replace(f"{target}.tmp", target)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the newest intact mlx_lm adapter checkpoint")
+    parser.add_argument("adapter_path", help="mlx_lm --adapter-path of the run")
+    args = parser.parse_args()
+
+    for iteration, path in mlx_checkpoints(args.adapter_path):
+        problem = check_safetensors(path)
+        print(f"{iteration:>7} {path} {'OK' if problem is None else problem}")
+    latest = latest_mlx_checkpoint(args.adapter_path)
+    print(f"Resume from: {latest[1] if latest else 'nothing (fresh start)'}")
+
+
+if __name__ == "__main__":
+    main()
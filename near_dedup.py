@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+MinHash/LSH near-duplicate detection over the QA corpus
+
+Every record's normalised instruction + output text is cut into character
+shingles, hashed and reduced to a MinHash signature with NumPy. LSH banding
+puts records whose signatures agree on a whole band into the same bucket;
+only bucket members are compared, so the cost grows with the number of
+records rather than the number of pairs. Candidates are kept when their
+estimated Jaccard similarity reaches the threshold.
+
+Usage:
+    python near_dedup.py --dataset final_training_dataset/kazakh_law_qa_full_20250702_013138.jsonl \\
+        --threshold 0.8 --output near_duplicates.json
+"""
+
+import argparse
+import json
+import re
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from jsonl_stream import iter_jsonl
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+# Texts held in memory at once by the CLI while signatures are computed
+_SIGNATURE_CHUNK = 4096
+
+
+def record_text(item):
+    """Normalised text a record is compared on"""
+    text = f"{item['instruction']} {item['output']}".lower()
+    return _SPACES.sub(" ", _NON_WORD.sub(" ", text)).strip()
+
+
+class MinHasher:
+    """MinHash signatures of character shingles
+
+    Shingles are shingle_size consecutive characters (5 by default, which
+    tolerates rewording and inflection better than word shingles), hashed
+    to 32 bits; each of the num_perm permutations is a random odd-multiplier
+    affine map modulo 2**32. Signatures for many texts are computed as one
+    matrix per batch and reduced per record with np.minimum.reduceat.
+    """
+
+    def __init__(self, num_perm=128, shingle_size=5, seed=1, batch_size=64):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.batch_size = batch_size
+        rng = np.random.default_rng(seed)
+        self._a = (rng.integers(0, 1 << 32, num_perm, dtype=np.uint64) | 1).astype(np.uint32)
+        self._b = rng.integers(0, 1 << 32, num_perm, dtype=np.uint64).astype(np.uint32)
+        self._powers = (rng.integers(0, 1 << 32, shingle_size, dtype=np.uint64) | 1).astype(np.uint32)
+
+    def shingles(self, text):
+        """Unique 32-bit hashes of the text's character shingles"""
+        chars = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+        if len(chars) < self.shingle_size:
+            chars = np.pad(chars, (0, self.shingle_size - len(chars)))
+        windows = sliding_window_view(chars, self.shingle_size)
+        return np.unique(windows @ self._powers)  # wraps modulo 2**32
+
+    def signature(self, text):
+        return self.signatures([text])[0]
+
+    def signatures(self, texts):
+        """(len(texts), num_perm) uint32 signature matrix"""
+        out = np.empty((len(texts), self.num_perm), dtype=np.uint32)
+        for start in range(0, len(texts), self.batch_size):
+            parts = [self.shingles(t) for t in texts[start:start + self.batch_size]]
+            offsets = np.cumsum([0] + [len(p) for p in parts[:-1]])
+            x = np.concatenate(parts)
+            hashed = self._a[:, None] * x[None, :] + self._b[:, None]
+            out[start:start + len(parts)] = np.minimum.reduceat(hashed, offsets, axis=1).T
+        return out
+
+
+def _band_keys(signatures, band, rows):
+    block = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+    return block.view(np.dtype((np.void, block.dtype.itemsize * rows))).ravel()
+
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def find_near_duplicates(signatures, threshold=0.8, bands=16):
+    """Cluster near-duplicate records from their MinHash signatures
+
+    Returns clusters (lists of record indices, smallest first) with more than
+    one member, largest cluster first.
+    """
+    n, num_perm = signatures.shape
+    rows = num_perm // bands
+    parent = np.arange(n)
+    for band in range(bands):
+        _, inverse, counts = np.unique(_band_keys(signatures, band, rows), return_inverse=True, return_counts=True)
+        inverse = inverse.ravel()
+        shared = counts[inverse] > 1
+        if not shared.any():
+            continue
+        members = np.flatnonzero(shared)
+        members = members[np.argsort(inverse[members], kind='stable')]
+        starts = np.flatnonzero(np.diff(inverse[members], prepend=-1))
+        for bucket in np.split(members, starts[1:]):
+            rep = bucket[0]
+            similarity = (signatures[bucket[1:]] == signatures[rep]).mean(axis=1)
+            for j in bucket[1:][similarity >= threshold]:
+                ra, rb = _find(parent, rep), _find(parent, j)
+                if ra != rb:
+                    parent[max(ra, rb)] = min(ra, rb)
+
+    roots = np.array([_find(parent, i) for i in range(n)])
+    clusters = {}
+    for i in np.flatnonzero(roots != np.arange(n)):
+        clusters.setdefault(int(roots[i]), [int(roots[i])]).append(int(i))
+    return sorted(clusters.values(), key=lambda c: (-len(c), c[0]))
+
+
+class NearDuplicateFilter:
+    """Streaming filter that drops records near-duplicating an earlier one
+
+    Keeps one signature per accepted record plus its band keys, so it can
+    run while a dataset is being prepared without a second pass.
+    """
+
+    def __init__(self, threshold=0.8, num_perm=128, bands=16, hasher=None):
+        self.threshold = threshold
+        self.hasher = hasher or MinHasher(num_perm)
+        self.bands = bands
+        self.rows = self.hasher.num_perm // bands
+        self._buckets = [dict() for _ in range(bands)]
+        self._kept = []
+        self.dropped = 0
+
+    def is_duplicate(self, item):
+        """Check a record and remember it if it is new"""
+        sig = self.hasher.signature(record_text(item))
+        keys = [sig[b * self.rows:(b + 1) * self.rows].tobytes() for b in range(self.bands)]
+        for band, key in enumerate(keys):
+            for idx in self._buckets[band].get(key, ()):
+                if (self._kept[idx] == sig).mean() >= self.threshold:
+                    self.dropped += 1
+                    return True
+        idx = len(self._kept)
+        self._kept.append(sig)
+        for band, key in enumerate(keys):
+            self._buckets[band].setdefault(key, []).append(idx)
+        return False
+
+    def filter(self, records):
+        for item in records:
+            if not self.is_duplicate(item):
+                yield item
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find near-duplicate QA records with MinHash/LSH")
+    parser.add_argument("--dataset", required=True)
+    parser.add_argument("--threshold", type=float, default=0.8, help="estimated Jaccard similarity")
+    parser.add_argument("--num-perm", type=int, default=128)
+    parser.add_argument("--bands", type=int, default=16)
+    parser.add_argument("--output", default=None, help="write clusters as JSON")
+    args = parser.parse_args()
+
+    hasher = MinHasher(args.num_perm)
+    instructions = []
+    signatures = []
+    texts = []
+    for item in iter_jsonl(args.dataset):
+        texts.append(record_text(item))
+        instructions.append(item['instruction'][:120])
+        if len(texts) == _SIGNATURE_CHUNK:
+            signatures.append(hasher.signatures(texts))
+            texts = []
+    signatures.append(hasher.signatures(texts))
+    signatures = np.concatenate(signatures)
+    clusters = find_near_duplicates(signatures, args.threshold, args.bands)
+
+    redundant = sum(len(c) - 1 for c in clusters)
+    print(f"{len(signatures)} records, {len(clusters)} near-duplicate clusters, {redundant} redundant records")
+    for cluster in clusters[:10]:
+        print(f"  [{len(cluster)}] {instructions[cluster[0]]}")
+
+    if args.output:
+        report = {
+            "dataset": args.dataset,
+            "threshold": args.threshold,
+            "records": len(signatures),
+            "redundant_records": redundant,
+            "clusters": [{"indices": c, "instruction": instructions[c[0]]} for c in clusters],
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
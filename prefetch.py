@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Background input pipeline settings for the PyTorch training path
+
+With the Trainer defaults every batch is fetched and collated on the main
+process between optimizer steps, so forward/backward waits on Python-side
+padding. prefetch_args() returns the TrainingArguments fields that move
+this into DataLoader worker processes: each worker collates whole batches
+ahead of the step that needs them, at most num_workers * prefetch_factor
+ready batches are queued, and on CUDA a pin-memory thread pins them so the
+host-to-device copy is asynchronous (non_blocking) and overlaps compute.
+
+init_worker() limits each worker to one intra-op thread and lowers its
+priority, so on CPU-only runs the workers fill the queue in the gaps and
+never take cores from the training step's compute threads. The time a
+step still waits for data is data_wait in throughput.jsonl.
+
+Usage:
+    TrainingArguments(..., **prefetch_args(device))
+    dataloader.worker_init_fn = functools.partial(init_worker, previous=dataloader.worker_init_fn)
+"""
+
+import os
+
+import torch
+
+WORKER_NICE = 10
+PREFETCH_FACTOR = 4  # ready batches queued per worker
+
+
+def default_workers(device):
+    """Worker processes for a device: collation is cheap next to a training step"""
+    cpus = os.cpu_count() or 1
+    if device == "cuda":
+        return min(4, max(1, cpus // 2))
+    # CPU and MPS: one worker keeps up; with few cores it only takes time from compute
+    return 1 if cpus >= 4 else 0
+
+
+def prefetch_args(device, num_workers=None, prefetch_factor=PREFETCH_FACTOR):
+    """TrainingArguments fields for a prefetching input pipeline on device
+
+    num_workers=0 keeps loading on the main process (Trainer's default).
+    """
+    if num_workers is None:
+        num_workers = default_workers(device)
+    pin = device == "cuda"  # pinned host memory only speeds up CUDA copies
+    if num_workers == 0:
+        return {"dataloader_num_workers": 0, "dataloader_pin_memory": pin}
+    fields = {
+        "dataloader_num_workers": num_workers,
+        "dataloader_prefetch_factor": prefetch_factor,
+        "dataloader_persistent_workers": True,  # no worker start-up at every epoch and evaluation
+        "dataloader_pin_memory": pin,
+    }
+    if pin:
+        fields["accelerator_config"] = {"non_blocking": True}
+    return fields
+
+
+def init_worker(worker_id, previous=None):
+    """DataLoader worker_init_fn: one thread, lower priority, then previous(worker_id)"""
+    torch.set_num_threads(1)
+    if hasattr(os, "nice"):
+        os.nice(WORKER_NICE)
+    if previous is not None:
+        previous(worker_id)
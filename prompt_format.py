@@ -0,0 +1,13 @@
+#!/usr/bin/env python3
+"""
+Gemma chat prompt format shared by the training and dataset scripts
+"""
+
+PROMPT_TEMPLATE = "<bos><start_of_turn>user\n{instruction}<end_of_turn>\n<start_of_turn>model\n{output}<end_of_turn><eos>"
+# Control tokens of the template; record text containing them literally would end or open turns
+TEMPLATE_TOKENS = ("<bos>", "<eos>", "<start_of_turn>", "<end_of_turn>", "<pad>")
+
+
+def format_prompt(instruction, output):
+    """Format prompt in Gemma chat format"""
+    return PROMPT_TEMPLATE.format(instruction=instruction, output=output)
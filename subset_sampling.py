@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Quality-weighted, complexity-stratified streaming subset sampler
+
+Builds an N-record training subset in a single pass over a JSONL file
+without loading it. Records are grouped by their complexity and each group
+keeps a weighted reservoir (Efraimidis-Spirakis A-Res: key = u ** (1 / w),
+largest keys win) with w = quality_score ** quality_power. At the end the N
+slots are shared between groups in proportion to their observed sizes (or
+to the given proportions), so the subset mirrors the corpus' complexity mix
+while favouring high-quality answers. Memory is bounded by N records per
+complexity level.
+
+Usage:
+    python subset_sampling.py --dataset final_training_dataset/kazakh_law_qa_full_20250702_013138.jsonl \\
+        --size 500 --output data/subset_500.jsonl
+"""
+
+import argparse
+import heapq
+import json
+import math
+import random
+from collections import Counter
+
+from jsonl_stream import iter_jsonl
+
+
+def allocate(counts, size, proportions=None):
+    """Split size slots between strata by largest remainder
+
+    counts maps stratum -> records seen; proportions (stratum -> share)
+    defaults to the observed counts. No stratum gets more than it has, and
+    leftover slots go to strata that still have records.
+    """
+    shares = proportions or counts
+    total = sum(shares.get(s, 0) for s in counts)
+    if not total:
+        return {s: 0 for s in counts}
+    quotas = {s: size * shares.get(s, 0) / total for s in counts}
+    alloc = {s: min(counts[s], int(q)) for s, q in quotas.items()}
+    by_remainder = sorted(counts, key=lambda s: quotas[s] - int(quotas[s]), reverse=True)
+    left = size - sum(alloc.values())
+    while left > 0:
+        open_strata = [s for s in by_remainder if alloc[s] < counts[s]]
+        if not open_strata:
+            break
+        for s in open_strata[:left]:
+            alloc[s] += 1
+            left -= 1
+    return alloc
+
+
+class StratifiedReservoir:
+    """Per-stratum weighted reservoirs filled one record at a time"""
+
+    def __init__(self, size, quality_key="quality_score", stratify_key="complexity",
+                 quality_power=1.0, seed=0):
+        self.size = size
+        self.quality_key = quality_key
+        self.stratify_key = stratify_key
+        self.quality_power = quality_power
+        self.rng = random.Random(seed)
+        self.counts = Counter()
+        self._heaps = {}
+
+    def weight(self, item):
+        return float(item.get(self.quality_key, 1.0)) ** self.quality_power
+
+    def add(self, index, item):
+        stratum = item.get(self.stratify_key)
+        self.counts[stratum] += 1
+        w = self.weight(item)
+        if w <= 0:
+            return
+        # log(u) / w orders records like u ** (1 / w) without underflow for small weights
+        key = math.log(1.0 - self.rng.random()) / w
+        heap = self._heaps.setdefault(stratum, [])
+        if len(heap) < self.size:
+            heapq.heappush(heap, (key, index, item))
+        elif key > heap[0][0]:
+            heapq.heapreplace(heap, (key, index, item))
+
+    def result(self, proportions=None):
+        """[(index, item)] of the subset in file order"""
+        available = {s: len(h) for s, h in self._heaps.items()}
+        alloc = allocate(available, self.size, proportions or {s: self.counts[s] for s in available})
+        chosen = []
+        for stratum, heap in self._heaps.items():
+            # The k largest keys of an A-Res reservoir are an A-Res sample of size k
+            chosen.extend(heapq.nlargest(alloc[stratum], heap))
+        return sorted(((index, item) for _, index, item in chosen), key=lambda pair: pair[0])
+
+
+def sample_subset(records, size, quality_key="quality_score", stratify_key="complexity",
+                  quality_power=1.0, proportions=None, seed=0):
+    """One-pass weighted, stratified sample of size records
+
+    Returns [(index, item)] in the order the records were read, where index
+    is the record's position in records. Records without a quality score
+    weigh 1.0; records with a non-positive weight are never chosen.
+    """
+    reservoir = StratifiedReservoir(size, quality_key, stratify_key, quality_power, seed)
+    for index, item in enumerate(records):
+        reservoir.add(index, item)
+    return reservoir.result(proportions)
+
+
+def subset_summary(sample, quality_key="quality_score", stratify_key="complexity"):
+    """Per-stratum counts and mean quality of a sample"""
+    items = [item for _, item in sample]
+    qualities = [float(item[quality_key]) for item in items if quality_key in item]
+    return {
+        "records": len(items),
+        "strata": dict(Counter(item.get(stratify_key) for item in items)),
+        "mean_quality": sum(qualities) / len(qualities) if qualities else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sample a quality-weighted, complexity-stratified subset")
+    parser.add_argument("--dataset", required=True)
+    parser.add_argument("--size", type=int, required=True)
+    parser.add_argument("--quality-power", type=float, default=1.0,
+                        help="exponent on quality_score; 0 samples uniformly within each stratum")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="write the subset as JSONL")
+    args = parser.parse_args()
+
+    reservoir = StratifiedReservoir(args.size, quality_power=args.quality_power, seed=args.seed)
+    quality_sum = quality_count = 0
+    for index, item in enumerate(iter_jsonl(args.dataset)):
+        reservoir.add(index, item)
+        if "quality_score" in item:
+            quality_sum += float(item["quality_score"])
+            quality_count += 1
+    sample = reservoir.result()
+
+    summary = subset_summary(sample)
+    corpus_quality = quality_sum / quality_count if quality_count else None
+    print(f"{summary['records']} of {sum(reservoir.counts.values())} records sampled")
+    for stratum, count in sorted(reservoir.counts.items(), key=lambda kv: -kv[1]):
+        print(f"  {stratum}: {summary['strata'].get(stratum, 0)} of {count}")
+    if corpus_quality is not None and summary["mean_quality"] is not None:
+        print(f"Mean quality_score: {corpus_quality:.3f} (corpus) -> {summary['mean_quality']:.3f} (subset)")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            for _, item in sample:
+                f.write(json.dumps(item, ensure_ascii=False) + '\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Per-step throughput metrics for transformers' Trainer
+
+ThroughputCallback times every optimizer step without touching the
+training loop: the Trainer's callback events and a forward hook on the
+model mark where data loading, forward, backward and the optimizer start
+and end. Each step is appended to a JSONL file with tokens/sec (real and
+padded), samples/sec, the phase times, peak memory and the padding ratio;
+a summary line is written when training ends. Peak memory is the
+allocator's peak on CUDA, the driver's allocation at the end of the step on
+MPS and, on CPU, the peak resident set during the step (over the whole run
+where the kernel cannot reset it, e.g. macOS).
+
+On CUDA the phases are timed with CUDA events read one step later, so
+timing never waits for the GPU; the times are then GPU time between the
+marks, and data_wait is the time the GPU sat idle waiting for the next
+batch. On CPU and MPS they are host wall-clock times.
+
+Usage:
+    trainer = Trainer(..., callbacks=[ThroughputCallback("throughput.jsonl")])
+    python throughput.py throughput.jsonl    # print the summary of a run
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import torch
+from transformers import TrainerCallback
+
+from batch_finder import _peak_rss, _reset_peak_rss
+
+# Label value of padding (and other ignored) tokens
+IGNORE_INDEX = -100
+PHASES = ("data_wait", "forward", "backward", "optimizer")
+
+
+class _Clock:
+    """Time marks: CUDA events on the current stream, or perf_counter values"""
+
+    def __init__(self, cuda):
+        self.cuda = cuda
+
+    def mark(self):
+        if not self.cuda:
+            return time.perf_counter()
+        event = torch.cuda.Event(enable_timing=True)
+        event.record()
+        return event
+
+    def elapsed(self, start, end):
+        """Seconds between two marks; waits for end on CUDA"""
+        if not self.cuda:
+            return end - start
+        end.synchronize()
+        return start.elapsed_time(end) / 1000
+
+
+def _memory(device):
+    if device.type == "cuda":
+        return torch.cuda.max_memory_allocated(device)
+    if device.type == "mps":
+        return torch.mps.driver_allocated_memory()
+    # Peak resident set since the step began, so activations freed before the step ends still count
+    return _peak_rss()
+
+
+def summarize(steps, warmup_steps=1):
+    """Summary dict over per-step records, skipping the first warmup_steps"""
+    measured = steps[warmup_steps:] or steps
+    if not measured:
+        return {"steps": 0}
+    step_times = np.array([s["step_time"] for s in measured])
+    seconds = float(step_times.sum())
+    real = sum(s["real_tokens"] for s in measured)
+    padded = sum(s["padded_tokens"] for s in measured)
+    summary = {
+        "steps": len(steps),
+        "measured_steps": len(measured),
+        "seconds": seconds,
+        "real_tokens_per_sec": real / seconds,
+        "padded_tokens_per_sec": padded / seconds,
+        "samples_per_sec": sum(s["samples"] for s in measured) / seconds,
+        "padding_ratio": 1.0 - real / padded if padded else 0.0,
+        "step_time_p50": float(np.percentile(step_times, 50)),
+        "step_time_p90": float(np.percentile(step_times, 90)),
+        "peak_memory_bytes": max(s["peak_memory_bytes"] for s in steps),
+    }
+    for phase in PHASES:
+        summary[f"{phase}_fraction"] = sum(s[phase] for s in measured) / seconds
+    return summary
+
+
+class ThroughputCallback(TrainerCallback):
+    """Write per-optimizer-step throughput and time breakdown to a JSONL file
+
+    Real tokens are those with a label, padded tokens every input position.
+    Backward includes gradient clipping; optimizer covers optimizer.step,
+    the scheduler and zero_grad. The first warmup_steps are left out of the
+    summary (kernel selection, allocator growth).
+    """
+
+    def __init__(self, output_path, warmup_steps=1):
+        self.output_path = output_path
+        self.warmup_steps = warmup_steps
+        self.steps = []
+        self.summary = None
+        self._file = None
+        self._hooks = []
+        self._clock = None
+        self._device = None
+        self._pending = None
+        self._idle_since = None  # end of the previous step, or of logging/saving after it
+        self._reset_step()
+
+    def _reset_step(self):
+        self._marks = {"micro": []}  # micro: [(forward start, forward end, backward end)]
+        self._forward_start = None
+        self._samples = 0
+        self._padded = 0
+        self._real = 0
+
+    # Forward hooks: one call per micro-batch on the top-level model
+    def _before_forward(self, module, args, kwargs):
+        if not module.training:
+            return
+        input_ids = kwargs.get("input_ids", args[0] if args else None)
+        labels = kwargs.get("labels")
+        if input_ids is not None:
+            self._samples += input_ids.shape[0]
+            self._padded += input_ids.numel()
+            # Stays on the device; read when the step is resolved
+            self._real = self._real + (labels.ne(IGNORE_INDEX).sum() if labels is not None else input_ids.numel())
+        self._forward_start = self._clock.mark()
+
+    def _after_forward(self, module, args, kwargs, output):
+        if module.training and self._forward_start is not None:
+            self._marks["micro"].append([self._forward_start, self._clock.mark(), None])
+            self._forward_start = None
+
+    def _end_backward(self):
+        if self._marks["micro"] and self._marks["micro"][-1][2] is None:
+            self._marks["micro"][-1][2] = self._clock.mark()
+
+    def on_train_begin(self, args, state, control, model=None, **kwargs):
+        self._device = args.device
+        self._clock = _Clock(self._device.type == "cuda")
+        self._hooks = [
+            model.register_forward_pre_hook(self._before_forward, with_kwargs=True),
+            model.register_forward_hook(self._after_forward, with_kwargs=True),
+        ]
+        if state.is_world_process_zero:
+            os.makedirs(os.path.dirname(self.output_path) or ".", exist_ok=True)
+            self._file = open(self.output_path, 'a', encoding='utf-8')
+        self._idle_since = self._clock.mark()
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        self._reset_step()
+        self._marks["begin"] = self._clock.mark()
+        self._marks["idle_since"] = self._idle_since
+        if self._device.type == "cuda":
+            torch.cuda.reset_peak_memory_stats(self._device)
+        elif self._device.type == "cpu":
+            _reset_peak_rss()
+
+    def on_substep_end(self, args, state, control, **kwargs):
+        self._end_backward()
+
+    def on_pre_optimizer_step(self, args, state, control, **kwargs):
+        self._end_backward()
+        self._marks["optimizer"] = self._clock.mark()
+
+    def on_step_end(self, args, state, control, **kwargs):
+        marks = self._marks
+        marks["end"] = self._idle_since = self._clock.mark()
+        step = {
+            "step": state.global_step,
+            "marks": marks,
+            "samples": self._samples,
+            "padded_tokens": self._padded,
+            "real_tokens": self._real,
+            "peak_memory_bytes": _memory(self._device),
+        }
+        # Resolve the previous step now that its events have long completed
+        self._resolve()
+        self._pending = step
+        self._reset_step()
+
+    def _housekeeping_done(self):
+        # Logging, saving and evaluation after a step are not data loading
+        if self._pending is not None:
+            self._idle_since = self._clock.mark()
+
+    def on_log(self, args, state, control, **kwargs):
+        self._housekeeping_done()
+
+    def on_save(self, args, state, control, **kwargs):
+        self._housekeeping_done()
+
+    def on_evaluate(self, args, state, control, **kwargs):
+        self._housekeeping_done()
+
+    def _resolve(self):
+        if self._pending is None:
+            return
+        step, self._pending = self._pending, None
+        marks = step.pop("marks")
+        elapsed = self._clock.elapsed
+        micro = [m for m in marks["micro"] if m[2] is not None]
+        record = {
+            "step": step["step"],
+            "step_time": elapsed(marks["idle_since"], marks["end"]),
+            "data_wait": elapsed(marks["idle_since"], marks["begin"]),
+            "forward": sum(elapsed(start, end) for start, end, _ in micro),
+            "backward": sum(elapsed(end, backward_end) for _, end, backward_end in micro),
+            "optimizer": elapsed(marks["optimizer"], marks["end"]) if "optimizer" in marks else 0.0,
+            "samples": step["samples"],
+            "padded_tokens": step["padded_tokens"],
+            "real_tokens": int(step["real_tokens"]),
+            "peak_memory_bytes": step["peak_memory_bytes"],
+        }
+        seconds = record["step_time"]
+        record["real_tokens_per_sec"] = record["real_tokens"] / seconds if seconds else 0.0
+        record["padded_tokens_per_sec"] = record["padded_tokens"] / seconds if seconds else 0.0
+        record["samples_per_sec"] = record["samples"] / seconds if seconds else 0.0
+        record["padding_ratio"] = 1.0 - record["real_tokens"] / record["padded_tokens"] if record["padded_tokens"] else 0.0
+        self.steps.append(record)
+        if self._file is not None:
+            self._file.write(json.dumps({"event": "step", **record}) + '\n')
+
+    def on_train_end(self, args, state, control, **kwargs):
+        self._resolve()
+        for hook in self._hooks:
+            hook.remove()
+        self._hooks = []
+        self.summary = summarize(self.steps, self.warmup_steps)
+        if self._file is not None:
+            self._file.write(json.dumps({"event": "summary", **self.summary}) + '\n')
+            self._file.close()
+            self._file = None
+            print_summary(self.summary)
+
+
+def load_metrics(path):
+    """(step records, summary or None) of the last run in a metrics file"""
+    steps = []
+    summary = None
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            event = record.pop("event")
+            if event == "summary":
+                summary = record
+            elif steps and record["step"] <= steps[-1]["step"]:  # a new run appended to the file
+                steps = [record]
+                summary = None
+            else:
+                steps.append(record)
+    return steps, summary
+
+
+def print_summary(summary):
+    if not summary.get("measured_steps"):
+        print("No training steps recorded")
+        return
+    print(f"Throughput over {summary['measured_steps']} steps: {summary['real_tokens_per_sec']:.0f} real tokens/s "
+          f"({summary['padded_tokens_per_sec']:.0f} padded), {summary['samples_per_sec']:.2f} samples/s, "
+          f"padding {summary['padding_ratio']:.1%}")
+    print("Step time: " + ", ".join(f"{phase} {summary[f'{phase}_fraction']:.1%}" for phase in PHASES)
+          + f"; p50 {summary['step_time_p50']:.3f}s, p90 {summary['step_time_p90']:.3f}s")
+    print(f"Peak memory: {summary['peak_memory_bytes'] / 2**30:.2f} GiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a throughput metrics file")
+    parser.add_argument("metrics")
+    parser.add_argument("--warmup-steps", type=int, default=1)
+    args = parser.parse_args()
+    steps, summary = load_metrics(args.metrics)
+    print_summary(summary if summary is not None else summarize(steps, args.warmup_steps))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Tiny Gemma 3-shaped models for CPU runs of the training tools
+
+Same architecture and module names as google/gemma-3-1b-it (so LoRA
+targets, gradient checkpointing and the trainer code paths are exercised),
+with a few million parameters instead of a billion. Used by the probes and
+benchmarks when no GPU or model download is available.
+"""
+
+import torch
+from peft import LoraConfig, TaskType, get_peft_model
+from transformers import Gemma3ForCausalLM, Gemma3TextConfig
+
+TINY_CONFIG = {
+    "vocab_size": 1024,
+    "hidden_size": 64,
+    "intermediate_size": 256,
+    "num_hidden_layers": 2,
+    "num_attention_heads": 2,
+    "num_key_value_heads": 1,
+    "head_dim": 32,
+    "sliding_window": 512,
+    "max_position_embeddings": 4096,
+}
+# Same adapters as fine_tune_gemma_local.py
+LORA_TARGET_MODULES = ["q_proj", "k_proj", "v_proj", "o_proj", "gate_proj", "up_proj", "down_proj"]
+
+
+def tiny_gemma(dtype=torch.float32, seed=0, **overrides):
+    """Randomly initialised Gemma3ForCausalLM; overrides change TINY_CONFIG fields"""
+    config = Gemma3TextConfig(**{**TINY_CONFIG, **overrides})
+    config._attn_implementation = "eager"  # as the trainer loads Gemma 3
+    torch.manual_seed(seed)
+    return Gemma3ForCausalLM(config).to(dtype)
+
+
+def tiny_peft_gemma(r=16, lora_alpha=32, target_modules=LORA_TARGET_MODULES, dtype=torch.float32, seed=0,
+                    **overrides):
+    """tiny_gemma with LoRA applied the way the trainer applies it"""
+    model = tiny_gemma(dtype, seed, **overrides)
+    lora_config = LoraConfig(
+        task_type=TaskType.CAUSAL_LM,
+        inference_mode=False,
+        r=r,
+        lora_alpha=lora_alpha,
+        lora_dropout=0.1,
+        target_modules=list(target_modules),
+        bias="none",
+    )
+    model = get_peft_model(model, lora_config)
+    model.enable_input_require_grads()
+    return model
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Pre-tokenized binary shards for the PyTorch trainer
+
+A shard is a directory with three files:
+    tokens.bin   - every sample's token ids back to back, flat uint32
+    offsets.bin  - uint64 start of each sample in tokens.bin, plus the end
+    meta.json    - tokenizer fingerprint, max_length, prompt template, source
+
+Compile once, then every training run memory-maps the arrays and reads
+samples as zero-copy tensors instead of re-tokenizing the corpus.
+
+Usage:
+    python token_shards.py --model google/gemma-3-1b-it \\
+        --dataset final_training_dataset/kazakh_law_qa_high_quality_20250702_013138.jsonl \\
+        --max-length 512 --limit 500 --output token_shards/high_quality_512
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import multiprocessing
+import shutil
+from array import array
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+
+import numpy as np
+import torch
+
+from jsonl_stream import iter_jsonl
+from prompt_format import PROMPT_TEMPLATE, format_prompt
+from tokenization_cache import DEFAULT_CACHE_PATH, TokenizationCache, cache_namespace, record_hash
+
+SHARD_VERSION = 1
+TOKENIZE_BATCH_SIZE = 1000
+
+
+class StaleShardError(ValueError):
+    """Shard was compiled with a different tokenizer, max_length or source"""
+
+
+def tokenizer_fingerprint(tokenizer):
+    """Stable hash of everything that changes the ids a tokenizer produces"""
+    h = hashlib.sha256()
+    h.update(type(tokenizer).__name__.encode())
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        state = json.loads(backend.to_str())
+        # Truncation/padding are per-call settings the tokenizer remembers, not part of its identity
+        state.pop("truncation", None)
+        state.pop("padding", None)
+        h.update(json.dumps(state, sort_keys=True, ensure_ascii=False).encode())
+    else:
+        h.update(json.dumps(sorted(tokenizer.get_vocab().items()), ensure_ascii=False).encode())
+    h.update(json.dumps(tokenizer.special_tokens_map, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+def source_info(dataset_path, limit=None, sample=None):
+    """Identify the records a shard was compiled from
+
+    sample describes how a subset was drawn (e.g. size and seed) when the
+    shard does not hold the first limit records.
+    """
+    stat = os.stat(dataset_path)
+    info = {
+        "path": os.path.abspath(dataset_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "limit": limit,
+    }
+    if sample is not None:
+        info["sample"] = sample
+    return info
+
+
+def _tokenize(batch, tokenizer, max_length):
+    texts = [format_prompt(item['instruction'], item['output']) for item in batch]
+    return tokenizer(texts, truncation=True, padding=False, max_length=max_length)["input_ids"]
+
+
+# Per-process tokenizer for the worker pool, set once by _init_worker
+_worker_tokenizer = None
+_worker_max_length = None
+
+
+def _init_worker(tokenizer, max_length):
+    global _worker_tokenizer, _worker_max_length
+    # The pool already uses every core; stop the Rust tokenizer oversubscribing them
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    _worker_tokenizer = tokenizer
+    _worker_max_length = max_length
+
+
+def _worker_tokenize(batch):
+    return _tokenize(batch, _worker_tokenizer, _worker_max_length)
+
+
+def iter_token_ids(records, tokenizer, max_length=512, batch_size=TOKENIZE_BATCH_SIZE, cache=None,
+                   num_workers=1, max_in_flight=None):
+    """Format and tokenize records in batches, yielding one id list per record
+
+    With a TokenizationCache only records whose content hash is not cached
+    for this tokenizer/template/max_length are sent to the tokenizer.
+
+    With num_workers > 1 batches are tokenized in a process pool. At most
+    max_in_flight batches (default 2 per worker) are queued at a time and
+    results are yielded in submission order, so the output is identical to
+    the serial path.
+    """
+    records = iter(records)
+    namespace = None
+    if cache is not None:
+        namespace = cache_namespace(tokenizer_fingerprint(tokenizer), PROMPT_TEMPLATE, max_length)
+
+    pool = None
+    if num_workers > 1:
+        pool = ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(tokenizer, max_length),
+        )
+        max_in_flight = max_in_flight or 2 * num_workers
+    else:
+        max_in_flight = 1
+
+    def finish(keys, found, missing, job):
+        fresh = job.result() if isinstance(job, Future) else job
+        if keys is None:
+            return fresh
+        entries = {keys[i]: ids for i, ids in zip(missing, fresh)}
+        if entries:
+            cache.put_many(namespace, entries)
+            found.update(entries)
+        return [found[key] for key in keys]
+
+    pending = deque()
+    try:
+        while True:
+            batch = list(islice(records, batch_size))
+            if not batch:
+                break
+            keys, found, missing = None, None, batch
+            if cache is not None:
+                keys = [record_hash(item) for item in batch]
+                found = cache.get_many(namespace, keys)
+                missing = [i for i, key in enumerate(keys) if key not in found]
+                batch = [batch[i] for i in missing]
+            if not batch:
+                job = []
+            elif pool is not None:
+                job = pool.submit(_worker_tokenize, batch)
+            else:
+                job = _tokenize(batch, tokenizer, max_length)
+            pending.append((keys, found, missing, job))
+            while len(pending) >= max_in_flight:
+                yield from finish(*pending.popleft())
+        while pending:
+            yield from finish(*pending.popleft())
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+
+def compile_shard(records, tokenizer, shard_dir, max_length=512, source=None,
+                  batch_size=TOKENIZE_BATCH_SIZE, cache=None, num_workers=1):
+    """Tokenize records once and write them as a shard directory
+
+    Records are consumed as a stream; the shard is written to a temporary
+    directory and renamed into place, so a crash never leaves a partial shard.
+    """
+    tmp_dir = f"{shard_dir.rstrip(os.sep)}.tmp{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    offsets = array('Q', [0])
+    with open(os.path.join(tmp_dir, "tokens.bin"), 'wb') as f:
+        for ids in iter_token_ids(records, tokenizer, max_length, batch_size, cache, num_workers):
+            np.asarray(ids, dtype='<u4').tofile(f)
+            offsets.append(offsets[-1] + len(ids))
+    with open(os.path.join(tmp_dir, "offsets.bin"), 'wb') as f:
+        np.frombuffer(offsets, dtype=np.uint64).astype('<u8').tofile(f)
+
+    meta = {
+        "version": SHARD_VERSION,
+        "tokenizer_fingerprint": tokenizer_fingerprint(tokenizer),
+        "tokenizer_name": getattr(tokenizer, "name_or_path", ""),
+        "max_length": max_length,
+        "prompt_template": PROMPT_TEMPLATE,
+        "num_samples": len(offsets) - 1,
+        "num_tokens": offsets[-1],
+        "source": source,
+    }
+    with open(os.path.join(tmp_dir, "meta.json"), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    shutil.rmtree(shard_dir, ignore_errors=True)
+    os.makedirs(os.path.dirname(os.path.abspath(shard_dir)), exist_ok=True)
+    os.replace(tmp_dir, shard_dir)
+    return meta
+
+
+def check_shard(meta, tokenizer=None, max_length=None, source=None):
+    """Raise StaleShardError if the shard does not match the current run"""
+    if meta.get("version") != SHARD_VERSION:
+        raise StaleShardError(f"shard version {meta.get('version')} != {SHARD_VERSION}")
+    if meta.get("prompt_template") != PROMPT_TEMPLATE:
+        raise StaleShardError("prompt template changed")
+    if max_length is not None and meta["max_length"] != max_length:
+        raise StaleShardError(f"max_length {meta['max_length']} != {max_length}")
+    if tokenizer is not None and meta["tokenizer_fingerprint"] != tokenizer_fingerprint(tokenizer):
+        raise StaleShardError("tokenizer fingerprint changed")
+    if source is not None and meta.get("source") != source:
+        raise StaleShardError("source dataset changed")
+
+
+class TokenShardDataset(torch.utils.data.Dataset):
+    """Memory-mapped shard; samples are zero-copy uint32 tensor views"""
+
+    def __init__(self, shard_dir):
+        self.shard_dir = shard_dir
+        with open(os.path.join(shard_dir, "meta.json"), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        # Copy-on-write mapping: pages are shared with the file, torch gets a writable view
+        self.offsets = np.memmap(os.path.join(shard_dir, "offsets.bin"), dtype='<u8', mode='r')
+        if self.meta["num_tokens"]:
+            self.tokens = np.memmap(os.path.join(shard_dir, "tokens.bin"), dtype='<u4', mode='c')
+        else:
+            self.tokens = np.zeros(0, dtype='<u4')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def length(self, i):
+        return int(self.offsets[i + 1] - self.offsets[i])
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets).astype(np.int64)
+
+    def __getitem__(self, i):
+        ids = torch.from_numpy(self.tokens[int(self.offsets[i]):int(self.offsets[i + 1])])
+        return {"input_ids": ids}
+
+    def __getstate__(self):
+        # Pickling a memmap copies its data; DataLoader workers started with spawn map the files again
+        return {"shard_dir": self.shard_dir}
+
+    def __setstate__(self, state):
+        self.__init__(state["shard_dir"])
+
+
+def load_shard(shard_dir, tokenizer=None, max_length=None, source=None):
+    """Open a shard, rejecting it if it is stale for this run"""
+    dataset = TokenShardDataset(shard_dir)
+    check_shard(dataset.meta, tokenizer, max_length, source)
+    return dataset
+
+
+class TokenShardCollator:
+    """Right-pad shard samples to the longest in the batch
+
+    Builds attention_mask and labels = input_ids with -100 on padding, as
+    DataCollatorForSeq2Seq does on the tokenized path.
+    """
+
+    def __init__(self, pad_token_id, label_pad_token_id=-100):
+        self.pad_token_id = pad_token_id
+        self.label_pad_token_id = label_pad_token_id
+
+    def __call__(self, features):
+        lengths = [len(f["input_ids"]) for f in features]
+        width = max(lengths)
+        input_ids = torch.full((len(features), width), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(features), width), dtype=torch.long)
+        for row, (f, n) in enumerate(zip(features, lengths)):
+            input_ids[row, :n] = f["input_ids"]
+            attention_mask[row, :n] = 1
+        labels = input_ids.masked_fill(attention_mask == 0, self.label_pad_token_id)
+        return {"input_ids": input_ids, "attention_mask": attention_mask, "labels": labels}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile a JSONL dataset into a token shard")
+    parser.add_argument("--model", default="google/gemma-3-1b-it")
+    parser.add_argument("--dataset", required=True)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--max-length", type=int, default=512)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH,
+                        help="tokenization cache file ('' to disable)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="tokenizer processes (1 = serial)")
+    args = parser.parse_args()
+
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+
+    cache = TokenizationCache(args.cache) if args.cache else None
+    records = islice(iter_jsonl(args.dataset), args.limit)
+    meta = compile_shard(records, tokenizer, args.output, args.max_length,
+                         source=source_info(args.dataset, args.limit), cache=cache,
+                         num_workers=args.workers)
+    print(f"Compiled {meta['num_samples']} samples ({meta['num_tokens']} tokens) into {args.output}")
+    if cache is not None:
+        print(f"Tokenization cache: {cache.hits} hits, {cache.misses} misses")
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Persistent, content-hash-keyed cache of tokenized records
+
+Entries are keyed on (tokenizer fingerprint, prompt template, max_length)
+plus a hash of the record's instruction and output, so after a few records
+are added or corrected only those are tokenized again. The cache is a single
+SQLite file bounded by max_bytes; least recently used entries are evicted
+first, which drops entries from old tokenizers once they stop being read.
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+DEFAULT_CACHE_PATH = "token_shards/tokenization_cache.sqlite"
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+# SQLite's default limit on bound parameters is 999
+_QUERY_CHUNK = 500
+
+
+def cache_namespace(fingerprint, template, max_length):
+    """Key prefix shared by all records tokenized with one configuration"""
+    return hashlib.sha256(f"{fingerprint}\0{template}\0{max_length}".encode()).hexdigest()
+
+
+def record_hash(item):
+    """Hash of the record fields that end up in the prompt"""
+    return hashlib.sha256(f"{item['instruction']}\0{item['output']}".encode()).hexdigest()
+
+
+class TokenizationCache:
+    """SQLite-backed LRU cache of token id lists"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS tokens ("
+            " namespace TEXT NOT NULL,"
+            " record_hash TEXT NOT NULL,"
+            " ids BLOB NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_used INTEGER NOT NULL,"
+            " PRIMARY KEY (namespace, record_hash))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS tokens_last_used ON tokens (last_used)")
+        self.conn.commit()
+        self._bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM tokens").fetchone()[0]
+
+    def get_many(self, namespace, keys):
+        """Return {record_hash: ids} for the cached keys and mark them used"""
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        for start in range(0, len(unique), _QUERY_CHUNK):
+            chunk = unique[start:start + _QUERY_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT record_hash, ids FROM tokens WHERE namespace = ? AND record_hash IN ({placeholders})",
+                [namespace, *chunk],
+            )
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype='<u4').tolist()
+        if found:
+            now = time.time_ns()
+            self.conn.executemany(
+                "UPDATE tokens SET last_used = ? WHERE namespace = ? AND record_hash = ?",
+                [(now, namespace, key) for key in found],
+            )
+            self.conn.commit()
+        hits = sum(1 for key in keys if key in found)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return found
+
+    def put_many(self, namespace, entries):
+        """Store {record_hash: ids} and evict old entries if over budget"""
+        now = time.time_ns()
+        rows = []
+        for key, ids in entries.items():
+            blob = np.asarray(ids, dtype='<u4').tobytes()
+            rows.append((namespace, key, blob, len(blob), now))
+            self._bytes += len(blob)
+        self.conn.executemany("INSERT OR REPLACE INTO tokens VALUES (?, ?, ?, ?, ?)", rows)
+        self.conn.commit()
+        if self._bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits max_bytes"""
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM tokens").fetchone()[0]
+        excess = total - self.max_bytes
+        if excess > 0:
+            doomed = []
+            for rowid, size in self.conn.execute("SELECT rowid, size FROM tokens ORDER BY last_used"):
+                if excess <= 0:
+                    break
+                doomed.append((rowid,))
+                excess -= size
+                total -= size
+            self.conn.executemany("DELETE FROM tokens WHERE rowid = ?", doomed)
+            self.conn.commit()
+            self.evicted += len(doomed)
+        self._bytes = total
+        return self.evicted
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evicted": self.evicted,
+            "bytes": self._bytes,
+        }
+
+    def close(self):
+        self.conn.close()
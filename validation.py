@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Held-out validation split and early stopping for the PyTorch training path
+
+holdout_split() sets aside a fixed random fraction of the tokenized samples.
+A small fixed subsample of it is evaluated every eval_steps (batched,
+no-grad, loss only, batches sorted by length; see
+BatchingTrainer.get_eval_dataloader), so each evaluation costs a few
+seconds and the losses stay comparable across evaluations.
+EarlyStoppingReport, Trainer's EarlyStoppingCallback with a report, stops
+when that loss has not improved for patience evaluations and prints how
+many steps and minutes stopping saved against the planned schedule.
+"""
+
+import time
+
+import numpy as np
+import torch
+from transformers import EarlyStoppingCallback
+
+
+class IndexedSubset(torch.utils.data.Dataset):
+    """Samples of a tokenized dataset at the given indices, with their lengths
+
+    Keeps the lengths attribute the batch samplers and packing read, which
+    torch.utils.data.Subset drops.
+    """
+
+    def __init__(self, dataset, indices):
+        self.dataset = dataset
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.lengths = np.asarray(dataset.lengths)[self.indices]
+
+    def __len__(self):
+        return len(self.indices)
+
+    def length(self, i):
+        return int(self.lengths[i])
+
+    def __getitem__(self, i):
+        return self.dataset[int(self.indices[i])]
+
+
+def holdout_split(dataset, eval_fraction=0.1, eval_samples=None, seed=0):
+    """(train, held-out, evaluation subsample) views of a tokenized dataset
+
+    The split depends only on the dataset size and seed, so a resumed run
+    holds out the same samples. eval_samples caps the subsample evaluated
+    during training (None: the whole held-out set).
+    """
+    order = np.random.default_rng(seed).permutation(len(dataset))
+    n_eval = max(1, round(len(dataset) * eval_fraction))
+    heldout = np.sort(order[:n_eval])
+    train = np.sort(order[n_eval:])
+    subsample = heldout if eval_samples is None else np.sort(order[:min(eval_samples, n_eval)])
+    return IndexedSubset(dataset, train), IndexedSubset(dataset, heldout), IndexedSubset(dataset, subsample)
+
+
+class EarlyStoppingReport(EarlyStoppingCallback):
+    """EarlyStoppingCallback that reports the optimizer steps and wall-clock time it saved
+
+    The saving is the steps left in the planned schedule times this run's
+    average wall time per step, evaluations included. It is only reported
+    when the patience ran out: training can also end short of max_steps
+    when the number of batches per epoch varies (token-budget batching).
+    """
+
+    def __init__(self, early_stopping_patience=1, early_stopping_threshold=0.0):
+        super().__init__(early_stopping_patience, early_stopping_threshold)
+        self.report = None
+        self._start_time = None
+        self._start_step = 0
+        self._eval_seconds = 0.0
+        self._evaluations = 0
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        super().on_train_begin(args, state, control, **kwargs)
+        self._start_time = time.perf_counter()
+        self._start_step = state.global_step  # above 0 when resumed
+
+    def on_evaluate(self, args, state, control, metrics=None, **kwargs):
+        super().on_evaluate(args, state, control, metrics=metrics, **kwargs)
+        if metrics and "eval_runtime" in metrics:
+            self._eval_seconds += metrics["eval_runtime"]
+            self._evaluations += 1
+
+    def on_train_end(self, args, state, control, **kwargs):
+        seconds = time.perf_counter() - self._start_time
+        steps = state.global_step - self._start_step
+        stopped_early = self.early_stopping_patience_counter >= self.early_stopping_patience
+        saved_steps = max(state.max_steps - state.global_step, 0) if stopped_early else 0
+        per_step = seconds / steps if steps else 0.0
+        self.report = {
+            "stopped_early": stopped_early,
+            "global_step": state.global_step,
+            "max_steps": state.max_steps,
+            "saved_steps": saved_steps,
+            "saved_minutes": saved_steps * per_step / 60,
+            "train_minutes": seconds / 60,
+            "evaluations": self._evaluations,
+            "eval_fraction": self._eval_seconds / seconds if seconds else 0.0,
+            "best_metric": state.best_metric,
+            "best_model_checkpoint": state.best_model_checkpoint,
+        }
+        if state.is_world_process_zero:
+            print_report(self.report)
+
+
+def print_report(report):
+    print(f"Validation: {report['evaluations']} evaluations took {report['eval_fraction']:.1%} of "
+          f"{report['train_minutes']:.1f} training minutes; best eval loss {report['best_metric']}")
+    if report["stopped_early"]:
+        print(f"Early stopping at step {report['global_step']}/{report['max_steps']} saved "
+              f"{report['saved_steps']} steps (~{report['saved_minutes']:.1f} minutes)")
+    else:
+        print(f"Trained {report['global_step']} steps; early stopping did not trigger")